@@ -0,0 +1,131 @@
+# coding: utf-8
+# Copyright (c) 2018-2019, Taku MURAKAMI. All rights reserved.
+# Distributed under the terms of the BSD 3-clause License.
+
+import os
+import sys
+import random
+import tracemalloc
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pythroughput.model.modelgenerator import ModelGenerator
+from pythroughput.model.modelanalyser import ModelAnalyser
+
+"""
+Micro-benchmarks of the hot paths of ModelGenerator and ModelAnalyser
+on supercells of Al2O3 (hR30) from 30 to 10,290 atoms, run by pytest-benchmark.
+Peak memory of a call traced by tracemalloc is stored in "extra_info".
+
+Usage
+-----
+> pytest benchmarks/bench_model.py --benchmark-autosave
+> pytest benchmarks/bench_model.py --benchmark-compare --benchmark-compare-fail=median:20%
+"""
+
+CIF = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                   "tests", "inputs", "cif", "Al2O3_hR30_R-3c_167.cif")
+# Diagonal supercells, which are given explicitly to keep the sizes of the benchmarks.
+SCALINGS = ((1, 1, 1), (2, 2, 2), (4, 4, 4), (7, 7, 7))
+MAX_SITES = int(os.environ.get("PYTHROUGHPUT_BENCH_MAX_SITES", 10 ** 5))
+NUM_MODELS = 8
+
+_generators = {}
+
+
+def get_generator(scaling):
+    """
+    Gets the model generator of the supercell, which is shared in the session.
+    """
+    if scaling not in _generators:
+        generator = ModelGenerator(CIF, fmt="cif")
+        generator.struct.make_supercell(scaling)
+        generator.reset_struct()
+        _generators[scaling] = generator
+    generator = _generators[scaling]
+    generator.reset_struct()
+    random.seed(0)
+    return generator
+
+
+def trace_memory(benchmark, function, *args):
+    """
+    Calls the function once with tracemalloc, out of the timed rounds,
+    and stores its peak memory (byte) in benchmark.extra_info.
+    """
+    tracemalloc.start()
+    try:
+        function(*args)
+        benchmark.extra_info["peak_memory"] = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def scalings():
+    return [pytest.param(scaling, id="x".join(str(n) for n in scaling))
+            for scaling in SCALINGS
+            if 30 * scaling[0] * scaling[1] * scaling[2] <= MAX_SITES]
+
+
+@pytest.fixture(params=scalings())
+def generator(request, benchmark):
+    generator = get_generator(request.param)
+    benchmark.extra_info["num_sites"] = generator.struct.num_sites
+    return generator
+
+
+@pytest.mark.benchmark(group="modify_cell")
+def test_modify_cell(benchmark, generator):
+    trace_memory(benchmark, generator.modify_cell, True, -0.01, 0.01)
+    benchmark(generator.modify_cell, True, -0.01, 0.01)
+
+
+@pytest.mark.benchmark(group="modify_atom")
+def test_modify_atom(benchmark, generator):
+    trace_memory(benchmark, generator.modify_atom, 10.0, -0.01, 0.01)
+    benchmark(generator.modify_atom, 10.0, -0.01, 0.01)
+
+
+@pytest.mark.benchmark(group="swap_atom")
+def test_swap_atom(benchmark, generator):
+    trace_memory(benchmark, generator.swap_atom, 10, True)
+    benchmark(generator.swap_atom, 10, True)
+
+
+@pytest.mark.benchmark(group="select_atoms")
+def test_select_atoms(benchmark, generator):
+    pools = generator._swap_pools(True)
+    trace_memory(benchmark, generator.select_atoms, True, pools)
+    benchmark(generator.select_atoms, True, pools)
+
+
+@pytest.mark.benchmark(group="sort_atom")
+def test_sort_atom(benchmark, generator):
+    trace_memory(benchmark, generator.sort_atom)
+    benchmark(generator.sort_atom)
+
+
+@pytest.mark.benchmark(group="get_struct")
+def test_get_struct(benchmark, generator):
+    trace_memory(benchmark, generator.get_struct)
+    benchmark(generator.get_struct)
+
+
+@pytest.mark.benchmark(group="reset_struct")
+def test_reset_struct(benchmark, generator):
+    trace_memory(benchmark, generator.reset_struct)
+    benchmark(generator.reset_struct)
+
+
+@pytest.mark.benchmark(group="calc_euclid_metric")
+def test_calc_euclid_metric(benchmark, generator):
+    structs = {}
+    for i in range(NUM_MODELS):
+        generator.reset_struct()
+        generator.modify_unsymmetrical(modify_shape=True, modify_atom=True)
+        structs["model{}".format(i)] = generator.get_struct()
+    analyser = ModelAnalyser(structs, generator.struct)
+    benchmark.extra_info["num_models"] = NUM_MODELS
+    trace_memory(benchmark, analyser.calc_euclid_metric)
+    benchmark(analyser.calc_euclid_metric)
@@ -0,0 +1,75 @@
+# coding: utf-8
+# Copyright (c) 2018-2019, Taku MURAKAMI. All rights reserved.
+# Distributed under the terms of the BSD 3-clause License.
+
+import os
+import time
+import zlib
+import numpy
+from ase.calculators.calculator import Calculator
+from ase.calculators.calculator import all_changes
+
+"""
+Stand-in of GPAW for benchmarks, which is imported instead of GPAW when
+this directory is put on the head of PYTHONPATH. It sleeps for the time
+given by the cost model (see fake_vasp.py) and returns energy, forces and stress.
+"""
+
+
+class KohnShamConvergenceError(Exception):
+    """
+    Raised when SCF is unconverged.
+    """
+    pass
+
+
+class Mixer(object):
+    """
+    Density mixer, whose arguments are only kept.
+    """
+    
+    def __init__(self, beta=0.25, nmaxold=3, weight=50.0, **kwargs):
+        self.beta = beta
+        self.nmaxold = nmaxold
+        self.weight = weight
+
+
+class GPAW(Calculator):
+    """
+    Stand-in of gpaw.GPAW.
+    """
+    
+    implemented_properties = ["energy", "forces", "stress"]
+    
+    def __init__(self, **kwargs):
+        Calculator.__init__(self, **kwargs)
+        self._iterations = None
+    
+    def set(self, **kwargs):
+        changed = Calculator.set(self, **kwargs)
+        if changed:
+            self.reset()
+        return changed
+    
+    def calculate(self, atoms=None, properties=["energy"], system_changes=all_changes):
+        Calculator.calculate(self, atoms, properties, system_changes)
+        natoms = len(self.atoms)
+        kpts = self.parameters.get("kpts") or {}
+        size = kpts.get("size", (1, 1, 1)) if isinstance(kpts, dict) else kpts
+        cost = float(os.environ.get("FAKE_VASP_SCALE", 1e-6)) * \
+            int(numpy.prod(size)) * natoms ** 3
+        time.sleep(min(cost, float(os.environ.get("FAKE_VASP_MAX_TIME", 10.0))))
+        
+        rng = numpy.random.RandomState(zlib.crc32(self.atoms.cell.array.tobytes(),
+                                                  zlib.crc32(self.atoms.numbers.tobytes())))
+        # The structure is unconverged only without the mixer given by restart.
+        if (rng.rand() < float(os.environ.get("FAKE_VASP_UNCONVERGED", 0.0)) and
+                self.parameters.get("mixer") is None):
+            raise KohnShamConvergenceError("Did not converge!")
+        self._iterations = 12 + rng.randint(0, 8)
+        self.results = {"energy": -3.7 * natoms + rng.uniform(-0.1, 0.1),
+                        "forces": rng.uniform(-0.05, 0.05, (natoms, 3)),
+                        "stress": numpy.zeros(6)}
+    
+    def get_number_of_iterations(self):
+        return self._iterations
@@ -0,0 +1,245 @@
+# coding: utf-8
+# Copyright (c) 2018-2019, Taku MURAKAMI. All rights reserved.
+# Distributed under the terms of the BSD 3-clause License.
+
+import os
+import sys
+import time
+import zlib
+import random
+
+"""
+Stand-in of VASP for benchmarks, which reads POSCAR, INCAR and KPOINTS in
+the current directory, sleeps for the time given by the cost model and writes
+vasprun.xml, OSZICAR and CONTCAR, which are parsed by pymatgen.
+
+Environment variables
+---------------------
+FAKE_VASP_SCALE: float
+    Sleeping time per k-point per site^3 (second). Default: 1e-6
+FAKE_VASP_MAX_TIME: float
+    The upper limit of sleeping time (second). Default: 10
+FAKE_VASP_UNCONVERGED: float
+    Fraction of unconverged SCF, which is decided by the structure. Default: 0
+"""
+
+
+def read_poscar(filename="POSCAR"):
+    """
+    Reads lattice, species and fractional coordinates from POSCAR.
+    """
+    with open(filename) as file:
+        lines = file.read().splitlines()
+    scale = float(lines[1].split()[0])
+    lattice = [[float(x) * scale for x in line.split()[:3]] for line in lines[2:5]]
+    symbols = lines[5].split()
+    counts = [int(x) for x in lines[6].split()]
+    start = 8 if lines[7].strip()[0] not in "sS" else 9
+    species = [symbol for symbol, count in zip(symbols, counts) for i in range(count)]
+    coords = [[float(x) for x in line.split()[:3]]
+              for line in lines[start:start + len(species)]]
+    if lines[start - 1].strip()[0] in "cCkK":
+        inverse = _inverse(lattice)
+        coords = [_dot(coord, inverse) for coord in coords]
+    return lines[0], lattice, symbols, counts, species, coords
+
+
+def read_incar(filename="INCAR"):
+    """
+    Reads INCAR as a dictionary of strings.
+    """
+    incar = {}
+    with open(filename) as file:
+        for line in file.read().replace(";", "\n").splitlines():
+            if "=" in line:
+                key, value = line.split("=", 1)
+                incar[key.strip().upper()] = value.split("#")[0].split("!")[0].strip()
+    return incar
+
+
+def read_kpoints(filename="KPOINTS"):
+    """
+    Reads the size of k-point mesh from KPOINTS.
+    """
+    try:
+        with open(filename) as file:
+            lines = file.read().splitlines()
+        return [int(x) for x in lines[3].split()[:3]]
+    except (OSError, IndexError, ValueError):
+        return [1, 1, 1]
+
+
+def _dot(vector, matrix):
+    return [sum(vector[i] * matrix[i][j] for i in range(3)) for j in range(3)]
+
+
+def _det(m):
+    return (m[0][0] * (m[1][1] * m[2][2] - m[1][2] * m[2][1]) -
+            m[0][1] * (m[1][0] * m[2][2] - m[1][2] * m[2][0]) +
+            m[0][2] * (m[1][0] * m[2][1] - m[1][1] * m[2][0]))
+
+
+def _inverse(m):
+    det = _det(m)
+    return [[(m[(j+1) % 3][(i+1) % 3] * m[(j+2) % 3][(i+2) % 3] -
+              m[(j+1) % 3][(i+2) % 3] * m[(j+2) % 3][(i+1) % 3]) / det
+             for j in range(3)] for i in range(3)]
+
+
+def _varray(name, rows, indent="   "):
+    lines = [indent + '<varray name="{}" >'.format(name)]
+    for row in rows:
+        lines.append(indent + "  <v>" + "".join(" {:16.8f}".format(x) for x in row) + " </v>")
+    lines.append(indent + "</varray>")
+    return lines
+
+
+def _structure(lattice, coords, name=None):
+    head = ' <structure name="{}" >'.format(name) if name is not None else " <structure>"
+    rec = _inverse(lattice)
+    rec = [[rec[j][i] for j in range(3)] for i in range(3)]
+    lines = [head, "  <crystal>"]
+    lines += _varray("basis", lattice, "   ")
+    lines.append('   <i name="volume"> {:16.8f} </i>'.format(abs(_det(lattice))))
+    lines += _varray("rec_basis", rec, "   ")
+    lines.append("  </crystal>")
+    lines += _varray("positions", coords, "  ")
+    lines.append(" </structure>")
+    return lines
+
+
+def _energy(value, indent="   "):
+    return [indent + "<energy>",
+            indent + ' <i name="e_fr_energy"> {:16.8f} </i>'.format(value),
+            indent + ' <i name="e_wo_entrp"> {:16.8f} </i>'.format(value),
+            indent + ' <i name="e_0_energy"> {:16.8f} </i>'.format(value),
+            indent + "</energy>"]
+
+
+def write_outputs(poscar, incar, kpoints, nelm, nsw, unconverged, rng):
+    """
+    Writes vasprun.xml, OSZICAR and CONTCAR.
+    """
+    title, lattice, symbols, counts, species, coords = poscar
+    natoms = len(species)
+    energy = -3.7 * natoms + rng.uniform(-0.1, 0.1)
+    nsteps = 1 if nsw == 0 else min(nsw, 3)
+    nscf = nelm if unconverged else min(nelm - 1, 12 + rng.randint(0, 8))
+    
+    lines = ['<?xml version="1.0" encoding="ISO-8859-1"?>', "<modeling>",
+             " <generator>",
+             '  <i name="program" type="string">vasp </i>',
+             '  <i name="version" type="string">5.4.4.18Apr17-6-g9f103f2a35  </i>',
+             '  <i name="subversion" type="string">(build Jan 01 2019) complex parallel </i>',
+             '  <i name="platform" type="string">LinuxIFC </i>',
+             '  <i name="date" type="string">{} </i>'.format(time.strftime("%Y %m %d")),
+             '  <i name="time" type="string">{} </i>'.format(time.strftime("%H:%M:%S")),
+             " </generator>", " <incar>"]
+    for key, value in sorted(incar.items()):
+        lines.append('  <i type="string" name="{}">{}</i>'.format(key, value))
+    lines += [" </incar>", " <kpoints>", '  <generation param="Gamma">',
+              '   <v type="int" name="divisions">{} {} {} </v>'.format(*kpoints),
+              '   <v name="usershift">      0.00000000       0.00000000       0.00000000 </v>',
+              '   <v name="genvec1">      1.00000000       0.00000000       0.00000000 </v>',
+              '   <v name="genvec2">      0.00000000       1.00000000       0.00000000 </v>',
+              '   <v name="genvec3">      0.00000000       0.00000000       1.00000000 </v>',
+              '   <v name="shift">      0.00000000       0.00000000       0.00000000 </v>',
+              "  </generation>"]
+    lines += _varray("kpointlist", [[0.0, 0.0, 0.0]], "  ")
+    lines += _varray("weights", [[1.0]], "  ")
+    lines += [" </kpoints>", " <parameters>",
+              '  <separator name="electronic" >',
+              '   <i type="string" name="PREC">normal</i>',
+              '   <i name="ENMAX">    400.00000000</i>',
+              '   <i name="NELECT">     {:.8f}</i>'.format(3.0 * natoms),
+              '   <i type="int" name="ISPIN">     1</i>',
+              '   <separator name="electronic convergence" >',
+              '    <i type="int" name="NELM">    {}</i>'.format(nelm),
+              '    <i name="EDIFF">      0.00010000</i>',
+              "   </separator>",
+              "  </separator>",
+              '  <separator name="ionic" >',
+              '   <i type="int" name="NSW">    {}</i>'.format(nsw),
+              '   <i type="int" name="IBRION">     {}</i>'.format(incar.get("IBRION", "1")),
+              '   <i type="int" name="ISIF">     {}</i>'.format(incar.get("ISIF", "3")),
+              '   <i name="EDIFFG">     -0.01000000</i>',
+              "  </separator>",
+              " </parameters>", " <atominfo>",
+              "  <atoms>{}</atoms>".format(natoms),
+              "  <types>{}</types>".format(len(symbols)),
+              '  <array name="atoms" >',
+              '   <dimension dim="1">ion</dimension>',
+              '   <field type="string">element</field>',
+              '   <field type="int">atomtype</field>', "   <set>"]
+    for specie in species:
+        lines.append("    <rc><c>{:2s}</c><c>   {}</c></rc>".format(
+            specie, symbols.index(specie) + 1))
+    lines += ["   </set>", "  </array>", '  <array name="atomtypes" >',
+              '   <dimension dim="1">type</dimension>',
+              '   <field type="int">atomspertype</field>',
+              '   <field type="string">element</field>',
+              "   <field>mass</field>", "   <field>valence</field>",
+              '   <field type="string">pseudopotential</field>', "   <set>"]
+    for symbol, count in zip(symbols, counts):
+        lines.append("    <rc><c>{:4d}</c><c>{:2s}</c><c>     1.00000000</c>"
+                     "<c>      3.00000000</c><c>  PAW_PBE {} 01Jan2000  </c></rc>".format(
+                         count, symbol, symbol))
+    lines += ["   </set>", "  </array>", " </atominfo>"]
+    lines += _structure(lattice, coords, "initialpos")
+    
+    oszicar = []
+    for step in range(nsteps):
+        step_energy = energy + 0.05 / (step + 1)
+        lines.append(" <calculation>")
+        for iteration in range(nscf):
+            lines += ["  <scstep>"] + _energy(step_energy + 10.0 ** -(iteration % 8), "   ")
+            lines.append("  </scstep>")
+            oszicar.append("DAV: {:3d}    {:.8E}   {:.5E}".format(
+                iteration + 1, step_energy, 10.0 ** -(iteration % 8)))
+        lines += ["  <scstep>"] + _energy(step_energy, "   ") + ["  </scstep>"]
+        lines += _structure(lattice, coords)
+        lines += _varray("forces", [[rng.uniform(-0.05, 0.05) for i in range(3)]
+                                    for j in range(natoms)], "  ")
+        lines += _varray("stress", [[rng.uniform(-1.0, 1.0) for i in range(3)]
+                                    for j in range(3)], "  ")
+        lines += _energy(step_energy, "  ")
+        lines.append(" </calculation>")
+        oszicar.append("{:4d} F= {:.8E} E0= {:.8E}  d E ={:.6E}".format(
+            step + 1, step_energy, step_energy, step_energy - energy))
+    lines += _structure(lattice, coords, "finalpos")
+    lines.append("</modeling>")
+    
+    with open("vasprun.xml", mode="w") as file:
+        file.write("\n".join(lines) + "\n")
+    with open("OSZICAR", mode="w") as file:
+        file.write("\n".join(oszicar) + "\n")
+    with open("CONTCAR", mode="w") as file:
+        file.write("\n".join([title, "1.0"] +
+                             [" ".join("{:.10f}".format(x) for x in row) for row in lattice] +
+                             [" ".join(symbols), " ".join(str(count) for count in counts),
+                              "Direct"] +
+                             [" ".join("{:.10f}".format(x) for x in coord)
+                              for coord in coords]) + "\n")
+
+
+def main():
+    poscar = read_poscar()
+    incar = read_incar()
+    kpoints = read_kpoints()
+    natoms = len(poscar[4])
+    nelm = int(incar.get("NELM", 60))
+    nsw = int(incar.get("NSW", 0))
+    seed = zlib.crc32(open("POSCAR", mode="rb").read())
+    rng = random.Random(seed)
+    # The structure is unconverged only in the first attempt, so restarts succeed.
+    unconverged = (rng.random() < float(os.environ.get("FAKE_VASP_UNCONVERGED", 0.0)) and
+                   incar.get("ALGO", "VeryFast").lower() == "veryfast")
+    cost = float(os.environ.get("FAKE_VASP_SCALE", 1e-6)) * \
+        kpoints[0] * kpoints[1] * kpoints[2] * natoms ** 3
+    time.sleep(min(cost, float(os.environ.get("FAKE_VASP_MAX_TIME", 10.0))))
+    write_outputs(poscar, incar, kpoints, nelm, nsw, unconverged, rng)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
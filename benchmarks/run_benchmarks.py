@@ -0,0 +1,251 @@
+# coding: utf-8
+# Copyright (c) 2018-2019, Taku MURAKAMI. All rights reserved.
+# Distributed under the terms of the BSD 3-clause License.
+
+import os
+import sys
+import time
+import json
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+"""
+Orchestration benchmarks of pythroughput with the stand-in of VASP or GPAW,
+which run on a plain Linux box with no DFT licence.
+
+Wall time and overhead per job of PyHighThroughput.run(), PyHighThroughput.read(),
+AtomizationCalculator and PyThroughCsv are measured for each number of structures,
+and written to "benchmarks/results/(timestamp).json", which is compared with
+the baseline by --compare.
+
+Usage
+-----
+> python benchmarks/run_benchmarks.py --sizes 100 10000 100000
+> python benchmarks/run_benchmarks.py --sizes 100 --compare benchmarks/results/baseline.json
+"""
+
+BENCHMARKS_PATH = os.path.dirname(os.path.abspath(__file__))
+PHASES = ("run", "read", "atomization", "csv")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 10000, 100000],
+                        help="Numbers of structures.")
+    parser.add_argument("--package", default="vasp", choices=["vasp", "gpaw"],
+                        help="First-principles calculation package.")
+    parser.add_argument("--phases", nargs="+", default=list(PHASES), choices=PHASES,
+                        help="Measured phases.")
+    parser.add_argument("--scale", type=float, default=0.0,
+                        help="Sleeping time of the stand-in per k-point per site^3 (second).")
+    parser.add_argument("--unconverged", type=float, default=0.0,
+                        help="Fraction of unconverged structures.")
+    parser.add_argument("--restart", action="store_true",
+                        help="Unconverged structures are restarted by RestartLadder.")
+    parser.add_argument("--scratch", default=None,
+                        help="Node-local scratch given to PyHighThroughput.")
+    parser.add_argument("--shard", action="store_true",
+                        help="Sharded output layout with the manifest.")
+    parser.add_argument("--output", default=os.path.join(BENCHMARKS_PATH, "results"),
+                        help="Directory of the results.")
+    parser.add_argument("--compare", default=None,
+                        help="Results of the baseline compared with.")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Allowed relative regression of time per job.")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def setup_environment(args):
+    """
+    Puts the stand-ins on the head of PATH (and PYTHONPATH for GPAW).
+    """
+    os.environ["PATH"] = os.path.join(BENCHMARKS_PATH, "bin") + os.pathsep + os.environ["PATH"]
+    os.environ["PYTHON"] = sys.executable
+    os.environ["FAKE_VASP_SCALE"] = str(args.scale)
+    os.environ["FAKE_VASP_UNCONVERGED"] = str(args.unconverged)
+    if args.package == "gpaw":
+        sys.path.insert(0, os.path.join(BENCHMARKS_PATH, "fake_gpaw"))
+    sys.path.insert(0, os.path.dirname(BENCHMARKS_PATH))
+
+
+def write_potentials(path):
+    """
+    Writes the database of pseudo-potentials read by Calculation_vasp.
+    """
+    os.makedirs(os.path.join(path, "Al"), exist_ok=True)
+    with open(os.path.join(path, "db_recommended_paw.csv"), mode="w") as file:
+        file.write("Al\tAl\n")
+    with open(os.path.join(path, "Al", "POTCAR"), mode="w") as file:
+        file.write("  PAW_PBE Al 04Jan2001\n   3.00000000000000\n")
+    return path + os.sep
+
+
+def make_structs(num, seed=0):
+    """
+    Makes structures of 1, 4 and 8 sites with perturbed lattices.
+    """
+    import numpy
+    import pymatgen
+    rng = numpy.random.RandomState(seed)
+    fcc = pymatgen.Structure(pymatgen.Lattice.cubic(4.05), ["Al"] * 4,
+                             [[0, 0, 0], [0.5, 0.5, 0], [0.5, 0, 0.5], [0, 0.5, 0.5]])
+    templates = [fcc.get_primitive_structure(), fcc, fcc * (2, 1, 1)]
+    structs = {}
+    for i in range(num):
+        template = templates[i % len(templates)]
+        strain = numpy.eye(3) + rng.uniform(-0.02, 0.02, (3, 3))
+        lattice = pymatgen.Lattice(numpy.dot(template.lattice.matrix, strain))
+        structs["Al{}_{:06d}".format(len(template), i)] = pymatgen.Structure(
+            lattice, template.species, template.frac_coords)
+    return structs
+
+
+def get_sleep_time(costs, scale):
+    """
+    Gets total sleeping time of the stand-in from the cost model.
+    """
+    max_time = float(os.environ.get("FAKE_VASP_MAX_TIME", 10.0))
+    return sum(min(cost * scale, max_time) for cost in costs.values())
+
+
+def measure(function):
+    start = time.perf_counter()
+    value = function()
+    return time.perf_counter() - start, value
+
+
+def run_size(num, args, path):
+    """
+    Runs the benchmarks of the number of structures.
+    """
+    from pythroughput.core.calculation import PyHighThroughput
+    from pythroughput.core.atomization import AtomizationCalculator
+    from pythroughput.core.restart import RestartLadder, is_unconverged
+    from pythroughput.outputs.pythroughcsv import PyThroughCsv
+    
+    structs = make_structs(num, args.seed)
+    input_path = write_potentials(os.path.join(path, "potentials"))
+    output_path = os.path.join(path, "outputs") + os.sep
+    os.makedirs(output_path, exist_ok=True)
+    report = {"num_structs": num}
+    
+    def new_calculation():
+        return PyHighThroughput(input_path=input_path, output_path=output_path,
+                                scratch_path=args.scratch, shard=args.shard,
+                                restart=RestartLadder() if args.restart is True else None,
+                                **structs)
+    
+    calculation = new_calculation()
+    seconds, results = measure(lambda: calculation.run(package=args.package))
+    sleep = get_sleep_time(calculation.costs, args.scale)
+    report["run"] = {"seconds": seconds, "per_job": seconds / num,
+                     "overhead_per_job": (seconds - sleep) / num,
+                     "unconverged": sum(1 for result in results.values()
+                                        if is_unconverged(dict(result.items()))),
+                     "restarts": len(calculation.restarts)}
+    
+    if "read" in args.phases and args.package == "vasp":
+        calculation = new_calculation()
+        seconds, read_results = measure(lambda: calculation.read(package=args.package))
+        report["read"] = {"seconds": seconds, "per_job": seconds / num}
+    
+    if "atomization" in args.phases:
+        # Formula is not in the results of VASP calculation.
+        table = {struct_name: {"formula": structs[struct_name].formula,
+                               "total_energy": result["total_energy"]}
+                 for struct_name, result in results.items()
+                 if result.get("total_energy") is not None and
+                 not isinstance(result["total_energy"], str)}
+        atomization = AtomizationCalculator(table, ["Al"])
+        seconds, value = measure(lambda: atomization.get_atomization_energy(
+            package=args.package, input_path=input_path))
+        report["atomization"] = {"seconds": seconds, "per_job": seconds / max(len(table), 1)}
+    
+    if "csv" in args.phases:
+        filename = os.path.join(path, "results.csv")
+        seconds, value = measure(lambda: PyThroughCsv(filename, results).write_values())
+        report["csv"] = {"seconds": seconds, "per_job": seconds / num}
+    return report
+
+
+def get_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=BENCHMARKS_PATH,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              universal_newlines=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(report, baseline, threshold):
+    """
+    Compares time per job with the baseline.
+    
+    Returns
+    -------
+    regressions: list
+        (number of structures, phase, ratio) slower than the threshold.
+    """
+    regressions = []
+    for size, phases in report["sizes"].items():
+        for phase, values in phases.items():
+            try:
+                base = baseline["sizes"][size][phase]["per_job"]
+            except (KeyError, TypeError):
+                continue
+            ratio = values["per_job"] / base if base > 0 else 1.0
+            print("{:>8s} {:12s} {:10.3e} s/job  x{:.2f}".format(size, phase,
+                                                                  values["per_job"], ratio))
+            if ratio > 1.0 + threshold:
+                regressions.append((size, phase, ratio))
+    return regressions
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    setup_environment(args)
+    report = {"timestamp": time.strftime("%Y%m%dT%H%M%S"),
+              "revision": get_revision(),
+              "python": platform.python_version(),
+              "platform": platform.platform(),
+              "package": args.package,
+              "scale": args.scale,
+              "unconverged": args.unconverged,
+              "sizes": {}}
+    cwd = os.getcwd()
+    for num in args.sizes:
+        path = tempfile.mkdtemp(prefix="pythroughput-benchmark-")
+        # Input files of VASP are written to the current directory.
+        os.chdir(path)
+        try:
+            sizes = run_size(num, args, path)
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(path, ignore_errors=True)
+        phases = {phase: sizes[phase] for phase in PHASES if phase in sizes}
+        report["sizes"][str(num)] = phases
+        for phase, values in phases.items():
+            print("{:>8d} {:12s} {:10.3f} s {:10.3e} s/job".format(
+                num, phase, values["seconds"], values["per_job"]))
+    
+    os.makedirs(args.output, exist_ok=True)
+    filename = os.path.join(args.output, report["timestamp"] + ".json")
+    with open(filename, mode="w") as file:
+        json.dump(report, file, indent=2)
+    print("Results are written to " + filename)
+    
+    if args.compare is not None:
+        with open(args.compare) as file:
+            regressions = compare(report, json.load(file), args.threshold)
+        for size, phase, ratio in regressions:
+            print("Regression: {} of {} structures is x{:.2f} slower.".format(phase, size, ratio))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
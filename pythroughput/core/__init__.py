@@ -3,4 +3,16 @@
 # Distributed under the terms of the BSD 3-clause License.
 
 from . import calculation
-from . import calculation_vasp
\ No newline at end of file
+from . import calculation_vasp
+from . import sources
+from . import structurecache
+from . import costmodel
+from . import geometry
+from . import archive
+from . import stageout
+from . import restart
+from . import tracer
+from . import mpigroups
+from . import paralleltuning
+from . import throughput
+from . import prioritizer
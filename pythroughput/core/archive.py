@@ -0,0 +1,391 @@
+# coding: utf-8
+# Copyright (c) 2018-2019, Taku MURAKAMI. All rights reserved.
+# Distributed under the terms of the BSD 3-clause License.
+
+import logging
+import os
+import io
+import codecs
+import gzip
+import shutil
+import tarfile
+import tempfile
+import contextlib
+from pymatgen.io.vasp.outputs import Vasprun
+try:
+    import zstandard
+except ModuleNotFoundError:
+    zstandard = None
+
+"""
+Compressed archival of output files, which are read transparently.
+"""
+
+logger = logging.getLogger(__name__)
+
+# Suffix of compressed files by each method.
+SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def _check_method(method):
+    """
+    Checks if the compression method is available.
+    """
+    if method not in SUFFIXES:
+        raise ValueError("Unknown compression method: " + str(method))
+    if method == "zstd" and zstandard is None:
+        raise ModuleNotFoundError("zstandard is required for zstd compression.")
+
+
+def _get_method(filename):
+    """
+    Gets the compression method from the suffix of the file, or None.
+    """
+    for method, suffix in SUFFIXES.items():
+        if filename.endswith(suffix):
+            return method
+    return None
+
+
+def open_compressed(filename, mode="rb", method=None, level=None):
+    """
+    Opens a compressed file as a stream, which is not decompressed at once.
+    
+    Arguments
+    ---------
+    filename: str
+        Path to the file.
+    mode: str
+        "rb", "wb", "rt" or "wt".
+    method: str or None
+        "gzip" or "zstd". When it is None, it is given by the suffix of the file.
+    level: int or None
+        Compression level, which is the default of the method when it is None.
+    
+    Returns
+    -------
+    file object
+        Stream of decompressed (or compressed) data.
+    """
+    if method is None:
+        method = _get_method(filename)
+    if method is None:
+        return open(filename, mode=mode)
+    _check_method(method)
+    writing = "w" in mode
+    if method == "gzip":
+        if writing:
+            file = gzip.open(filename, mode="wb", compresslevel=level or 6)
+        else:
+            file = gzip.open(filename, mode="rb")
+    elif writing:
+        compressor = zstandard.ZstdCompressor(level=level or 3)
+        file = compressor.stream_writer(open(filename, mode="wb"), closefd=True)
+    else:
+        file = zstandard.ZstdDecompressor().stream_reader(open(filename, mode="rb"),
+                                                          closefd=True)
+    if "t" in mode:
+        return io.TextIOWrapper(file, encoding="utf-8")
+    return file
+
+
+def move_file(source, target):
+    """
+    Moves a file by rename, or by copy when it is on the other file system.
+    The target appears atomically.
+    
+    Arguments
+    ---------
+    source: str
+        Path to the source file.
+    target: str
+        Path to the target file.
+    """
+    try:
+        os.replace(source, target)
+    except OSError:
+        temporary = target + ".part"
+        shutil.copyfile(source, temporary)
+        os.replace(temporary, target)
+        os.remove(source)
+
+
+def compress_file(source, target, method="gzip", level=None):
+    """
+    Compresses a file and removes the source. The target appears atomically.
+    
+    Arguments
+    ---------
+    source: str
+        Path to the source file.
+    target: str
+        Path to the compressed file, e.g. "vasprun.xml.gz".
+    method: str
+        "gzip" or "zstd".
+    level: int or None
+        Compression level.
+    """
+    temporary = target + ".part"
+    with open(source, mode="rb") as file:
+        with open_compressed(temporary, mode="wb", method=method, level=level) as compressed:
+            shutil.copyfileobj(file, compressed, CHUNK_SIZE)
+    os.replace(temporary, target)
+    os.remove(source)
+
+
+def get_archive_path(path, method="gzip"):
+    """
+    Gets the path to the archive packing the directory.
+    
+    Arguments
+    ---------
+    path: str
+        Output directory.
+    method: str
+        "gzip" or "zstd".
+    
+    Returns
+    -------
+    str
+        e.g. "(output directory).tar.gz".
+    """
+    return os.path.normpath(path) + ".tar" + SUFFIXES[method]
+
+
+def find_archive(path):
+    """
+    Finds the archive packing the directory.
+    
+    Arguments
+    ---------
+    path: str
+        Output directory.
+    
+    Returns
+    -------
+    str or None
+        Path to the archive, or None if it is not found.
+    """
+    for method in SUFFIXES:
+        archive_path = get_archive_path(path, method)
+        if os.path.exists(archive_path):
+            return archive_path
+    return None
+
+
+def pack_directory(path, method="gzip", level=None):
+    """
+    Packs the files in the directory into one compressed archive,
+    and removes the directory. The archive appears atomically.
+    
+    Arguments
+    ---------
+    path: str
+        Output directory.
+    method: str
+        "gzip" or "zstd".
+    level: int or None
+        Compression level.
+    
+    Returns
+    -------
+    archive_path: str
+        Path to the archive.
+    """
+    _check_method(method)
+    archive_path = get_archive_path(path, method)
+    temporary = archive_path + ".part"
+    with open_compressed(temporary, mode="wb", method=method, level=level) as file:
+        with tarfile.open(fileobj=file, mode="w|") as tar:
+            for name in sorted(os.listdir(path)):
+                tar.add(os.path.join(path, name), arcname=name)
+    os.replace(temporary, archive_path)
+    shutil.rmtree(path)
+    return archive_path
+
+
+@contextlib.contextmanager
+def open_output(path, name, mode="rb"):
+    """
+    Opens an output file, which is found as it is, compressed,
+    or in the archive packing the directory, as a decompressed stream.
+    
+    Arguments
+    ---------
+    path: str
+        Output directory.
+    name: str
+        Name of the file, e.g. "vasprun.xml".
+    mode: str
+        "rb" or "rt".
+    
+    Yields
+    ------
+    file object
+        Stream of the file.
+    """
+    filename = find_output(path, name)
+    if filename is None:
+        archive_path = find_archive(path)
+        if archive_path is None:
+            raise FileNotFoundError(os.path.join(path, name))
+        with open_compressed(archive_path, mode="rb") as file:
+            # Archives are read as streams, in which members are found in order.
+            with tarfile.open(fileobj=file, mode="r|") as tar:
+                for member in tar:
+                    if member.name == name:
+                        stream = tar.extractfile(member)
+                        if "t" in mode:
+                            # Streamed members are not seekable for io.TextIOWrapper.
+                            stream = codecs.getreader("utf-8")(stream)
+                        yield stream
+                        return
+        raise FileNotFoundError(os.path.join(archive_path, name))
+    with open_compressed(filename, mode=mode) as file:
+        yield file
+
+
+def find_output(path, name):
+    """
+    Finds an output file as it is or compressed.
+    
+    Arguments
+    ---------
+    path: str
+        Output directory.
+    name: str
+        Name of the file.
+    
+    Returns
+    -------
+    str or None
+        Path to the file, or None if it is not found.
+    """
+    filename = os.path.join(path, name)
+    for suffix in ("",) + tuple(SUFFIXES.values()):
+        if os.path.exists(filename + suffix):
+            return filename + suffix
+    return None
+
+
+def read_vasprun(path, **kwargs):
+    """
+    Reads vasprun.xml in the output directory, which may be compressed or packed.
+    
+    Arguments
+    ---------
+    path: str
+        Output directory.
+    kwargs:
+        Arguments of pymatgen.io.vasp.outputs.Vasprun.
+    
+    Returns
+    -------
+    pymatgen.io.vasp.outputs.Vasprun
+        vasprun.xml file, which includes all calculation results.
+    """
+    filename = find_output(path, "vasprun.xml")
+    if filename is not None and _get_method(filename) != "zstd":
+        # pymatgen decompresses gzip while parsing.
+        return Vasprun(filename, **kwargs)
+    with tempfile.NamedTemporaryFile(suffix=".xml") as temporary:
+        with open_output(path, "vasprun.xml") as file:
+            shutil.copyfileobj(file, temporary, CHUNK_SIZE)
+        temporary.flush()
+        return Vasprun(temporary.name, **kwargs)
+
+
+class ArchivePolicy(object):
+    """
+    Archival policy of output files, which compresses large output files
+    or packs the whole output directory into one compressed archive.
+    The files are read transparently by read_vasprun() and open_output().
+    
+    Arguments
+    ---------
+    compress: list
+        Names of the files compressed when their size is not less than "min_size".
+    method: str
+        "gzip" or "zstd" (which requires zstandard).
+    level: int or None
+        Compression level, which is the default of the method when it is None.
+    min_size: int
+        The lower limit of size of the compressed files (byte).
+    pack: bool
+        If the whole output directory is packed into "(directory).tar.gz"
+        (or ".tar.zst"), in which files are not compressed one by one.
+    """
+    
+    def __init__(self, compress=("vasprun.xml", "OUTCAR", "CONTCAR", "INCAR", "POSCAR"),
+                 method="gzip", level=None, min_size=0, pack=False):
+        _check_method(method)
+        self.compress = compress
+        self.method = method
+        self.level = level
+        self.min_size = min_size
+        self.pack = pack
+    
+    def is_compressed(self, filename):
+        """
+        Is the file compressed by the policy.
+        
+        Arguments
+        ---------
+        filename: str
+            Path to the file.
+        
+        Returns
+        -------
+        bool
+        """
+        return (self.pack is False and os.path.basename(filename) in self.compress and
+                os.path.getsize(filename) >= self.min_size)
+    
+    def stage_file(self, source, target_path):
+        """
+        Moves (and compresses) a file to the output directory.
+        
+        Arguments
+        ---------
+        source: str
+            Path to the source file.
+        target_path: str
+            Output directory.
+        
+        Returns
+        -------
+        name: str
+            Name of the staged file.
+        """
+        name = os.path.basename(source)
+        if self.is_compressed(source):
+            name += SUFFIXES[self.method]
+            compress_file(source, os.path.join(target_path, name), self.method, self.level)
+        else:
+            move_file(source, os.path.join(target_path, name))
+        return name
+    
+    def apply(self, path):
+        """
+        Applies the policy to the output directory, e.g. of finished calculations.
+        
+        Arguments
+        ---------
+        path: str
+            Output directory.
+        
+        Returns
+        -------
+        str
+            Path to the archive or the directory.
+        """
+        if self.pack is True:
+            return pack_directory(path, self.method, self.level)
+        for name in os.listdir(path):
+            filename = os.path.join(path, name)
+            if os.path.isfile(filename) and self.is_compressed(filename):
+                compress_file(filename, filename + SUFFIXES[self.method], self.method,
+                              self.level)
+        return path
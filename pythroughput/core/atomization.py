@@ -94,7 +94,7 @@ class AtomizationCalculator(object):
         list
             Total energies of standard structures you need.
         """
-        if package is "vasp" and input_path is None:
+        if package == "vasp" and input_path is None:
             print("Error: In vasp calculation, you must set path to POTCARs as input_path.")
             return
         
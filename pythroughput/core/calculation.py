@@ -4,14 +4,36 @@
 
 import logging
 import os
+import tempfile
+import threading
+import collections
+import numpy
 import pymatgen
 from pymatgen.io.vasp.outputs import Vasprun
 from pymatgen.io.ase import AseAtomsAdaptor
+from pythroughput.core.sources import StructureRef
+from pythroughput.core.sources import StructureSource
+from pythroughput.core.costmodel import detect_symmetry
+from pythroughput.core.costmodel import estimate_cost
+from pythroughput.core.costmodel import get_kpoints_size
+from pythroughput.core.stageout import StageOut
+from pythroughput.core.stageout import is_staged
+from pythroughput.core.restart import is_unconverged
+from pythroughput.core.tracer import get_tracer
+from pythroughput.core.tracer import ProfileTracer
+from pythroughput.core.paralleltuning import ParallelTuner
+from pythroughput.core.throughput import JobPool
+from pythroughput.core.throughput import ThroughputPlan
+from pythroughput.outputs.resulttable import ResultTable
+from pythroughput.outputs.trajectorystore import TrajectoryStore
+from pythroughput.outputs.manifest import Manifest
+from pythroughput.outputs.manifest import shard_path
 try:
     from ase import Atom
     from ase.optimize import QuasiNewton
     from gpaw import GPAW
     from gpaw import KohnShamConvergenceError
+    from gpaw import Mixer
 except ModuleNotFoundError:
     print("Raise ModuleNotFoundError: You cannot use GPAW in this system!")
     pass
@@ -34,11 +56,24 @@ class PyHighThroughput(object):
     
     Parameters
     ----------
-    structs: pymatgen.Structure
+    structs: dict or StructureSource
         Calculating structures.
-    results: dict
+    results: ResultTable
         dictionary of calculation results, which consist of
         physical properties as the keys and that value as the values.
+    symmetries: dict
+        Symmetry of the structures detected at dispatch in symmetry mode,
+        see pythroughput.core.costmodel.detect_symmetry().
+    costs: dict
+        Estimated relative cost of the structures,
+        which uses the number of irreducible k-points in symmetry mode.
+    restarts: dict
+        Restarts of the unconverged structures, each of which is
+        {"changes": (changes of calculation configurations), "converged": bool}.
+    statistics: dict
+        Number of SCF iterations and ionic steps of the calculated structures.
+    pruned: list
+        Names of the structures not calculated, since the target of the prioritizer is met.
     """
     
     def __init__(self,
@@ -48,6 +83,23 @@ class PyHighThroughput(object):
                  },
                  input_path=None,
                  output_path=None,
+                 source=None,
+                 symmetry=False,
+                 primitive=False,
+                 geometry_filter=None,
+                 trajectory_store=None,
+                 scratch_path=None,
+                 stage_out=None,
+                 archive=None,
+                 shard=False,
+                 manifest=None,
+                 restart=None,
+                 tracer=None,
+                 telemetry=None,
+                 mpi_groups=None,
+                 parallel_tuner=None,
+                 throughput_plan=None,
+                 prioritizer=None,
                  **structs):
         """
         Arguments
@@ -60,17 +112,123 @@ class PyHighThroughput(object):
         output_path: str or None
             Path to output files. When it is None,
             output is omitted in GPAW calculation.
+        source: StructureSource or None
+            Lazy source of the structures (e.g. DirectorySource),
+            which are parsed only when their calculation is dispatched.
+            It cannot be used together with structs.
+        symmetry: bool
+            Symmetry mode, in which symmetry of the structures is detected at dispatch
+            and VASP uses symmetry (ISYM=2) for the structures keeping their symmetry,
+            e.g. generated by ModelGenerator.modify_symmetrical().
+            Otherwise, symmetry is switched off (ISYM=0).
+        primitive: bool
+            If the structures are reduced to their primitive cells before dispatch.
+            Energies are scaled back to the given cells by the ratio of the numbers
+            of sites, and "formula" is that of the given cells, while forces and
+            relaxed structures are those of the primitive cells.
+        geometry_filter: GeometryFilter or None
+            Filter rejecting structures with unreasonable geometry before dispatch,
+            whose results are {"results": "Invalid geometry", "reason": (reason)}.
+        trajectory_store: str, TrajectoryStore or None
+            Store (or its directory) to which energies, forces, stresses and positions
+            of all the ionic steps of each calculation are appended.
+        scratch_path: str or None
+            Node-local scratch (e.g. "$TMPDIR"), in which VASP runs in a temporary
+            directory per structure. Output files are staged to output path afterwards.
+            When it is None, VASP runs in the current directory.
+        stage_out: StageOut or None
+            Stage-out of output files, which is asynchronous and overlaps the next
+            calculation. It is created when scratch_path or archive is given.
+        archive: ArchivePolicy or None
+            Archival policy compressing output files of VASP calculation, or packing
+            their output directory. They are read transparently by read().
+        shard: bool
+            If output files are placed in two levels of hash-prefix directories,
+            e.g. "(output path)/3f/a2/(structure name)", instead of output path itself.
+        manifest: str, Manifest or None
+            Manifest (or its file) recording output path, status and digest of results
+            of each structure. When it is None, "(output path)/manifest.jsonl" is used
+            in the sharded layout.
+        restart: RestartLadder or None
+            Escalation ladder restarting unconverged calculations from their last state
+            with more robust configurations, whose attempts are recorded in restarts.
+        tracer: Tracer or None
+            Tracer timing the phases of the calculation (e.g. writing inputs, running VASP,
+            parsing vasprun.xml and stage-out) in spans tagged with struct_name,
+            num_sites and kpoints, e.g. JsonLinesTracer. It does nothing by default.
+        telemetry: CampaignTelemetry or None
+            Live telemetry of run(), e.g. throughput, queue depth and SCF statistics,
+            written to a Prometheus textfile and a JSON status file.
+            In MPI groups, it is written by rank 0 of the world, on the jobs of its group.
+        mpi_groups: MpiGroups or None
+            Groups of MPI ranks running GPAW calculations concurrently, each of which
+            calculates its share of the structures with its sub-communicator.
+            Results are gathered from all the groups at the end of run(),
+            and output files, the manifest and trajectories are written by their leaders.
+        parallel_tuner: str, ParallelTuner or None
+            Tuner (or its table of measured timings) choosing KPAR and NCORE of VASP
+            calculation from the ranks, k-points and bands, and refining the choice
+            by the timings of the finished calculations.
+        throughput_plan: str, ThroughputPlan or None
+            Plan (or its file) of ranks per job and concurrent jobs of each size class
+            given by pythroughput.core.throughput.autotune(), which is used by run()
+            unless n_jobs is given.
+        prioritizer: SurrogatePrioritizer or None
+            Prioritizer reordering the remaining structures by the surrogate model fitted
+            to the results streamed in, with which run() stops when its target is met.
+            All the structures are parsed before run() to calculate their features.
+            In MPI groups, each group prioritizes its share of the structures.
         structs: dict
             Dictionary of pymatgen.Structure object,
             which consists of the name of the structures
             as the keys and the atomic structures as the values.
         """
-        self.structs = structs
+        if source is not None:
+            if structs:
+                raise ValueError("Give structures either as source or as keyword arguments.")
+            self.structs = source
+        else:
+            self.structs = structs
         self.calculator = calculator
         self.input_path = input_path
         self.output_path = output_path
+        self.symmetry = symmetry
+        self.primitive = primitive
+        self.geometry_filter = geometry_filter
+        if trajectory_store is not None and not isinstance(trajectory_store, TrajectoryStore):
+            trajectory_store = TrajectoryStore(trajectory_store)
+        self.trajectory_store = trajectory_store
+        self.scratch_path = scratch_path
+        if stage_out is None and (scratch_path is not None or archive is not None):
+            stage_out = StageOut(archive=archive)
+        self.stage_out = stage_out
+        self.shard = shard
+        if manifest is None and shard is True and output_path is not None:
+            manifest = os.path.join(output_path, "manifest.jsonl")
+        if manifest is not None and not isinstance(manifest, Manifest):
+            manifest = Manifest(manifest)
+        self.manifest = manifest
+        self.restart = restart
+        self.restarts = {}
+        self.tracer = get_tracer(tracer)
+        self.telemetry = telemetry
+        self.mpi_groups = mpi_groups
+        if parallel_tuner is not None and not isinstance(parallel_tuner, ParallelTuner):
+            parallel_tuner = ParallelTuner(parallel_tuner)
+        self.parallel_tuner = parallel_tuner
+        if throughput_plan is not None and not isinstance(throughput_plan, ThroughputPlan):
+            throughput_plan = ThroughputPlan(throughput_plan)
+        self.throughput_plan = throughput_plan
+        self.prioritizer = prioritizer
+        self.pruned = []
+        self.statistics = {}
+        self.symmetries = {}
+        self.costs = {}
+        # Records of structures are written by concurrent calculations in threads.
+        self._lock = threading.Lock()
     
-    def run(self, steps=1, package="gpaw"):
+    def run(self, steps=1, package="gpaw", resume=False, n_jobs=None, concurrency=None,
+            cores=None):
         """
         Runs high-throughput first-principles calculation.
         
@@ -80,19 +238,285 @@ class PyHighThroughput(object):
             Number of relaxation steps.
         package: str
             First-principles calculation package using in calculation.
+        resume: bool
+            If the structures finished in the manifest are not calculated again.
+            Their results are read from their output path in VASP calculation,
+            once stage-out of the output files is completed. GPAW calculations,
+            whose results are not read, and VASP calculations whose output files
+            are not staged are run again.
+        n_jobs: int or None
+            Number of MPI ranks of each VASP calculation. When it is None,
+            that of the size class of the structure in the throughput plan is used,
+            or 4 without the plan.
+        concurrency: int or None
+            Number of concurrent VASP calculations, which requires scratch_path
+            and is not profiled by ProfileTracer.
+            Default: 1, or as many as the cores of the throughput plan allow.
+        cores: int or None
+            Number of cores shared by concurrent calculations.
+            Default: n_jobs x concurrency, or the cores of the throughput plan.
         
         Returns
         -------
-        results: dict
+        results: ResultTable
             Dictionary of calculation results, which consists of
             the name of structure as a key and the result of
             calculation as a value.
         """
-        self.results = {}
-        for struct_name, struct in self.structs.items():
-            self.results[struct_name] = self._calc(struct_name, struct, steps, package)
+        self.results = ResultTable()
+        self.pruned = []
+        pool = self._make_job_pool(package, n_jobs, concurrency, cores)
+        telemetry = self.telemetry
+        if self.mpi_groups is not None and not self.mpi_groups.is_root():
+            telemetry = None
+        if telemetry is not None:
+            telemetry.start(num_jobs=self._count_structs())
+        try:
+            with self.tracer.span("run", package=package, steps=steps):
+                invalid = self._check_batch()
+                if self.prioritizer is None:
+                    structs = self._iter_structs()
+                else:
+                    structs = self._iter_prioritized(telemetry)
+                for struct_name, struct in structs:
+                    if resume is True and self.manifest is not None:
+                        if self._read_done(struct_name, struct, package):
+                            self._observe(struct_name)
+                            if telemetry is not None:
+                                telemetry.job_skipped(struct_name)
+                            continue
+                    if invalid is None:
+                        reason = self._check_geometry(struct)
+                    else:
+                        reason = invalid.get(struct_name)
+                    if reason is not None:
+                        logger.info("%s is not calculated: %s", struct_name, reason)
+                        self.results[struct_name] = {"results": "Invalid geometry",
+                                                     "reason": reason}
+                        self._record(struct_name, None, self.results[struct_name])
+                        if telemetry is not None:
+                            telemetry.job_finished(struct_name, self.results[struct_name])
+                        continue
+                    ranks = self._get_ranks(struct, n_jobs)
+                    if telemetry is not None:
+                        telemetry.job_started(struct_name, cores=ranks)
+                    pool.submit(struct_name, ranks, self._run_struct, struct_name, struct, steps,
+                                package, ranks)
+                    for struct_name, results in pool.finished():
+                        self._finish_struct(struct_name, results, telemetry)
+                for struct_name, results in pool.finished(block=True):
+                    self._finish_struct(struct_name, results, telemetry)
+                if self.stage_out is not None:
+                    with self.tracer.span("wait_stage_out"):
+                        self.stage_out.wait()
+                if self.mpi_groups is not None:
+                    with self.tracer.span("gather"):
+                        results = self.mpi_groups.gather(self.results.to_dict())
+                    self.results = ResultTable()
+                    self.results.update(results)
+        finally:
+            pool.shutdown()
+            if telemetry is not None:
+                telemetry.stop()
         return self.results
     
+    def _make_job_pool(self, package, n_jobs, concurrency, cores):
+        """
+        Makes the pool of concurrent calculations.
+        
+        Returns
+        -------
+        JobPool
+            Pool of calculations sharing the cores.
+        """
+        plan = self.throughput_plan
+        if n_jobs is None and plan is not None and plan.classes:
+            min_ranks = min(entry["n_jobs"] for entry in plan.classes.values())
+            if cores is None:
+                cores = plan.cores
+        else:
+            min_ranks = n_jobs if n_jobs is not None else 4
+        if cores is None:
+            cores = min_ranks * (concurrency if concurrency is not None else 1)
+        max_workers = concurrency if concurrency is not None else max(cores // min_ranks, 1)
+        if max_workers > 1:
+            if package != "vasp":
+                raise ValueError("Only VASP calculations run concurrently.")
+            if self.scratch_path is None:
+                raise ValueError("Concurrent VASP calculations need scratch_path.")
+            tracers = getattr(self.tracer, "tracers", [self.tracer])
+            if any(isinstance(tracer, ProfileTracer) for tracer in tracers):
+                raise ValueError("ProfileTracer does not profile concurrent calculations.")
+        return JobPool(cores, max_workers)
+    
+    def _get_ranks(self, struct, n_jobs):
+        """
+        Gets the number of MPI ranks of the calculation of the structure.
+        """
+        if n_jobs is not None:
+            return n_jobs
+        if self.throughput_plan is not None:
+            plan = self.throughput_plan.get(struct.num_sites)
+            if plan is not None:
+                return plan["n_jobs"]
+        return 4
+    
+    def _run_struct(self, struct_name, struct, steps, package, n_jobs):
+        """
+        Runs the calculation of the structure, which may run in a thread of the pool.
+        """
+        with self.tracer.span("calc", struct_name=struct_name, num_sites=len(struct)):
+            return self._calc(struct_name, struct, steps, package, n_jobs)
+    
+    def _finish_struct(self, struct_name, results, telemetry):
+        """
+        Stores and records results of the finished calculation.
+        """
+        self.results[struct_name] = results
+        self._observe(struct_name)
+        if telemetry is not None:
+            telemetry.job_finished(struct_name, results, self.statistics.get(struct_name))
+        self._record(struct_name, self._get_struct_output_path(struct_name), results)
+    
+    def _observe(self, struct_name):
+        """
+        Gives results of the structure to the prioritizer.
+        """
+        if self.prioritizer is not None and struct_name in self.results:
+            self.prioritizer.observe(struct_name, self.results[struct_name])
+    
+    def _count_structs(self):
+        """
+        Counts the structures (of the group in MPI groups),
+        or returns None if the source is not sized.
+        """
+        try:
+            num = len(self.structs)
+        except TypeError:
+            return None
+        if self.mpi_groups is not None:
+            num = len(range(self.mpi_groups.index, num, self.mpi_groups.num_groups))
+        return num
+    
+    def _iter_structs(self):
+        """
+        Iterates the structures, which are those assigned to the group
+        of this rank in MPI groups. The others are not parsed.
+        
+        Returns
+        -------
+        generator
+            Pairs of the name of the structure and pymatgen.Structure.
+        """
+        if self.mpi_groups is None:
+            yield from self.structs.items()
+            return
+        for struct_name, struct in self._iter_refs():
+            yield struct_name, struct.load() if isinstance(struct, StructureRef) else struct
+    
+    def _iter_refs(self):
+        """
+        Iterates the references to the structures (assigned to the group
+        of this rank in MPI groups) without parsing them.
+        
+        Returns
+        -------
+        generator
+            Pairs of the name of the structure and StructureRef,
+            or pymatgen.Structure given in the dictionary.
+        """
+        if isinstance(self.structs, StructureSource):
+            pairs = self.structs.refs()
+        else:
+            pairs = self.structs.items()
+        for position, (struct_name, struct) in enumerate(pairs):
+            if self.mpi_groups is None or self.mpi_groups.is_assigned(position):
+                yield struct_name, struct
+    
+    def _iter_prioritized(self, telemetry=None):
+        """
+        Iterates the structures in the order given by the prioritizer, which is
+        updated when new results are observed, until its target is met.
+        The remaining structures are recorded in pruned.
+        
+        Each structure is featurized while the structures are streamed, and only
+        its reference is kept in the queue, so it is parsed again when it is dispatched.
+        
+        Returns
+        -------
+        generator
+            Pairs of the name of the structure and pymatgen.Structure.
+        """
+        queue = {}
+        
+        def stream():
+            for struct_name, struct in self._iter_refs():
+                queue[struct_name] = struct
+                yield struct_name, struct.load() if isinstance(struct, StructureRef) else struct
+        
+        with self.tracer.span("add_candidates", num_structs=self._count_structs()):
+            self.prioritizer.add_candidates(stream())
+        num_observations = None
+        while queue:
+            if self.prioritizer.num_observations != num_observations:
+                num_observations = self.prioritizer.num_observations
+                with self.tracer.span("prioritize", num_structs=len(queue)):
+                    if self.prioritizer.is_done(queue):
+                        break
+                    order = collections.deque(self.prioritizer.rank(queue))
+            struct_name = order.popleft()
+            struct = queue.pop(struct_name)
+            yield struct_name, struct.load() if isinstance(struct, StructureRef) else struct
+        if queue:
+            logger.info("Target is met, and %d structures are not calculated.", len(queue))
+            self.pruned = list(queue)
+            for struct_name in self.pruned:
+                if telemetry is not None:
+                    telemetry.job_skipped(struct_name)
+    
+    def _is_writer(self):
+        """
+        Does this rank write output files, which is the leader of its group in MPI groups.
+        """
+        return self.mpi_groups is None or self.mpi_groups.is_leader()
+    
+    def _check_batch(self):
+        """
+        Checks geometry of all the structures at once when they are given as arrays,
+        e.g. ModelBatch.
+        
+        Returns
+        -------
+        invalid: dict or None
+            Reasons of rejection keyed by the name of the rejected structures,
+            or None when the structures are checked one by one.
+        """
+        if self.geometry_filter is None:
+            return {}
+        if hasattr(self.structs, "lattices") and hasattr(self.structs, "frac_coords"):
+            with self.tracer.span("check_geometry", num_structs=len(self.structs)):
+                return self.geometry_filter.check_batch(self.structs)
+        return None
+    
+    def _check_geometry(self, struct):
+        """
+        Checks geometry of the structure.
+        
+        Arguments
+        ---------
+        struct: pymatgen.Structure
+            Atomic structure itself.
+        
+        Returns
+        -------
+        str or None
+            Reason of rejection, or None if the structure is valid.
+        """
+        if self.geometry_filter is None:
+            return None
+        with self.tracer.span("check_geometry", num_sites=len(struct)):
+            return self.geometry_filter.check(struct)
+    
     def read(self,
              package="gpaw",
              results_list=["struct_name",
@@ -110,23 +534,101 @@ class PyHighThroughput(object):
         
         Returns
         -------
-        results: dict
+        results: ResultTable
             Dictionary of calculation results, which consists of
             the name of structure as a key and the result of
             calculation as a value.
         """
-        self.results = {}
-        if package is "gpaw":
+        self.results = ResultTable()
+        if package == "gpaw":
             pass
-        elif package is "vasp":
+        elif package == "vasp":
             for struct_name, struct in self.structs.items():
-                struct_calculator = self._set_default_calculator(struct_name, struct)
+                if self.manifest is not None:
+                    self._read_done(struct_name, struct, package, results_list)
+                    continue
+                struct_calculator = self._set_default_calculator(struct_name, struct, package)
                 self.results[struct_name] = Calculation_vasp(
                     struct_name, struct, struct_calculator, None
                 ).read_results(results_list=results_list)
         return self.results
     
-    def _calc(self, struct_name, struct, steps, package):
+    def _read_done(self, struct_name, struct, package,
+                   results_list=["struct_name",
+                                 "initial_energy",
+                                 "total_energy",
+                                 "initial_forces",
+                                 "final_forces"]):
+        """
+        Reads results of the structure from its output path in the manifest,
+        if its calculation is finished and its output files are staged.
+        Results of GPAW calculation are not read, so they are calculated again.
+        
+        Arguments
+        ---------
+        struct_name: str
+            Name of the structure.
+        struct: pymatgen.Structure
+            Atomic structure itself.
+        package: str
+            First-principles calculation package using in calculation.
+        results_list
+            List of required results.
+        
+        Returns
+        -------
+        bool
+            If the results are read.
+        """
+        entry = self.manifest.get(struct_name)
+        if entry is None or entry["status"] != "done" or package != "vasp":
+            return False
+        if entry["path"] is not None and not is_staged(entry["path"]):
+            logger.warning("Output files of %s are not staged, so it is calculated again.",
+                           struct_name)
+            return False
+        if self.primitive is True:
+            calc_struct, ratio = self._reduce_struct(struct)
+        else:
+            calc_struct, ratio = struct, 1
+        struct_calculator = self._set_default_calculator(struct_name, calc_struct, package)
+        results = Calculation_vasp(
+            struct_name, calc_struct, struct_calculator, None
+        ).read_results(results_list=results_list, path=entry["path"])
+        if ratio != 1 and "error" not in results:
+            results = self._scale_results(results, struct, ratio)
+        self.results[struct_name] = results
+        return True
+    
+    def _get_struct_output_path(self, struct_name):
+        """
+        Gets the output path of the structure, in the sharded layout if shard is True.
+        
+        Arguments
+        ---------
+        struct_name: str
+            Name of the structure.
+        
+        Returns
+        -------
+        str or None
+            Output path without extension, or None when output is omitted.
+        """
+        if self.output_path is None:
+            return None
+        if self.shard is True:
+            return shard_path(self.output_path, struct_name)
+        return self.output_path + struct_name
+    
+    def _record(self, struct_name, path, results):
+        """
+        Records the calculation of the structure in the manifest.
+        """
+        if self.manifest is not None and self._is_writer():
+            with self.tracer.span("record", struct_name=struct_name):
+                self.manifest.record(struct_name, path, results)
+    
+    def _calc(self, struct_name, struct, steps, package, n_jobs=4):
         """
         Runs first-principles calculation.
         
@@ -140,6 +642,8 @@ class PyHighThroughput(object):
             Number of relaxation steps.
         package: str
             First-principles calculation package using in calculation.
+        n_jobs: int
+            Number of MPI ranks of VASP calculation.
         
         Parameters
         ----------
@@ -152,19 +656,142 @@ class PyHighThroughput(object):
         dict
             Calculation results return by get_results method.
         """
-        struct_calculator = self._set_default_calculator(struct_name, struct)
+        if self.primitive is True:
+            calc_struct, ratio = self._reduce_struct(struct)
+        else:
+            calc_struct, ratio = struct, 1
+        struct_calculator = self._set_default_calculator(struct_name, calc_struct, package)
+        if self.shard is True and struct_calculator["txt"] is not None:
+            os.makedirs(os.path.dirname(struct_calculator["txt"]), exist_ok=True)
         
-        if package is "gpaw":
+        if package == "gpaw":
+            if self.mpi_groups is not None:
+                struct_calculator["communicator"] = self.mpi_groups.comm
+            calculation = Calculation(struct_name, calc_struct, struct_calculator,
+                                      trajectory=self.trajectory_store is not None,
+                                      tracer=self.tracer)
             try:
-                return Calculation(struct_name, struct, struct_calculator).get_results(steps=steps)
+                results = calculation.get_results(steps=steps, restart=self.restart)
             except KohnShamConvergenceError:
-                return {"results": "Unconverged"}
-        elif package is "vasp":
-            return Calculation_vasp(struct_name, struct, struct_calculator, self.input_path).get_results(steps=steps)
+                results = {"results": "Unconverged"}
+            self._set_records(struct_name, calculation)
+            if is_unconverged(results):
+                return results
+        elif package == "vasp":
+            calculation = Calculation_vasp(struct_name, calc_struct, struct_calculator,
+                                           self.input_path,
+                                           work_path=self._make_work_path(struct_name),
+                                           stage_out=self.stage_out, tracer=self.tracer,
+                                           tuner=self.parallel_tuner)
+            results = calculation.get_results(steps=steps, n_jobs=n_jobs, restart=self.restart)
+            self._set_records(struct_name, calculation)
         else:
-            pass
+            return None
+        if self.trajectory_store is not None and self._is_writer():
+            with self.tracer.span("store_trajectory", struct_name=struct_name):
+                self._store_trajectory(struct_name, calculation)
+        if ratio != 1:
+            results = self._scale_results(results, struct, ratio)
+        return results
+    
+    def _set_records(self, struct_name, calculation):
+        """
+        Sets the restart attempts and the statistics of the finished calculation.
+        """
+        with self._lock:
+            if calculation.attempts:
+                self.restarts[struct_name] = calculation.attempts
+            self.statistics[struct_name] = calculation.get_statistics()
+    
+    def _make_work_path(self, struct_name):
+        """
+        Makes the temporary work directory of the structure in scratch.
+        
+        Arguments
+        ---------
+        struct_name: str
+            Name of the structure.
+        
+        Returns
+        -------
+        str or None
+            Path to the work directory, or None when scratch is not used.
+        """
+        if self.scratch_path is None:
+            return None
+        scratch_path = os.path.expandvars(os.path.expanduser(self.scratch_path))
+        os.makedirs(scratch_path, exist_ok=True)
+        return tempfile.mkdtemp(prefix=struct_name.replace(os.sep, "_") + ".",
+                                dir=scratch_path)
+    
+    def _store_trajectory(self, struct_name, calculation):
+        """
+        Appends the trajectory of the calculation to the trajectory store.
+        
+        Arguments
+        ---------
+        struct_name: str
+            Name of the structure.
+        calculation: Calculation or Calculation_vasp
+            Finished calculation.
+        """
+        trajectory = calculation.get_trajectory()
+        if trajectory is None:
+            logger.warning("Trajectory of %s is not found.", struct_name)
+            return
+        self.trajectory_store.append(struct_name, **trajectory)
+    
+    def _reduce_struct(self, struct):
+        """
+        Reduces the structure to its primitive cell.
+        
+        Arguments
+        ---------
+        struct: pymatgen.Structure
+            Atomic structure itself.
+        
+        Returns
+        -------
+        calc_struct: pymatgen.Structure
+            Primitive cell of the structure, or the structure itself
+            when it is already primitive.
+        ratio: int
+            Number of primitive cells in the structure.
+        """
+        calc_struct = struct.get_primitive_structure()
+        if calc_struct.num_sites >= struct.num_sites:
+            return struct, 1
+        return calc_struct, struct.num_sites // calc_struct.num_sites
     
-    def _set_default_calculator(self, struct_name, struct):
+    def _scale_results(self, results, struct, ratio):
+        """
+        Scales energies calculated in the primitive cell back to the given cell.
+        
+        Arguments
+        ---------
+        results: dict
+            Calculation results of the primitive cell.
+        struct: pymatgen.Structure
+            The given structure.
+        ratio: int
+            Number of primitive cells in the structure.
+        
+        Returns
+        -------
+        results: dict
+            Calculation results of the given cell.
+        """
+        if not isinstance(results, dict):
+            return results
+        for key in ("initial_energy", "total_energy"):
+            if isinstance(results.get(key), float) and results[key] != float("inf"):
+                results[key] *= ratio
+        if "formula" in results:
+            results["formula"] = struct.formula
+        results["primitive_ratio"] = ratio
+        return results
+    
+    def _set_default_calculator(self, struct_name, struct, package="gpaw"):
         """
         Sets default calculation configulations which are different
         depending on structure, system size, and so on.
@@ -175,6 +802,8 @@ class PyHighThroughput(object):
             The name of the structure.
         struct: pymatgen.Structure
             Atomic structure itself.
+        package: str
+            First-principles calculation package using in calculation.
         
         Returns
         -------
@@ -182,9 +811,9 @@ class PyHighThroughput(object):
             Calculation configurations which are different
             depending on structures.
         """
-        struct_calculator = self.calculator
+        struct_calculator = dict(self.calculator)
         if self.output_path is not None:
-            struct_calculator["txt"] = self.output_path + struct_name + ".txt"
+            struct_calculator["txt"] = self._get_struct_output_path(struct_name) + ".txt"
         else:
             struct_calculator["txt"] = None
         
@@ -196,6 +825,19 @@ class PyHighThroughput(object):
         else:
             struct_calculator["kpts"] = {"size": (1, 1, 1)}
         
+        num_kpoints = int(numpy.prod(get_kpoints_size(struct_calculator["kpts"])))
+        if self.symmetry is True and package == "vasp":
+            symmetry = detect_symmetry(struct, struct_calculator["kpts"])
+            with self._lock:
+                self.symmetries[struct_name] = symmetry
+            if symmetry["num_operations"] > 1:
+                struct_calculator["isym"] = 2
+                num_kpoints = symmetry["num_kpoints"]
+            else:
+                struct_calculator["isym"] = 0
+        with self._lock:
+            self.costs[struct_name] = estimate_cost(struct.num_sites, num_kpoints)
+        
         return struct_calculator
     
 
@@ -204,7 +846,7 @@ class Calculation(object):
     Class to perform first-principles calculation with GPAW.
     """
     
-    def __init__(self, struct_name, struct, calculator):
+    def __init__(self, struct_name, struct, calculator, trajectory=False, tracer=None):
         """
         Arguments
         ---------
@@ -214,20 +856,83 @@ class Calculation(object):
             Atomic structure itself.
         calculator: dict
             Calculation configurations.
+        trajectory: bool
+            If all the steps of the calculation are recorded.
+        tracer: Tracer or None
+            Tracer timing the phases of the calculation.
         """
         self._struct_name = struct_name
         self._struct = struct
+        self._trajectory = [] if trajectory is True else None
+        self._ionic_steps = 1
+        self.attempts = []
+        self._tracer = get_tracer(tracer)
+        self._tags = {"struct_name": struct_name,
+                      "num_sites": len(struct),
+                      "kpoints": list(get_kpoints_size(calculator.get("kpts")))}
         try:
             self._atom = AseAtomsAdaptor.get_atoms(struct, **struct.site_properties)
-            self._atom.set_calculator(GPAW(**calculator))
+            with self._tracer.span("init_gpaw", **self._tags):
+                self._atom.set_calculator(GPAW(**calculator))
         except ValueError:
             self._atom = None
     
-    def get_results(self, steps=1):
+    def get_results(self, steps=1, restart=None):
         """
         Runs first-principles calculation with GPAW
         and gets calculation results.
         
+        Arguments
+        ---------
+        steps: int
+            Number of relaxation steps.
+        restart: RestartLadder or None
+            Escalation ladder restarting the unconverged calculation
+            from its last state, whose attempts are recorded in self.attempts.
+        
+        Returns
+        -------
+        results: dict
+            Dictionary of caluclation results.
+        """
+        num_attempts = restart.get_num_attempts("gpaw") if restart is not None else 0
+        while True:
+            try:
+                results = self._calculate(steps)
+            except KohnShamConvergenceError:
+                if len(self.attempts) >= num_attempts:
+                    if self.attempts:
+                        self.attempts[-1]["converged"] = False
+                    raise
+            else:
+                if self.attempts:
+                    self.attempts[-1]["converged"] = True
+                return results
+            changes = restart.get_changes("gpaw", len(self.attempts) + 1)
+            logger.info("Restart %s with %s", self._struct_name, changes)
+            self.attempts.append({"changes": changes, "converged": False})
+            self._restart(changes)
+    
+    def _restart(self, changes):
+        """
+        Changes calculation configurations keeping the current atoms,
+        so the calculation restarts from its last state.
+        
+        Arguments
+        ---------
+        changes: dict
+            Changes of calculation configurations,
+            in which "mixer" is given as the arguments of gpaw.Mixer.
+        """
+        changes = dict(changes)
+        if isinstance(changes.get("mixer"), dict):
+            changes["mixer"] = Mixer(**changes["mixer"])
+        self._atom.calc.set(**changes)
+    
+    def _calculate(self, steps):
+        """
+        Runs first-principles calculation with GPAW.
+        
         Arguments
         ---------
         steps: int
@@ -242,12 +947,15 @@ class Calculation(object):
             return self._struct_name, self._atom
         else:
             results = {}
-            if not steps is 1:
+            if steps != 1:
                 results["relax_struct"] = self._get_relax_struct(steps)
             else:
                 pass
-            results["total_energy"] = self._get_total_energy()
+            with self._tracer.span("scf", **self._tags):
+                results["total_energy"] = self._get_total_energy()
             results["formula"] = self._struct.formula
+            if self._trajectory is not None and not self._trajectory:
+                self._record_step()
             return results
     
     def _is_not_invalid_struct(self):
@@ -275,9 +983,66 @@ class Calculation(object):
         pymatgen.Structure
             Relaxed structure.
         """
-        QuasiNewton(self._atom, logfile=None).run(steps=steps)
+        optimizer = QuasiNewton(self._atom, logfile=None)
+        if self._trajectory is not None:
+            optimizer.attach(self._record_step, interval=1)
+        with self._tracer.span("relax", steps=steps, **self._tags):
+            optimizer.run(steps=steps)
+        self._ionic_steps = optimizer.get_number_of_steps()
         return AseAtomsAdaptor.get_structure(self._atom)
     
+    def _record_step(self):
+        """
+        Records energy, forces, stress and positions of the current step,
+        which is called by QuasiNewton as an observer.
+        """
+        try:
+            stress = self._atom.get_stress(voigt=False)
+        except NotImplementedError:
+            stress = numpy.full((3, 3), numpy.nan)
+        self._trajectory.append((self._atom.get_potential_energy(),
+                                 numpy.array(self._atom.get_cell()),
+                                 self._atom.get_positions(),
+                                 self._atom.get_forces(),
+                                 stress))
+    
+    def get_statistics(self):
+        """
+        Gets the number of ionic steps and SCF iterations of the calculation.
+        
+        Returns
+        -------
+        statistics: dict or None
+            "ionic_steps" and "scf_iterations", which is that of the last SCF in GPAW.
+        """
+        if self._atom is None:
+            return None
+        try:
+            scf_iterations = self._atom.calc.get_number_of_iterations()
+        except (AttributeError, TypeError):
+            scf_iterations = None
+        return {"ionic_steps": self._ionic_steps, "scf_iterations": scf_iterations}
+    
+    def get_trajectory(self):
+        """
+        Gets recorded steps of the calculation.
+        
+        Returns
+        -------
+        trajectory: dict or None
+            Arrays of the trajectory given to TrajectoryStore.append(),
+            or None when no step is recorded.
+        """
+        if not self._trajectory:
+            return None
+        energies, lattices, positions, forces, stresses = zip(*self._trajectory)
+        return {"numbers": self._atom.get_atomic_numbers(),
+                "energies": energies,
+                "lattices": lattices,
+                "positions": positions,
+                "forces": forces,
+                "stresses": stresses}
+    
     def _get_total_energy(self):
         """
         Gets total energy (eV) of (relaxed) structure.
@@ -5,13 +5,24 @@
 import logging
 import os
 import csv
+import time
 import subprocess
 import xml.etree.cElementTree as ET
+import numpy
 import pymatgen
 from pymatgen.io.vasp.inputs import Poscar
 from pymatgen.io.vasp.inputs import Incar
 # from pymatgen.io.vasp.inputs import Kpoints
-from pymatgen.io.vasp.outputs import Vasprun
+from pythroughput.core.stageout import stage_files
+from pythroughput.core.archive import read_vasprun
+from pythroughput.core.restart import is_unconverged
+from pythroughput.core.costmodel import detect_symmetry
+from pythroughput.core.costmodel import count_time_reversal_kpoints
+from pythroughput.core.costmodel import get_kpoints_size
+from pythroughput.core.paralleltuning import read_nelect
+from pythroughput.core.paralleltuning import estimate_nbands
+from pythroughput.core.tracer import get_tracer
+from pythroughput.outputs.trajectorystore import trajectory_from_vasprun
 
 """
 Class to performe high-throughput first-principles calculation with VASP.
@@ -19,13 +30,17 @@ Class to performe high-throughput first-principles calculation with VASP.
 
 logger = logging.getLogger(__name__)
 
+# Default of NELM in VASP.
+VASP_NELM = 60
+
 
 class Calculation_vasp(object):
     """
     Class to perform first-principles calculation with VASP.
     """
     
-    def __init__(self, struct_name, struct, calculator, potential_path):
+    def __init__(self, struct_name, struct, calculator, potential_path,
+                 work_path=None, stage_out=None, tracer=None, tuner=None):
         """
         Arguments
         ---------
@@ -37,12 +52,37 @@ class Calculation_vasp(object):
             Calculation configulation as ASE format.
         potential_path: str
             Path to pseudo-potential database using in VASP calculation.
+        work_path: str or None
+            Directory in which input files are written and VASP runs,
+            e.g. in node-local scratch. When it is None, the current directory is used.
+        stage_out: StageOut or None
+            Asynchronous stage-out of output files. When it is None,
+            output files are moved to the output path before returning results.
+        tracer: Tracer or None
+            Tracer timing the phases of the calculation.
+        tuner: ParallelTuner or None
+            Tuner choosing KPAR and NCORE, unless they are given in calculator,
+            to which the measured timing of the calculation is recorded.
         """
         self._struct_name = struct_name
         self._struct = struct
+        self._vasprun = None
+        self._work_path = work_path if work_path is not None else os.curdir
+        self._stage_out = stage_out
+        self._calculator = calculator
+        self.attempts = []
+        self._started = None
+        self._maxiter = None
+        self._tuner = tuner
+        self.parallel = None
+        self._tracer = get_tracer(tracer)
+        self._tags = {"struct_name": struct_name,
+                      "num_sites": len(struct),
+                      "kpoints": list(get_kpoints_size(calculator.get("kpts")))}
         try:
             self._output_path = self._set_output_path(calculator["txt"])
-            self._write_input_files(struct, calculator, potential_path)
+            with self._tracer.span("write_inputs", **self._tags):
+                self._write_input_files(struct, calculator, potential_path)
         except KeyError:
             pass
         except TypeError:
@@ -62,14 +102,13 @@ class Calculation_vasp(object):
         -------
         path: str
             Output file path, if it is None in arguments,
-            it is "./outputs/(structure name)".
+            it is "./outputs/(structure name)". The directory is made when
+            the calculation runs, since that of a packed output is not read.
         """
         if output_path is not None:
             path = os.path.splitext(output_path)[0]
         else:
             return None
-        if not os.path.exists(path):
-            os.makedirs(path, exist_ok=True)
         return path
     
     def _write_input_files(self, struct, calculator, potential_path):
@@ -88,7 +127,24 @@ class Calculation_vasp(object):
         self._write_poscar(struct)
         self._write_incar(calculator)
         self._write_kpoints(calculator["kpts"])
-        self._write_potcar(struct, potential_path)
+        with self._tracer.span("write_potcar", **self._tags):
+            self._write_potcar(struct, potential_path)
+    
+    def _work_file(self, name):
+        """
+        Gets the path to the file in the work directory.
+        """
+        return os.path.join(self._work_path, name)
+    
+    def _has_work_file(self, name):
+        """
+        Is the file written in the work directory and not empty,
+        and written by this calculation once it is started.
+        """
+        filename = self._work_file(name)
+        if not os.path.exists(filename) or os.path.getsize(filename) == 0:
+            return False
+        return self._started is None or os.path.getmtime(filename) >= self._started
     
     def _write_poscar(self, struct):
         """
@@ -99,7 +155,7 @@ class Calculation_vasp(object):
         struct: pymatgen.Strucuture
             Atomic structure itself.
         """
-        with open("POSCAR", mode="w") as file:
+        with open(self._work_file("POSCAR"), mode="w") as file:
             file.writelines(str(Poscar(struct)))
     
     def _write_incar(self, calculator):
@@ -132,7 +188,14 @@ class Calculation_vasp(object):
         if calculator.get("isif") is not None:
             incar_dict["isif"] = calculator["isif"]
         
-        with open("INCAR", mode="w") as file:
+        if calculator.get("isym") is not None:
+            incar_dict["ISYM"] = calculator["isym"]
+        
+        for tag in ("ALGO", "AMIX", "BMIX", "ISTART", "ICHARG", "LWAVE", "KPAR", "NCORE"):
+            if calculator.get(tag.lower()) is not None:
+                incar_dict[tag] = calculator[tag.lower()]
+        
+        with open(self._work_file("INCAR"), mode="w") as file:
             file.writelines(str(Incar(incar_dict)))
     
     def _write_kpoints(self, kpts):
@@ -164,7 +227,7 @@ class Calculation_vasp(object):
         else:
             shift = "Gamma"
         
-        with open("KPOINTS", mode="w") as file:
+        with open(self._work_file("KPOINTS"), mode="w") as file:
             file.write("Automatic mesh generated by pythroughput\n")
             file.write("  0\n")
             file.write(shift + "\n")
@@ -182,12 +245,12 @@ class Calculation_vasp(object):
         potential_path: str
             Path to pseudo-potential database using in VASP calculation.
         """
-        if os.path.exists("POTCAR") is True:
-            os.remove("POTCAR")
+        if os.path.exists(self._work_file("POTCAR")) is True:
+            os.remove(self._work_file("POTCAR"))
         
         recommended_potential = self._read_potential(potential_path)
         
-        with open("POTCAR", mode="a") as file:
+        with open(self._work_file("POTCAR"), mode="a") as file:
             for symbol in struct.symbol_set:
                 file.writelines(open(
                     potential_path + recommended_potential[symbol] + "/POTCAR"
@@ -222,7 +285,8 @@ class Calculation_vasp(object):
                                   "total_energy",
                                   "initial_forces",
                                   "final_forces"],
-                    backup_file_list=["POSCAR", "vasprun.xml", "INCAR"]):
+                    backup_file_list=["POSCAR", "vasprun.xml", "INCAR"],
+                    restart=None):
         """
         Gets calculation results.
         
@@ -236,6 +300,9 @@ class Calculation_vasp(object):
             List of required results.
         backup_file_list: list
             List of backuped files.
+        restart: RestartLadder or None
+            Escalation ladder restarting the unconverged calculation
+            from its last state, whose attempts are recorded in self.attempts.
         
         Parameters
         ----------
@@ -250,34 +317,92 @@ class Calculation_vasp(object):
             dictionary of caluclation results.
         """
         results = {}
+        backup_file_list = list(backup_file_list)
+        if self._output_path is not None:
+            os.makedirs(self._output_path, exist_ok=True)
         
-        if not steps is 1:
-            with open("INCAR", mode="a") as file:
+        if self._tuner is not None:
+            self._tune_parallel(n_jobs)
+        
+        num_attempts = restart.get_num_attempts("vasp") if restart is not None else 0
+        if num_attempts > 0 and self._calculator.get("lwave") is None:
+            # Wave functions are written for the restart.
+            self._write_incar(dict(self._calculator, lwave=True))
+        
+        if steps != 1:
+            with open(self._work_file("INCAR"), mode="a") as file:
                 file.write("NSW="+str(steps))
             backup_file_list.append("CONTCAR")
         
+        # Files older than the calculation, e.g. in the current directory, are not restarted.
+        self._started = time.time() - 1.0
+        start = time.perf_counter()
         self._run_vasp(n_jobs)
-        if self._output_path is not None:
-            self._mv_output_files(backup_file_list)
-        
-        results = self.read_results(results_list)
+        seconds = time.perf_counter() - start
+        results = self.read_results(results_list, path=self._work_path)
+        if self.parallel is not None and "error" not in results:
+            statistics = self.get_statistics()
+            self._tuner.record(n_jobs, self.parallel["num_kpoints"], self.parallel["nbands"],
+                               self.parallel, seconds, statistics["scf_iterations"])
+        if restart is not None:
+            while is_unconverged(results) and len(self.attempts) < num_attempts:
+                changes = restart.get_changes("vasp", len(self.attempts) + 1)
+                logger.info("Restart %s with %s", self._struct_name, changes)
+                self._prepare_restart(changes, steps,
+                                      lwave=len(self.attempts) + 1 < num_attempts)
+                self._run_vasp(n_jobs)
+                results = self.read_results(results_list, path=self._work_path)
+                self.attempts.append({"changes": changes,
+                                      "converged": not is_unconverged(results)})
+        self._mv_output_files(backup_file_list)
         
         return results
     
+    def _tune_parallel(self, n_jobs):
+        """
+        Chooses KPAR and NCORE by the tuner from the number of ranks, irreducible
+        k-points and bands, and rewrites INCAR. Those given in calculator are kept.
+        
+        Arguments
+        ---------
+        n_jobs: int
+            Number of CPU using in parallel calculation.
+        """
+        if self._calculator.get("kpar") is not None or self._calculator.get("ncore") is not None:
+            return
+        kpts = self._calculator.get("kpts")
+        if self._calculator.get("isym") == 2:
+            num_kpoints = detect_symmetry(self._struct, kpts)["num_kpoints"]
+        elif self._calculator.get("isym") == -1:
+            num_kpoints = int(numpy.prod(get_kpoints_size(kpts)))
+        else:
+            # The mesh is reduced by time-reversal symmetry without symmetry (ISYM = 0).
+            num_kpoints = count_time_reversal_kpoints(kpts)
+        nelect = read_nelect(self._work_file("POTCAR"), self._struct)
+        nbands = estimate_nbands(nelect, self._struct.num_sites)
+        settings = self._tuner.choose(n_jobs, num_kpoints, nbands)
+        logger.info("%s runs with KPAR = %d and NCORE = %d", self._struct_name,
+                    settings["kpar"], settings["ncore"])
+        self._calculator = dict(self._calculator, **settings)
+        self._write_incar(self._calculator)
+        self.parallel = dict(settings, num_kpoints=num_kpoints, nbands=nbands)
+    
     def read_results(self, results_list=["struct_name",
                                          "initial_energy",
                                          "total_energy",
                                          "initial_forces",
-                                         "final_forces"]):
+                                         "final_forces"],
+                     path=None):
         """
         Reads results from calculated files, vasprun.xml.
         
         Arguments
         ---------
-        vasprun: pymatgen.io.vasp.outputs.Vasprun
-            vasprun.xml file, which includes all calculation results.
         results_list
             List of required results.
+        path: str or None
+            Directory of vasprun.xml. When it is None,
+            the output path (or the work directory) is used.
         
         Returns
         -------
@@ -285,14 +410,15 @@ class Calculation_vasp(object):
             dictionary of caluclation results.
         """
         results = {}
+        if path is None:
+            path = self._output_path if self._output_path is not None else self._work_path
         try:
-            if self._output_path is not None:
-                vasprun = Vasprun(self._output_path + "/vasprun.xml")
-            else:
-                vasprun = Vasprun("vasprun.xml")
-        except (ET.ParseError, ValueError) as error:
+            with self._tracer.span("parse_vasprun", **self._tags):
+                vasprun = read_vasprun(path)
+        except (ET.ParseError, ValueError, FileNotFoundError) as error:
             results["error"] = error
             return results
+        self._vasprun = vasprun
         
         for term in results_list:
             if term == "struct_name":
@@ -311,6 +437,75 @@ class Calculation_vasp(object):
                 results[term] = "Undefined parameter"
         return results
     
+    def get_statistics(self):
+        """
+        Gets the number of ionic steps and SCF iterations of the calculation
+        read by read_results().
+        
+        Returns
+        -------
+        statistics: dict or None
+            "ionic_steps" and "scf_iterations" (in all the ionic steps),
+            or None when vasprun.xml is not read.
+        """
+        if self._vasprun is None:
+            return None
+        steps = self._vasprun.ionic_steps
+        return {"ionic_steps": len(steps),
+                "scf_iterations": sum(len(step.get("electronic_steps", [])) for step in steps)}
+    
+    def get_trajectory(self):
+        """
+        Gets all the ionic steps of the calculation read by read_results().
+        
+        Returns
+        -------
+        trajectory: dict or None
+            Arrays of the trajectory given to TrajectoryStore.append(),
+            or None when vasprun.xml is not read or has no ionic step.
+        """
+        if self._vasprun is None or not self._vasprun.ionic_steps:
+            return None
+        return trajectory_from_vasprun(self._vasprun)
+    
+    def _prepare_restart(self, changes, steps, lwave=False):
+        """
+        Prepares the restart from the last state of the calculation,
+        that is the last structure (CONTCAR) and the charge density (CHGCAR)
+        or the wave functions (WAVECAR) if they are written.
+        WAVECAR is written by the calculations followed by a restart (LWAVE),
+        unless "lwave" is given in the calculator. When the changes do not give more
+        electronic steps (NELM) than the previous run, they are increased by half.
+        
+        Arguments
+        ---------
+        changes: dict
+            Changes of calculation configurations.
+        steps: int
+            Number of relaxation steps.
+        lwave: bool
+            If the restarted calculation writes WAVECAR for the next restart.
+        """
+        calculator = dict(self._calculator)
+        calculator.update(changes)
+        if self._maxiter is None:
+            self._maxiter = self._calculator.get("maxiter") or VASP_NELM
+        if (calculator.get("maxiter") or VASP_NELM) <= self._maxiter:
+            calculator["maxiter"] = self._maxiter + self._maxiter // 2
+        self._maxiter = calculator["maxiter"]
+        if lwave is True and calculator.get("lwave") is None:
+            calculator["lwave"] = True
+        if self._has_work_file("WAVECAR"):
+            calculator["istart"] = 1
+        if self._has_work_file("CHGCAR"):
+            calculator["icharg"] = 1
+        if self._has_work_file("CONTCAR"):
+            os.replace(self._work_file("CONTCAR"), self._work_file("POSCAR"))
+        self._write_incar(calculator)
+        if steps != 1:
+            with open(self._work_file("INCAR"), mode="a") as file:
+                file.write("NSW="+str(steps))
+    
     def _run_vasp(self, n_jobs):
         """
         Runs VASP calculation.
@@ -322,7 +517,8 @@ class Calculation_vasp(object):
         """
         cmd = "mpirun -np " + str(n_jobs) + " vasp &"
         devnull = open("/dev/null", "w")
-        subprocess.run(cmd.split(), stdout=devnull)
+        with self._tracer.span("run_vasp", n_jobs=n_jobs, **self._tags):
+            subprocess.run(cmd.split(), stdout=devnull, cwd=self._work_path)
     
     def _get_total_energy(self, vasprun):
         """
@@ -360,7 +556,7 @@ class Calculation_vasp(object):
         
         try:
             initial_istep = vasprun.ionic_steps[0]
-            if initial_istep["electronic_steps"] < vasprun.parameters["NELM"]:
+            if len(initial_istep["electronic_steps"]) < vasprun.parameters["NELM"]:
                 if initial_istep["e_wo_entrp"] != initial_istep[
                         'electronic_steps'][-1]["e_0_energy"]:
                     return float(initial_istep["e_wo_entrp"])
@@ -420,16 +616,21 @@ class Calculation_vasp(object):
     
     def _mv_output_files(self, backup_file_list):
         """
-        Moves output files to output path.
+        Moves output files to output path by in-process renames,
+        asynchronously when stage_out is given and the work directory is not
+        the current directory, which is removed after it.
         
         Arguments
         ---------
         backup_file_list: tuple
             File list moving to output path.
         """
-        for file in backup_file_list:
-            if os.path.exists(self._output_path):
-                os.makedirs(self._output_path, exist_ok=True)
-            cmd = "mv " + file + " " + self._output_path
-            subprocess.run(cmd.split())
-    
+        remove_source = self._work_path != os.curdir
+        archive = self._stage_out.archive if self._stage_out is not None else None
+        with self._tracer.span("stage_out", **self._tags):
+            if self._stage_out is not None and remove_source:
+                self._stage_out.submit(self._work_path, self._output_path, backup_file_list,
+                                       remove_source=remove_source)
+            elif self._output_path is not None or remove_source:
+                stage_files(self._work_path, self._output_path, backup_file_list,
+                            archive=archive, remove_source=remove_source)
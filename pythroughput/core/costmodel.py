@@ -0,0 +1,121 @@
+# coding: utf-8
+# Copyright (c) 2018-2019, Taku MURAKAMI. All rights reserved.
+# Distributed under the terms of the BSD 3-clause License.
+
+import logging
+import numpy
+from pymatgen.symmetry.analyzer import SpacegroupAnalyzer
+
+"""
+Symmetry detection and cost model of first-principles calculation.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def get_kpoints_size(kpts):
+    """
+    Gets the size of k-point mesh from calculation configulation of KPOINTS.
+    
+    Arguments
+    ---------
+    kpts: dict or None
+        Calculation configulation of KPOINTS as ASE format.
+    
+    Returns
+    -------
+    tuple
+        The number of KPOINTS aligned to a, b and c direction.
+    """
+    if kpts is None or kpts.get("size") is None:
+        return (1, 1, 1)
+    return tuple(int(size) for size in kpts["size"])
+
+
+def count_time_reversal_kpoints(kpts):
+    """
+    Counts k-points of the mesh reduced only by time-reversal symmetry
+    (k and -k are equivalent), which VASP uses without symmetry (ISYM = 0).
+    
+    Arguments
+    ---------
+    kpts: dict or None
+        Calculation configulation of KPOINTS as ASE format.
+    
+    Returns
+    -------
+    int
+        Number of irreducible k-points.
+    """
+    size = get_kpoints_size(kpts)
+    gamma = kpts is None or kpts.get("gamma") is not False
+    # k-points equal to -k (2k is a reciprocal lattice vector) are not paired.
+    # A gamma-centered mesh has 2 of them in each even direction, and 1 in each odd one.
+    # A Monkhorst-Pack mesh has none in each even direction, since it is shifted.
+    num_self = 1
+    for n in size:
+        if n % 2 == 0:
+            num_self *= 2 if gamma else 0
+    return (int(numpy.prod(size)) + num_self) // 2
+
+
+def detect_symmetry(struct, kpts=None, symprec=1e-3):
+    """
+    Detects symmetry of the structure by spglib,
+    and counts irreducible k-points of the mesh.
+    
+    Arguments
+    ---------
+    struct: pymatgen.Structure
+        Atomic structure itself.
+    kpts: dict or None
+        Calculation configulation of KPOINTS as ASE format.
+    symprec: float
+        Tolerance of symmetry detection (angstrom).
+    
+    Returns
+    -------
+    symmetry: dict
+        "spacegroup": International number of the space group,
+        "num_operations": Number of symmetry operations,
+        "num_kpoints": Number of irreducible k-points,
+        and "num_kpoints_full": Number of k-points in the full mesh.
+    """
+    size = get_kpoints_size(kpts)
+    gamma = kpts is None or kpts.get("gamma") is not False
+    # Monkhorst-Pack meshes of even size are shifted from gamma point.
+    shift = [0 if gamma or n % 2 == 1 else 1 for n in size]
+    try:
+        analyzer = SpacegroupAnalyzer(struct, symprec=symprec)
+        spacegroup = analyzer.get_space_group_number()
+        num_operations = len(analyzer.get_symmetry_operations())
+        num_kpoints = len(analyzer.get_ir_reciprocal_mesh(size, is_shift=shift))
+    except (TypeError, ValueError) as error:
+        logger.warning("Symmetry is not detected: %s", error)
+        spacegroup = 1
+        num_operations = 1
+        num_kpoints = int(numpy.prod(size))
+    return {"spacegroup": spacegroup,
+            "num_operations": num_operations,
+            "num_kpoints": num_kpoints,
+            "num_kpoints_full": int(numpy.prod(size))}
+
+
+def estimate_cost(num_sites, num_kpoints):
+    """
+    Estimates relative cost of first-principles calculation, which is
+    proportional to the number of k-points and the cube of system size.
+    
+    Arguments
+    ---------
+    num_sites: int
+        Number of sites in the structure.
+    num_kpoints: int
+        Number of (irreducible) k-points.
+    
+    Returns
+    -------
+    float
+        Relative cost, 1.0 for a single site at a single k-point.
+    """
+    return float(num_kpoints) * float(num_sites)**3
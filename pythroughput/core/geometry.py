@@ -0,0 +1,216 @@
+# coding: utf-8
+# Copyright (c) 2018-2019, Taku MURAKAMI. All rights reserved.
+# Distributed under the terms of the BSD 3-clause License.
+
+import logging
+import itertools
+import numpy
+
+"""
+Geometry sanity filter applied before first-principles calculation.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def min_distances(lattices, frac_coords, cutoff):
+    """
+    Calculates the minimum interatomic distance of each structure, including
+    periodic images, by the cell-list neighbour search vectorized over structures.
+    
+    Atoms are binned into cells in fractional space, whose interplanar spacings
+    are not shorter than "cutoff", so only pairs in neighbouring cells are compared.
+    The number of cells is limited to a few times the number of atoms, so both
+    cost and memory are linear in the number of atoms.
+    
+    Arguments
+    ---------
+    lattices: numpy.ndarray
+        Lattice matrices (N x 3 x 3).
+    frac_coords: numpy.ndarray
+        Fractional coordinates (N x natoms x 3).
+    cutoff: float
+        Cutoff distance (angstrom).
+    
+    Returns
+    -------
+    numpy.ndarray
+        Minimum interatomic distances (N), inf when no pair is closer than "cutoff".
+    """
+    lattices = numpy.asarray(lattices, dtype=numpy.float64)
+    frac_coords = numpy.asarray(frac_coords, dtype=numpy.float64)
+    num, natoms = frac_coords.shape[:2]
+    distances = numpy.full(num, numpy.inf)
+    if num == 0 or natoms == 0:
+        return distances
+    
+    spacing = 1.0 / numpy.linalg.norm(numpy.linalg.inv(lattices), axis=1)
+    max_ncells = max(int(round((4 * natoms) ** (1.0 / 3.0))), 1)
+    ncells = numpy.clip(numpy.floor(spacing / cutoff), 1, max_ncells).astype(numpy.int64)
+    # Neighbouring cells within "cutoff", more than one for thin cells,
+    # so structures are grouped by the reach not to search far for all of them.
+    reaches = numpy.max(numpy.ceil(cutoff * ncells / spacing - 1e-8), axis=1).astype(int)
+    for reach in numpy.unique(reaches):
+        group = numpy.flatnonzero(reaches == reach)
+        distances[group] = _search_cells(lattices[group], frac_coords[group],
+                                         ncells[group], max(int(reach), 1))
+    distances[distances >= cutoff] = numpy.inf
+    return distances
+
+
+def _search_cells(lattices, frac_coords, ncells, reach):
+    """
+    Searches the minimum interatomic distances in cells within "reach".
+    """
+    num, natoms = frac_coords.shape[:2]
+    frac_coords = frac_coords - numpy.floor(frac_coords)
+    cells = numpy.minimum((frac_coords * ncells[:, numpy.newaxis, :]).astype(numpy.int64),
+                          ncells[:, numpy.newaxis, :] - 1)
+    max_cells = int(numpy.max(numpy.prod(ncells, axis=1)))
+    models = numpy.repeat(numpy.arange(num), natoms)
+    cells = cells.reshape(-1, 3)
+    ncells_atoms = ncells[models]
+    keys = models * max_cells + _cell_ids(cells, ncells_atoms)
+    order = numpy.argsort(keys, kind="stable")
+    # Atoms in the cell "key" are order[heads[key]:heads[key]+sizes[key]].
+    sizes = numpy.bincount(keys, minlength=num * max_cells)
+    heads = numpy.cumsum(sizes) - sizes
+    coords = numpy.einsum("nai,nij->naj", frac_coords, lattices).reshape(-1, 3)
+    atom_lattices = lattices[models]
+    squared = numpy.full(num, numpy.inf)
+    
+    # Pairs found by opposite offsets are the same, so only half of them are searched.
+    for offset in itertools.product(range(-reach, reach + 1), repeat=3):
+        if offset < (0, 0, 0):
+            continue
+        neighbours = cells + offset
+        wraps = numpy.floor_divide(neighbours, ncells_atoms)
+        neighbour_keys = models * max_cells + _cell_ids(neighbours - wraps * ncells_atoms,
+                                                        ncells_atoms)
+        starts = heads[neighbour_keys]
+        counts = sizes[neighbour_keys]
+        if counts.sum() == 0:
+            continue
+        sources = numpy.repeat(numpy.arange(len(keys)), counts)
+        ends = numpy.cumsum(counts)
+        targets = order[numpy.repeat(starts - ends + counts, counts) +
+                        numpy.arange(ends[-1])]
+        shifts = numpy.einsum("ai,aij->aj", wraps.astype(numpy.float64), atom_lattices)
+        vectors = coords[targets] - coords[sources] + shifts[sources]
+        lengths = numpy.einsum("pj,pj->p", vectors, vectors)
+        # The atom itself is excluded, but not its periodic images.
+        if offset == (0, 0, 0):
+            lengths[sources == targets] = numpy.inf
+        numpy.minimum.at(squared, models[sources], lengths)
+    return numpy.sqrt(squared)
+
+
+def _cell_ids(cells, ncells):
+    """
+    Converts indices of cells along axes into flat indices.
+    """
+    return (cells[:, 0] * ncells[:, 1] + cells[:, 1]) * ncells[:, 2] + cells[:, 2]
+
+
+class GeometryFilter(object):
+    """
+    Geometry sanity filter, which rejects structures with atoms almost on top
+    of each other, unreasonable volume per atom, or nearly singular lattice
+    before they are sent to first-principles calculation.
+    
+    Arguments
+    ---------
+    min_distance: float
+        The lower limit of interatomic distance (angstrom).
+    volume_per_atom: tuple
+        The lower and upper limits of volume per atom (angstrom^3).
+    max_condition: float
+        The upper limit of condition number of lattice matrix.
+    chunk_size: int
+        Number of structures checked at once.
+    """
+    
+    def __init__(self, min_distance=0.5, volume_per_atom=(2.0, 150.0), max_condition=100.0,
+                 chunk_size=4096):
+        self.min_distance = min_distance
+        self.volume_per_atom = volume_per_atom
+        self.max_condition = max_condition
+        self.chunk_size = chunk_size
+    
+    def check_arrays(self, lattices, frac_coords):
+        """
+        Checks geometry of structures given as arrays.
+        
+        Arguments
+        ---------
+        lattices: numpy.ndarray
+            Lattice matrices (N x 3 x 3).
+        frac_coords: numpy.ndarray
+            Fractional coordinates (N x natoms x 3).
+        
+        Returns
+        -------
+        reasons: list
+            Reason of rejection of each structure, or None if it is valid.
+        """
+        lattices = numpy.asarray(lattices, dtype=numpy.float64).reshape(-1, 3, 3)
+        natoms = numpy.shape(frac_coords)[1]
+        reasons = []
+        for start in range(0, len(lattices), self.chunk_size):
+            chunk = slice(start, start + self.chunk_size)
+            conditions = numpy.linalg.cond(lattices[chunk])
+            volumes = numpy.abs(numpy.linalg.det(lattices[chunk])) / max(natoms, 1)
+            lattice_valid = ((conditions <= self.max_condition) &
+                             (self.volume_per_atom[0] <= volumes) &
+                             (volumes <= self.volume_per_atom[1]))
+            distances = numpy.full(len(conditions), numpy.inf)
+            distances[lattice_valid] = min_distances(
+                lattices[chunk][lattice_valid],
+                numpy.asarray(frac_coords[chunk])[lattice_valid], self.min_distance)
+            for condition, volume, distance in zip(conditions, volumes, distances):
+                if not condition <= self.max_condition:
+                    reasons.append("Condition number of lattice {:.3g}".format(condition))
+                elif not self.volume_per_atom[0] <= volume <= self.volume_per_atom[1]:
+                    reasons.append("Volume per atom {:.3g} A^3".format(volume))
+                elif distance < self.min_distance:
+                    reasons.append("Interatomic distance {:.3g} A".format(distance))
+                else:
+                    reasons.append(None)
+        return reasons
+    
+    def check(self, struct):
+        """
+        Checks geometry of a structure.
+        
+        Arguments
+        ---------
+        struct: pymatgen.Structure
+            Atomic structure itself.
+        
+        Returns
+        -------
+        str or None
+            Reason of rejection, or None if the structure is valid.
+        """
+        return self.check_arrays(struct.lattice.matrix[numpy.newaxis],
+                                 struct.frac_coords[numpy.newaxis])[0]
+    
+    def check_batch(self, batch):
+        """
+        Checks geometry of all the models in a batch without materializing them.
+        Swapped species do not matter, since the check does not depend on species.
+        
+        Arguments
+        ---------
+        batch: ModelBatch
+            Batch of models, or any source with names(), lattices and frac_coords.
+        
+        Returns
+        -------
+        invalid: dict
+            Reasons of rejection, which consists of the name of
+            the rejected models as the keys.
+        """
+        reasons = self.check_arrays(batch.lattices, batch.frac_coords)
+        return {struct_name: reason for struct_name, reason in zip(batch.names(), reasons)
+                if reason is not None}
@@ -0,0 +1,145 @@
+# coding: utf-8
+# Copyright (c) 2018-2019, Taku MURAKAMI. All rights reserved.
+# Distributed under the terms of the BSD 3-clause License.
+
+import logging
+import numpy
+try:
+    from gpaw import mpi
+except ImportError:
+    mpi = None
+
+"""
+Groups of MPI ranks running GPAW calculations concurrently in one MPI world.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def split_ranks(size, group_size):
+    """
+    Splits ranks of the world into groups. When the size of the world is not
+    divisible by group_size, the remaining ranks are spread over the groups.
+    
+    Arguments
+    ---------
+    size: int
+        Number of ranks in the world.
+    group_size: int
+        The lower limit of the number of ranks in a group.
+    
+    Returns
+    -------
+    groups: list
+        Lists of ranks in each group, e.g. [[0, 1, 2], [3, 4]] for (5, 2).
+    """
+    if group_size < 1:
+        raise ValueError("group_size must be positive.")
+    num_groups = max(size // group_size, 1)
+    return [ranks.tolist() for ranks in numpy.array_split(numpy.arange(size), num_groups)]
+
+
+class MpiGroups(object):
+    """
+    Groups of MPI ranks splitting the world communicator, each of which runs
+    GPAW calculations with its sub-communicator (the "communicator" argument of GPAW).
+    
+    Every group takes every (number of groups)-th structure in the order of
+    the structures independently, so no rank coordinates the others during run,
+    and results are gathered from the leaders (rank 0 of each group) at the end.
+    
+    Arguments
+    ---------
+    group_size: int
+        Number of ranks running a calculation. Small cells are run efficiently
+        by a few ranks, e.g. 4 ranks x 16 groups under "mpirun -np 64".
+    world: communicator or None
+        World communicator of GPAW. Default: gpaw.mpi.world
+    broadcast: function or None
+        Function broadcasting a Python object, (object, root, communicator) -> object.
+        Default: gpaw.mpi.broadcast
+    
+    Parameters
+    ----------
+    groups: list
+        Lists of ranks in each group.
+    index: int
+        Index of the group of this rank.
+    comm: communicator
+        Sub-communicator of the group of this rank.
+    """
+    
+    def __init__(self, group_size=1, world=None, broadcast=None):
+        if world is None or broadcast is None:
+            if mpi is None:
+                raise ModuleNotFoundError("MpiGroups requires GPAW.")
+            world = mpi.world if world is None else world
+            broadcast = mpi.broadcast if broadcast is None else broadcast
+        self.world = world
+        self._broadcast = broadcast
+        self.groups = split_ranks(world.size, group_size)
+        self.index = None
+        self.comm = None
+        # Creation of communicators is collective, so all the ranks create all the groups.
+        for index, ranks in enumerate(self.groups):
+            comm = world.new_communicator(numpy.array(ranks))
+            if world.rank in ranks:
+                self.index = index
+                self.comm = comm
+        logger.info("Rank %d runs in group %d of %d ranks.", world.rank, self.index,
+                    len(self.groups[self.index]))
+    
+    @property
+    def num_groups(self):
+        """
+        Number of the groups.
+        """
+        return len(self.groups)
+    
+    def is_leader(self):
+        """
+        Is this rank the leader (rank 0) of its group, which writes outputs of the group.
+        """
+        return self.world.rank == self.groups[self.index][0]
+    
+    def is_root(self):
+        """
+        Is this rank the root (rank 0) of the world.
+        """
+        return self.world.rank == 0
+    
+    def is_assigned(self, position):
+        """
+        Is the structure calculated by the group of this rank.
+        
+        Arguments
+        ---------
+        position: int
+            Position of the structure in the order of the structures.
+        
+        Returns
+        -------
+        bool
+        """
+        return position % self.num_groups == self.index
+    
+    def gather(self, results):
+        """
+        Gathers results of all the groups, which are sent by their leaders.
+        
+        Arguments
+        ---------
+        results: dict
+            Calculation results of the group of this rank.
+        
+        Returns
+        -------
+        gathered: dict
+            Calculation results of all the groups, given on every rank
+            including rank 0 of the world.
+        """
+        gathered = {}
+        for ranks in self.groups:
+            part = results if self.world.rank == ranks[0] else None
+            gathered.update(self._broadcast(part, ranks[0], self.world))
+        return gathered
@@ -0,0 +1,262 @@
+# coding: utf-8
+# Copyright (c) 2018-2019, Taku MURAKAMI. All rights reserved.
+# Distributed under the terms of the BSD 3-clause License.
+
+import logging
+import os
+import re
+import json
+import math
+import time
+import threading
+
+"""
+Tuning of parallelization of VASP (KPAR and NCORE) with the table of measured timings.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def read_nelect(potcar_filename, struct):
+    """
+    Reads the number of valence electrons of the structure from ZVAL in POTCAR,
+    in which potentials are written in the order of struct.symbol_set.
+    
+    Arguments
+    ---------
+    potcar_filename: str
+        Path to POTCAR.
+    struct: pymatgen.Structure
+        Atomic structure itself.
+    
+    Returns
+    -------
+    float or None
+        Number of electrons, or None when POTCAR is not read.
+    """
+    try:
+        with open(potcar_filename) as file:
+            valences = [float(value) for value in
+                        re.findall(r"ZVAL\s*=\s*([-+0-9.Ee]+)", file.read())]
+    except (OSError, ValueError):
+        return None
+    symbols = struct.symbol_set
+    if len(valences) != len(symbols):
+        return None
+    composition = struct.composition
+    return sum(valence * composition[symbol] for valence, symbol in zip(valences, symbols))
+
+
+def estimate_nbands(nelect, num_sites):
+    """
+    Estimates the number of bands by the default of VASP,
+    max(NELECT/2 + NIONS/2, 0.6 NELECT) in non-spin-polarized calculation.
+    
+    Arguments
+    ---------
+    nelect: float or None
+        Number of electrons. When it is None, 4 electrons per site are assumed.
+    num_sites: int
+        Number of sites in the structure.
+    
+    Returns
+    -------
+    int
+        Number of bands.
+    """
+    if nelect is None:
+        nelect = 4.0 * num_sites
+    return int(math.ceil(max(0.6 * nelect, nelect / 2.0 + num_sites / 2.0)))
+
+
+def get_divisors(num):
+    """
+    Gets the divisors of the number in ascending order.
+    """
+    return [i for i in range(1, num + 1) if num % i == 0]
+
+
+class ParallelTuner(object):
+    """
+    Tuner of parallelization of VASP, which chooses KPAR and NCORE from
+    the number of MPI ranks, (irreducible) k-points and bands.
+    NPAR is not written, since it is given by VASP as (ranks / KPAR) / NCORE.
+    
+    Candidates are ranked by the cost model, in which k-points are distributed
+    over KPAR groups and bands over the ranks in each group, and NCORE close to
+    the square root of the ranks in the group is preferred. The best "explore"
+    candidates of each class of jobs, (ranks, k-points, bands rounded to a power of 2),
+    are tried in turn, and then the fastest one in the table of measured timings
+    (second per SCF iteration) is chosen for the later jobs of the class.
+    
+    Arguments
+    ---------
+    path: str or None
+        Path to the JSON-lines table of measured timings, which is shared by
+        campaigns. When it is None, timings are kept only in memory.
+    explore: int
+        Number of candidates tried in each class of jobs.
+    min_bands_per_rank: int
+        The lower limit of bands per rank, under which band parallelization is
+        regarded as inefficient.
+    """
+    
+    def __init__(self, path=None, explore=3, min_bands_per_rank=4):
+        self.path = path
+        self.explore = explore
+        self.min_bands_per_rank = min_bands_per_rank
+        self._timings = {}
+        # Timings are recorded by concurrent calculations in threads.
+        self._lock = threading.Lock()
+        if path is not None:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            if os.path.exists(path):
+                self._load()
+    
+    def _load(self):
+        """
+        Loads the measured timings from the table.
+        """
+        with open(self.path) as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    logger.warning("Broken line in %s is ignored.", self.path)
+                    continue
+                self._add(tuple(entry["key"]), (entry["kpar"], entry["ncore"]),
+                          entry["seconds_per_scf"])
+    
+    def _add(self, key, settings, seconds):
+        self._timings.setdefault(key, {}).setdefault(tuple(settings), []).append(seconds)
+    
+    def get_key(self, n_ranks, num_kpoints, nbands):
+        """
+        Gets the class of the job, in which the number of bands is rounded to a power of 2.
+        
+        Returns
+        -------
+        tuple
+            (ranks, k-points, bands).
+        """
+        return (int(n_ranks), int(num_kpoints),
+                2 ** int(round(math.log(max(nbands, 1), 2))))
+    
+    def estimate_time(self, n_ranks, num_kpoints, nbands, kpar, ncore):
+        """
+        Estimates relative time of an SCF iteration by the cost model.
+        
+        Returns
+        -------
+        float
+            Relative time, 1.0 for a single rank.
+        """
+        ranks = n_ranks // kpar
+        kpoints = math.ceil(num_kpoints / kpar)
+        # Bands are not shared well by too many ranks.
+        efficiency = min(1.0, nbands / float(ranks * self.min_bands_per_rank))
+        penalty = 1.0 + 0.1 * abs(math.log(ncore, 2) - math.log(math.sqrt(ranks), 2))
+        return kpoints * penalty / (ranks * efficiency) / max(num_kpoints, 1)
+    
+    def get_candidates(self, n_ranks, num_kpoints, nbands):
+        """
+        Gets the candidates of KPAR and NCORE ranked by the cost model.
+        
+        Arguments
+        ---------
+        n_ranks: int
+            Number of MPI ranks of VASP.
+        num_kpoints: int
+            Number of (irreducible) k-points.
+        nbands: int
+            Number of bands.
+        
+        Returns
+        -------
+        list
+            Pairs of (KPAR, NCORE), from the best.
+        """
+        candidates = []
+        for kpar in get_divisors(n_ranks):
+            if kpar > max(num_kpoints, 1):
+                break
+            for ncore in get_divisors(n_ranks // kpar):
+                cost = self.estimate_time(n_ranks, num_kpoints, nbands, kpar, ncore)
+                candidates.append((cost, -kpar, ncore))
+        return [(-kpar, ncore) for cost, kpar, ncore in sorted(candidates)]
+    
+    def get_timings(self, n_ranks, num_kpoints, nbands):
+        """
+        Gets the measured timings of the class of the job.
+        
+        Returns
+        -------
+        dict
+            Mean second per SCF iteration keyed by (KPAR, NCORE).
+        """
+        with self._lock:
+            timings = self._timings.get(self.get_key(n_ranks, num_kpoints, nbands), {})
+            return {settings: sum(seconds) / len(seconds) for settings, seconds in timings.items()}
+    
+    def choose(self, n_ranks, num_kpoints, nbands):
+        """
+        Chooses KPAR and NCORE of the job.
+        
+        Arguments
+        ---------
+        n_ranks: int
+            Number of MPI ranks of VASP.
+        num_kpoints: int
+            Number of (irreducible) k-points.
+        nbands: int
+            Number of bands.
+        
+        Returns
+        -------
+        settings: dict
+            "kpar" and "ncore" in ASE format.
+        """
+        candidates = self.get_candidates(n_ranks, num_kpoints, nbands)
+        timings = self.get_timings(n_ranks, num_kpoints, nbands)
+        untried = [settings for settings in candidates[:self.explore] if settings not in timings]
+        if untried:
+            kpar, ncore = untried[0]
+        else:
+            kpar, ncore = min(timings, key=timings.get)
+        return {"kpar": kpar, "ncore": ncore}
+    
+    def record(self, n_ranks, num_kpoints, nbands, settings, seconds, scf_iterations):
+        """
+        Records the measured timing of the job.
+        
+        Arguments
+        ---------
+        n_ranks: int
+            Number of MPI ranks of VASP.
+        num_kpoints: int
+            Number of (irreducible) k-points.
+        nbands: int
+            Number of bands.
+        settings: dict
+            "kpar" and "ncore" given by choose().
+        seconds: float
+            Elapsed time of VASP (second).
+        scf_iterations: int
+            Number of SCF iterations in all the ionic steps.
+        """
+        if not scf_iterations:
+            return
+        key = self.get_key(n_ranks, num_kpoints, nbands)
+        seconds_per_scf = seconds / scf_iterations
+        with self._lock:
+            self._add(key, (settings["kpar"], settings["ncore"]), seconds_per_scf)
+            if self.path is not None:
+                entry = {"key": list(key),
+                         "kpar": settings["kpar"],
+                         "ncore": settings["ncore"],
+                         "seconds_per_scf": seconds_per_scf,
+                         "time": time.time()}
+                with open(self.path, mode="a") as file:
+                    file.write(json.dumps(entry) + "\n")
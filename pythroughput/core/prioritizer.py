@@ -0,0 +1,482 @@
+# coding: utf-8
+# Copyright (c) 2018-2019, Taku MURAKAMI. All rights reserved.
+# Distributed under the terms of the BSD 3-clause License.
+
+import logging
+import math
+import numpy
+from pythroughput.model.fingerprintindex import fingerprint
+
+"""
+Surrogate-guided prioritization of the structures in a screening campaign.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def normal_cdf(values):
+    """
+    Cumulative distribution function of the standard normal distribution.
+    """
+    return numpy.array([0.5 * (1.0 + math.erf(value / math.sqrt(2.0)))
+                        for value in numpy.ravel(values)])
+
+
+def normal_ppf(probability):
+    """
+    Inverse of normal_cdf(), which is solved by bisection.
+    """
+    lower, upper = -10.0, 10.0
+    for i in range(64):
+        middle = 0.5 * (lower + upper)
+        if normal_cdf(middle)[0] < probability:
+            lower = middle
+        else:
+            upper = middle
+    return 0.5 * (lower + upper)
+
+
+class BayesianRidge(object):
+    """
+    Bayesian linear regression, in which precisions of the weights (alpha) and
+    the noise (beta) are given by maximizing the evidence (MacKay's updates).
+    Features are standardized by the statistics given to fit(), and replaced by
+    random Fourier features approximating the Gaussian (RBF) kernel, with which
+    the regression approximates a Gaussian process at the cost of num_features.
+    
+    Arguments
+    ---------
+    num_features: int
+        Number of random Fourier features. The regression is linear when it is 0.
+    length_scale: float or None
+        Length scale of the kernel in the standardized features.
+        Default: median distance between (at most 256) samples
+    random_state: int or None
+        Seed of the random Fourier features.
+    max_iter: int
+        The upper limit of iterations of the updates.
+    tol: float
+        Tolerance of relative changes of alpha and beta.
+    
+    Parameters
+    ----------
+    alpha: float
+        Precision of the weights.
+    beta: float
+        Precision of the noise.
+    calibration: float
+        Scale of the predictive deviation given by the leave-one-out errors.
+    """
+    
+    def __init__(self, num_features=256, length_scale=None, random_state=0,
+                 max_iter=100, tol=1e-4):
+        self.num_features = num_features
+        self.length_scale = length_scale
+        self.random_state = random_state
+        self.max_iter = max_iter
+        self.tol = tol
+        self.alpha = 1.0
+        self.beta = 1.0
+        self.calibration = 1.0
+        self._mean = None
+    
+    def fit(self, features, values, center=None, scale=None):
+        """
+        Fits the model.
+        
+        Arguments
+        ---------
+        features: numpy.ndarray
+            Features of the samples (samples x features).
+        values: numpy.ndarray
+            Target values of the samples.
+        center: numpy.ndarray or None
+            Center of standardization. Default: mean of features
+        scale: numpy.ndarray or None
+            Scale of standardization. Default: standard deviation of features
+        """
+        features = numpy.asarray(features, dtype=numpy.float64)
+        values = numpy.asarray(values, dtype=numpy.float64)
+        self._center = features.mean(axis=0) if center is None else center
+        scale = features.std(axis=0) if scale is None else scale
+        self._scale = numpy.where(scale > 1e-12, scale, 1.0)
+        self._offset = values.mean()
+        x = (features - self._center) / self._scale
+        self._weights = None
+        if self.num_features > 0:
+            length_scale = self.length_scale
+            rng = numpy.random.RandomState(self.random_state)
+            if length_scale is None:
+                samples = x[rng.permutation(len(x))[:256]]
+                distances = numpy.linalg.norm(samples[:, numpy.newaxis, :]
+                                              - samples[numpy.newaxis, :, :], axis=-1)
+                distances = distances[numpy.triu_indices(len(samples), k=1)]
+                length_scale = numpy.median(distances) if distances.size else 1.0
+            self._weights = (rng.standard_normal((x.shape[1], self.num_features))
+                             / max(length_scale, 1e-12))
+            self._phases = rng.uniform(0.0, 2.0 * numpy.pi, self.num_features)
+        x = self._expand(x)
+        y = values - self._offset
+        num = len(x)
+        
+        # Posterior is diagonal in the eigenvectors of the Gram matrix.
+        eigenvalues, vectors = numpy.linalg.eigh(numpy.dot(x.T, x))
+        eigenvalues = numpy.clip(eigenvalues, 0.0, None)
+        projection = numpy.dot(vectors.T, numpy.dot(x.T, y))
+        alpha = 1.0
+        beta = 1.0 / max(y.var(), 1e-12)
+        for i in range(self.max_iter):
+            mean = numpy.dot(vectors, beta * projection / (alpha + beta * eigenvalues))
+            gamma = numpy.sum(beta * eigenvalues / (alpha + beta * eigenvalues))
+            residual = numpy.sum((y - numpy.dot(x, mean)) ** 2)
+            new_alpha = gamma / max(numpy.dot(mean, mean), 1e-12)
+            new_beta = max(num - gamma, 1e-6) / max(residual, 1e-12)
+            converged = (abs(new_alpha - alpha) <= self.tol * alpha
+                         and abs(new_beta - beta) <= self.tol * beta)
+            alpha, beta = new_alpha, new_beta
+            if converged:
+                break
+        self.alpha = alpha
+        self.beta = beta
+        self._covariance = numpy.dot(vectors / (alpha + beta * eigenvalues), vectors.T)
+        self._mean = beta * numpy.dot(self._covariance, numpy.dot(x.T, y))
+        
+        # Predictive deviation is scaled up when the exact leave-one-out errors are
+        # larger than it, e.g. in a model too confident with few samples.
+        variances = numpy.einsum("ij,jk,ik->i", x, self._covariance, x)
+        leverages = numpy.clip(beta * variances, 0.0, 1.0 - 1e-6)
+        errors = (y - numpy.dot(x, self._mean)) / (1.0 - leverages)
+        scores = errors ** 2 / (1.0 / beta + variances / (1.0 - leverages))
+        self.calibration = max(1.0, numpy.sqrt(numpy.mean(scores))) if num > 1 else 1.0
+        return self
+    
+    def _expand(self, x):
+        """
+        Maps the standardized features to the random Fourier features.
+        """
+        if self._weights is None:
+            return x
+        waves = numpy.cos(numpy.dot(x, self._weights) + self._phases)
+        return numpy.sqrt(2.0 / self.num_features) * waves
+    
+    def predict(self, features):
+        """
+        Predicts the values.
+        
+        Arguments
+        ---------
+        features: numpy.ndarray
+            Features of the samples (samples x features).
+        
+        Returns
+        -------
+        mean: numpy.ndarray
+            Predicted values.
+        std: numpy.ndarray
+            Standard deviation of the predictions, including the noise.
+        """
+        x = (numpy.asarray(features, dtype=numpy.float64) - self._center) / self._scale
+        x = self._expand(x)
+        mean = numpy.dot(x, self._mean) + self._offset
+        variance = 1.0 / self.beta + numpy.einsum("ij,jk,ik->i", x, self._covariance, x)
+        return mean, self.calibration * numpy.sqrt(variance)
+
+
+class SurrogatePrioritizer(object):
+    """
+    Prioritizer of the structures in a screening campaign for low energies,
+    which fits the surrogate model (BayesianRidge) to the results streamed in,
+    reorders the remaining structures by the lower confidence bound of
+    the predicted value (mean - kappa x std), and tells when the target is met.
+    
+    The target is met by default when the lowest top_k values are found,
+    i.e. the probability that any remaining structure has a value lower than
+    the top_k-th observed one (the sum of the probabilities of the structures)
+    is at most 1 - confidence. The first min_observations structures are chosen
+    by farthest-point sampling in the feature space to seed the surrogate model.
+    
+    Features are the atomic fractions of the elements followed by the fingerprint of
+    the structure (pythroughput.model.fingerprintindex.fingerprint()), and the value
+    is the total energy per atom, or formation energy per atom if references are given.
+    
+    Arguments
+    ---------
+    top_k: int
+        Number of structures with the lowest values to be found.
+    confidence: float
+        Confidence of the target, e.g. 0.9.
+    kappa: float or None
+        Weight of the uncertainty in the order. Default: that of two-sided confidence
+    min_observations: int
+        Number of results before the surrogate model is used.
+    key: str
+        Key of the energy in the results.
+    references: dict or None
+        Energies per atom of the elements (e.g. {"Al": -3.74}), which are subtracted.
+    target: function or None
+        User-defined target, (prioritizer, names of the remaining structures) -> bool,
+        which replaces that of top_k.
+    featurizer: function or None
+        Function giving features of a structure, pymatgen.Structure -> numpy.ndarray.
+        Default: fingerprint() with cutoff and nbins
+    cutoff: float
+        Cutoff distance of the fingerprint (angstrom).
+    nbins: int
+        Number of bins of the fingerprint.
+    num_features: int
+        Number of random Fourier features of the surrogate model.
+    
+    Parameters
+    ----------
+    values: dict
+        Observed values keyed by the name of the structures.
+    model: BayesianRidge or None
+        Surrogate model fitted to the observed values.
+    """
+    
+    def __init__(self, top_k=10, confidence=0.9, kappa=None, min_observations=8,
+                 key="total_energy", references=None, target=None, featurizer=None,
+                 cutoff=6.0, nbins=48, num_features=256):
+        if top_k < 1:
+            raise ValueError("top_k must be positive.")
+        if not 0.0 < confidence < 1.0:
+            raise ValueError("confidence must be between 0 and 1.")
+        self.top_k = top_k
+        self.confidence = confidence
+        self.kappa = normal_ppf(0.5 + 0.5 * confidence) if kappa is None else kappa
+        self.min_observations = max(min_observations, 2)
+        self.key = key
+        self.references = references
+        self.target = target
+        self.featurizer = featurizer
+        self.cutoff = cutoff
+        self.nbins = nbins
+        self.num_features = num_features
+        self.values = {}
+        self.model = None
+        self._elements = []
+        self._features = {}
+        self._compositions = {}
+        self._center = None
+        self._scale = None
+        self._fitted = 0
+    
+    @property
+    def num_observations(self):
+        """
+        Number of observed values.
+        """
+        return len(self.values)
+    
+    def add_candidates(self, structs):
+        """
+        Adds the candidates of the campaign, whose features are calculated.
+        
+        Arguments
+        ---------
+        structs: iterable
+            Pairs of the name of the structure and pymatgen.Structure,
+            which are featurized one by one and not kept.
+        """
+        elements = set(self._elements)
+        for struct_name, struct in structs:
+            composition = struct.composition.fractional_composition
+            self._compositions[struct_name] = (
+                struct.num_sites, {str(element): composition[element] for element in composition})
+            elements.update(self._compositions[struct_name][1])
+            self._features[struct_name] = self._featurize(struct)
+        self._elements = sorted(elements)
+        matrix = self._get_features(list(self._features))
+        self._center = matrix.mean(axis=0)
+        self._scale = matrix.std(axis=0)
+        self._fitted = 0
+    
+    def _featurize(self, struct):
+        """
+        Gets features of the structure given by the featurizer.
+        """
+        if self.featurizer is None:
+            features = fingerprint(struct, self.cutoff, self.nbins)
+        else:
+            features = self.featurizer(struct)
+        return numpy.asarray(features, dtype=numpy.float64)
+    
+    def _get_features(self, names):
+        """
+        Gets features of the structures, atomic fractions followed by
+        those given by the featurizer.
+        """
+        rows = []
+        for struct_name in names:
+            fractions = self._compositions[struct_name][1]
+            rows.append(numpy.concatenate([
+                [fractions.get(element, 0.0) for element in self._elements],
+                self._features[struct_name]]))
+        return numpy.array(rows, dtype=numpy.float64).reshape(len(rows), -1)
+    
+    def get_value(self, struct_name, results):
+        """
+        Gets the value of the results, which is energy per atom.
+        
+        Arguments
+        ---------
+        struct_name: str
+            Name of the structure.
+        results: dict, ResultView or None
+            Calculation results.
+        
+        Returns
+        -------
+        float or None
+            Value, or None when the results have no energy, e.g. unconverged calculation.
+        """
+        if not hasattr(results, "get") or struct_name not in self._compositions:
+            return None
+        energy = results.get(self.key)
+        if isinstance(energy, bool) or not isinstance(energy, (int, float, numpy.floating)):
+            return None
+        if not math.isfinite(energy):
+            return None
+        num_sites, fractions = self._compositions[struct_name]
+        value = energy / num_sites
+        if self.references is not None:
+            value -= sum(fraction * self.references[element]
+                         for element, fraction in fractions.items())
+        return value
+    
+    def observe(self, struct_name, results):
+        """
+        Observes results of the calculated structure.
+        
+        Arguments
+        ---------
+        struct_name: str
+            Name of the structure, which is one of the candidates.
+        results: dict, ResultView or None
+            Calculation results.
+        """
+        value = self.get_value(struct_name, results)
+        if value is None:
+            logger.debug("%s has no value for the surrogate model.", struct_name)
+            return
+        self.values[struct_name] = value
+    
+    def _fit(self):
+        """
+        Fits the surrogate model to the observed values if it is out of date.
+        """
+        if self.num_observations < self.min_observations:
+            return False
+        if self._fitted != self.num_observations:
+            names = list(self.values)
+            self.model = BayesianRidge(self.num_features).fit(self._get_features(names),
+                                             [self.values[name] for name in names],
+                                             self._center, self._scale)
+            self._fitted = self.num_observations
+        return True
+    
+    def predict(self, names):
+        """
+        Predicts the values of the structures.
+        
+        Arguments
+        ---------
+        names: list
+            Names of the structures, which are the candidates.
+        
+        Returns
+        -------
+        mean: numpy.ndarray
+            Predicted values.
+        std: numpy.ndarray
+            Standard deviation of the predictions.
+        """
+        if not self._fit():
+            raise ValueError("{} results are required to predict values.".format(
+                self.min_observations))
+        return self.model.predict(self._get_features(names))
+    
+    def rank(self, names):
+        """
+        Reorders the remaining structures from the most promising.
+        
+        Arguments
+        ---------
+        names: list
+            Names of the remaining structures.
+        
+        Returns
+        -------
+        list
+            Names of the structures in the order of calculation.
+        """
+        names = list(names)
+        if not names:
+            return names
+        if not self._fit():
+            return self._spread(names, self.min_observations - self.num_observations)
+        mean, std = self.predict(names)
+        bounds = mean - self.kappa * std
+        return [names[i] for i in numpy.argsort(bounds, kind="stable")]
+    
+    def _spread(self, names, count):
+        """
+        Orders the first count structures by farthest-point sampling in the
+        standardized feature space from the observed ones, and the others as given.
+        """
+        scale = numpy.where(self._scale > 1e-12, self._scale, 1.0)
+        points = (self._get_features(names) - self._center) / scale
+        distances = numpy.full(len(names), numpy.inf)
+        if self.values:
+            observed = (self._get_features(list(self.values)) - self._center) / scale
+            for point in observed:
+                distances = numpy.minimum(distances,
+                                          numpy.linalg.norm(points - point, axis=1))
+        order = []
+        for i in range(min(count, len(names))):
+            chosen = int(numpy.argmax(distances))
+            order.append(chosen)
+            distances = numpy.minimum(distances,
+                                      numpy.linalg.norm(points - points[chosen], axis=1))
+            distances[order] = -1.0
+        chosen = set(order)
+        order += [i for i in range(len(names)) if i not in chosen]
+        return [names[i] for i in order]
+    
+    def get_top(self):
+        """
+        Gets the structures with the lowest observed values.
+        
+        Returns
+        -------
+        list
+            Pairs of the name of the structure and the value, at most top_k.
+        """
+        return sorted(self.values.items(), key=lambda item: item[1])[:self.top_k]
+    
+    def is_done(self, names):
+        """
+        Is the target of the campaign met.
+        
+        Arguments
+        ---------
+        names: list
+            Names of the remaining structures.
+        
+        Returns
+        -------
+        bool
+        """
+        names = list(names)
+        if self.target is not None:
+            return bool(self.target(self, names))
+        if self.num_observations < max(self.top_k, self.min_observations):
+            return False
+        if not names:
+            return True
+        threshold = self.get_top()[-1][1]
+        mean, std = self.predict(names)
+        probability = numpy.sum(normal_cdf((threshold - mean) / std))
+        logger.debug("Probability of a lower value in %d structures: %.3g",
+                     len(names), probability)
+        return probability <= 1.0 - self.confidence
@@ -0,0 +1,106 @@
+# coding: utf-8
+# Copyright (c) 2018-2019, Taku MURAKAMI. All rights reserved.
+# Distributed under the terms of the BSD 3-clause License.
+
+import logging
+import numbers
+
+"""
+Escalation ladder restarting unconverged calculations.
+"""
+
+logger = logging.getLogger(__name__)
+
+# Changes of calculation configurations (ASE format) of each restart.
+# ALGO is switched from VeryFast to more robust algorithms, with smaller
+# mixing and more electronic steps than the default (maxiter = 300).
+VASP_LADDER = ({"algo": "Normal", "maxiter": 400},
+               {"algo": "Normal", "amix": 0.2, "bmix": 0.0001, "maxiter": 600},
+               {"algo": "All", "amix": 0.1, "bmix": 0.0001, "maxiter": 800})
+GPAW_LADDER = ({"mixer": {"beta": 0.05, "nmaxold": 5, "weight": 50.0}, "maxiter": 500},
+               {"mixer": {"beta": 0.02, "nmaxold": 8, "weight": 100.0}, "maxiter": 1000})
+
+
+def is_unconverged(results):
+    """
+    Is the calculation unconverged.
+    
+    Arguments
+    ---------
+    results: dict or None
+        Calculation results.
+    
+    Returns
+    -------
+    bool
+        If any value of the results is "Unconverged".
+    """
+    if not isinstance(results, dict):
+        return False
+    return any(isinstance(value, str) and value == "Unconverged"
+               for value in results.values())
+
+
+class RestartLadder(object):
+    """
+    Escalation ladder of unconverged calculations, which are restarted
+    from their last state (CONTCAR and CHGCAR/WAVECAR in VASP, and the current
+    atoms and wave functions in GPAW) with more robust configurations.
+    
+    Arguments
+    ---------
+    vasp: tuple or None
+        Changes of calculation configurations of each restart of VASP calculation,
+        e.g. ({"algo": "Fast"}, {"algo": "All", "amix": 0.1}). A restart is given
+        more electronic steps (NELM) than the previous run in any case.
+    gpaw: tuple or None
+        Changes of calculation configurations of each restart of GPAW calculation.
+        "mixer" is given as the arguments of gpaw.Mixer.
+    max_attempts: int or None
+        The upper limit of restarts of each structure.
+    """
+    
+    def __init__(self, vasp=None, gpaw=None, max_attempts=None):
+        self.ladders = {"vasp": VASP_LADDER if vasp is None else tuple(vasp),
+                        "gpaw": GPAW_LADDER if gpaw is None else tuple(gpaw)}
+        if max_attempts is not None and not isinstance(max_attempts, numbers.Integral):
+            raise TypeError("max_attempts must be int.")
+        self.max_attempts = max_attempts
+    
+    def get_num_attempts(self, package):
+        """
+        Gets the number of restarts.
+        
+        Arguments
+        ---------
+        package: str
+            First-principles calculation package using in calculation.
+        
+        Returns
+        -------
+        int
+        """
+        num = len(self.ladders.get(package, ()))
+        if self.max_attempts is not None:
+            num = min(num, self.max_attempts)
+        return num
+    
+    def get_changes(self, package, attempt):
+        """
+        Gets changes of calculation configurations of the restart.
+        
+        Arguments
+        ---------
+        package: str
+            First-principles calculation package using in calculation.
+        attempt: int
+            Number of the restart, which starts from 1.
+        
+        Returns
+        -------
+        dict
+            Changes of calculation configurations.
+        """
+        if not 1 <= attempt <= self.get_num_attempts(package):
+            raise IndexError("No more restart of " + package + " calculation.")
+        return dict(self.ladders[package][attempt - 1])
@@ -0,0 +1,393 @@
+# coding: utf-8
+# Copyright (c) 2018-2019, Taku MURAKAMI. All rights reserved.
+# Distributed under the terms of the BSD 3-clause License.
+
+import logging
+import os
+import re
+import glob
+import json
+import pymatgen
+
+"""
+Lazy sources of structures used in high-throughput calculation.
+"""
+
+logger = logging.getLogger(__name__)
+
+# Beginning of a line of JSON-lines whose first key is "name",
+# and the number of bytes following it, in which the name is decoded.
+NAME_PREFIX = re.compile(rb'\s*\{\s*"name"\s*:\s*')
+NAME_SIZE = 4096
+
+
+class StructureRef(object):
+    """
+    Picklable reference to a structure, which is parsed only when load() is called.
+    
+    Arguments
+    ---------
+    loader: callable
+        Function returning pymatgen.Structure, which must be picklable
+        (module level function) to be sent to the other process.
+    args: tuple
+        Arguments of the loader.
+    """
+    
+    __slots__ = ("loader", "args")
+    
+    def __init__(self, loader, *args):
+        self.loader = loader
+        self.args = args
+    
+    def load(self):
+        """
+        Loads the structure.
+        
+        Returns
+        -------
+        pymatgen.Structure
+            Atomic structure itself.
+        """
+        return self.loader(*self.args)
+
+
+class StructureSource(object):
+    """
+    Base class of lazy structure sources.
+    
+    A source behaves like the dictionary of pymatgen.Structure given to
+    PyHighThroughput, which consists of the name of the structures as the keys
+    and the atomic structures as the values, but the structures are parsed
+    only when they are accessed. Subclasses implement names() and ref().
+    """
+    
+    def names(self):
+        """
+        Gets the names of structures without parsing them.
+        
+        Returns
+        -------
+        list
+            Names of structures.
+        """
+        raise NotImplementedError
+    
+    def ref(self, struct_name):
+        """
+        Gets the reference to the structure.
+        
+        Arguments
+        ---------
+        struct_name: str
+            Name of the structure.
+        
+        Returns
+        -------
+        StructureRef
+            Reference to the structure.
+        """
+        raise NotImplementedError
+    
+    def refs(self):
+        """
+        Gets the references to all the structures.
+        
+        Returns
+        -------
+        generator
+            Pairs of the name of the structure and StructureRef.
+        """
+        for struct_name in self.names():
+            yield struct_name, self.ref(struct_name)
+    
+    def keys(self):
+        """
+        Gets the names of structures, same as names().
+        """
+        return self.names()
+    
+    def items(self):
+        """
+        Gets pairs of the name and the structure, parsing each structure
+        only when the iteration reaches it.
+        
+        Returns
+        -------
+        generator
+            Pairs of the name of the structure and pymatgen.Structure.
+        """
+        for struct_name, ref in self.refs():
+            yield struct_name, ref.load()
+    
+    def values(self):
+        """
+        Gets the structures, parsing each structure lazily.
+        """
+        for struct_name, struct in self.items():
+            yield struct
+    
+    def __getitem__(self, struct_name):
+        return self.ref(struct_name).load()
+    
+    def __iter__(self):
+        return iter(self.names())
+    
+    def __len__(self):
+        return len(self.names())
+
+
+def load_file(path, fmt=None):
+    """
+    Parses a structure file.
+    
+    Arguments
+    ---------
+    path: str
+        Path to the structure file.
+    fmt: str or None
+        Format of the structure file, e.g. "cif" or "poscar".
+        When it is None, the format is guessed from the file name.
+    
+    Returns
+    -------
+    pymatgen.Structure
+        Atomic structure itself.
+    """
+    if fmt is None:
+        return pymatgen.Structure.from_file(path)
+    with open(path) as file:
+        return pymatgen.Structure.from_str(file.read(), fmt=fmt)
+
+
+def load_dict(struct_dict):
+    """
+    Builds a structure from dict-type representation.
+    
+    Arguments
+    ---------
+    struct_dict: dict
+        pymatgen.Structure with dict-type representation.
+    
+    Returns
+    -------
+    pymatgen.Structure
+        Atomic structure itself.
+    """
+    return pymatgen.Structure.from_dict(struct_dict)
+
+
+def get_json_line_name(line):
+    """
+    Gets the name of a line of JSON-lines. When "name" is the first key,
+    only the name is decoded, not the structure following it.
+    
+    Arguments
+    ---------
+    line: bytes
+        Line of the JSON-lines file.
+    
+    Returns
+    -------
+    str
+        Name of the structure.
+    """
+    match = NAME_PREFIX.match(line)
+    if match is not None:
+        try:
+            name, end = json.JSONDecoder().raw_decode(
+                line[match.end():match.end()+NAME_SIZE].decode("utf-8", errors="ignore"))
+        except ValueError:
+            pass
+        else:
+            if isinstance(name, str):
+                return name
+    return json.loads(line.decode("utf-8"))["name"]
+
+
+def load_json_line(path, offset):
+    """
+    Parses a structure written in a line of a JSON-lines file.
+    
+    Arguments
+    ---------
+    path: str
+        Path to the JSON-lines file.
+    offset: int
+        Byte offset of the line.
+    
+    Returns
+    -------
+    pymatgen.Structure
+        Atomic structure itself.
+    """
+    with open(path, mode="rb") as file:
+        file.seek(offset)
+        line = json.loads(file.readline().decode("utf-8"))
+    return pymatgen.Structure.from_dict(line["structure"])
+
+
+def load_structure(struct):
+    """
+    Returns given structure as it is.
+    """
+    return struct
+
+
+class FileSource(StructureSource):
+    """
+    Structure files, such as CIF and POSCAR.
+    
+    Arguments
+    ---------
+    paths: list or dict
+        List of paths to the structure files, whose base names are used as
+        the names of structures, or dict which consists of the name of
+        the structures as the keys and the paths as the values.
+    fmt: str or None
+        Format of the structure files. When it is None,
+        the format is guessed from the file names.
+    """
+    
+    def __init__(self, paths, fmt=None):
+        if isinstance(paths, dict):
+            self._paths = dict(paths)
+        else:
+            self._paths = {}
+            for path in paths:
+                struct_name = os.path.basename(path)
+                if struct_name in self._paths:
+                    raise ValueError("Duplicated structure name: " + struct_name)
+                self._paths[struct_name] = path
+        self.fmt = fmt
+    
+    def names(self):
+        return list(self._paths.keys())
+    
+    def ref(self, struct_name):
+        return StructureRef(load_file, self._paths[struct_name], self.fmt)
+    
+    def path(self, struct_name):
+        """
+        Gets the path to the structure file.
+        """
+        return self._paths[struct_name]
+
+
+class GlobSource(FileSource):
+    """
+    Structure files matching a glob pattern, e.g. "inputs/cif/*.cif".
+    
+    Arguments
+    ---------
+    pattern: str
+        Glob pattern of the structure files, "**" matches any directories.
+    fmt: str or None
+        Format of the structure files. When it is None,
+        the format is guessed from the file names.
+    """
+    
+    def __init__(self, pattern, fmt=None):
+        paths = sorted(path for path in glob.iglob(pattern, recursive=True)
+                       if os.path.isfile(path))
+        super(GlobSource, self).__init__(paths, fmt=fmt)
+
+
+class DirectorySource(FileSource):
+    """
+    Directory of structure files, e.g. POSCAR or CIF.
+    Only file names are listed at construction, using os.scandir.
+    
+    Arguments
+    ---------
+    path: str
+        Path to the directory.
+    fmt: str or None
+        Format of the structure files. When it is None,
+        the format is guessed from the file names.
+    """
+    
+    def __init__(self, path, fmt=None):
+        with os.scandir(path) as entries:
+            paths = sorted(entry.path for entry in entries
+                           if entry.is_file() and not entry.name.startswith("."))
+        super(DirectorySource, self).__init__(paths, fmt=fmt)
+
+
+class JsonLinesSource(StructureSource):
+    """
+    JSON-lines file whose each line is {"name": (name), "structure": (dict)},
+    where "structure" is pymatgen.Structure with dict-type representation.
+    The names are indexed without decoding the structures when "name" is
+    the first key of the lines, e.g. written by json.dumps of the dict above.
+    
+    Arguments
+    ---------
+    path: str
+        Path to the JSON-lines file.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self._offsets = None
+    
+    def _index(self):
+        """
+        Indexes byte offsets of the lines by their names.
+        """
+        if self._offsets is None:
+            self._offsets = {}
+            offset = 0
+            with open(self.path, mode="rb") as file:
+                for line in file:
+                    if line.strip():
+                        self._offsets[get_json_line_name(line)] = offset
+                    offset += len(line)
+        return self._offsets
+    
+    def names(self):
+        return list(self._index().keys())
+    
+    def ref(self, struct_name):
+        return StructureRef(load_json_line, self.path, self._index()[struct_name])
+    
+    def items(self):
+        """
+        Reads structures line by line without indexing the whole file.
+        """
+        with open(self.path) as file:
+            for line in file:
+                if line.strip():
+                    line = json.loads(line)
+                    yield line["name"], pymatgen.Structure.from_dict(line["structure"])
+
+
+class IterableSource(StructureSource):
+    """
+    Generator (or any iterable) yielding pairs of the name of the structure and
+    pymatgen.Structure, dict-type representation or StructureRef.
+    It can be iterated only once when a generator is given.
+    
+    Arguments
+    ---------
+    iterable: iterable
+        Pairs of the name and the structure.
+    """
+    
+    def __init__(self, iterable):
+        self._iterable = iterable
+    
+    def refs(self):
+        for struct_name, struct in self._iterable:
+            if isinstance(struct, StructureRef):
+                yield struct_name, struct
+            elif isinstance(struct, dict):
+                yield struct_name, StructureRef(load_dict, struct)
+            else:
+                yield struct_name, StructureRef(load_structure, struct)
+    
+    def names(self):
+        raise TypeError("Names of IterableSource are not known before iteration.")
+    
+    def __getitem__(self, struct_name):
+        raise TypeError("IterableSource does not support random access.")
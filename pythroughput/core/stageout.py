@@ -0,0 +1,158 @@
+# coding: utf-8
+# Copyright (c) 2018-2019, Taku MURAKAMI. All rights reserved.
+# Distributed under the terms of the BSD 3-clause License.
+
+import logging
+import os
+import json
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pythroughput.core.archive import find_archive
+from pythroughput.core.archive import move_file
+
+"""
+Stage-out of output files from node-local scratch.
+"""
+
+logger = logging.getLogger(__name__)
+
+DONE_MARKER = ".done"
+
+
+def stage_files(source_path, target_path, files, archive=None, remove_source=False):
+    """
+    Stages output files from the work directory to the output directory,
+    and writes the completion marker ".done" at last.
+    
+    Arguments
+    ---------
+    source_path: str
+        Work directory, e.g. in node-local scratch.
+    target_path: str or None
+        Output directory. When it is None, files are not staged.
+    files: list
+        Names of the staged files. Missing files are skipped.
+    archive: ArchivePolicy or None
+        Archival policy, by which files are compressed while staged,
+        or the output directory is packed into an archive after staging.
+    remove_source: bool
+        If the work directory is removed after staging.
+    
+    Returns
+    -------
+    staged: list
+        Names of the staged files in the output directory.
+    """
+    staged = []
+    if target_path is not None:
+        os.makedirs(target_path, exist_ok=True)
+        for name in files:
+            source = os.path.join(source_path, name)
+            if not os.path.exists(source):
+                continue
+            if archive is not None:
+                staged.append(archive.stage_file(source, target_path))
+            else:
+                move_file(source, os.path.join(target_path, name))
+                staged.append(name)
+        temporary = os.path.join(target_path, DONE_MARKER + ".part")
+        with open(temporary, mode="w") as file:
+            json.dump({"files": staged}, file)
+        os.replace(temporary, os.path.join(target_path, DONE_MARKER))
+        if archive is not None and archive.pack is True:
+            archive.apply(target_path)
+    if remove_source is True:
+        shutil.rmtree(source_path, ignore_errors=True)
+    return staged
+
+
+def is_staged(target_path):
+    """
+    Is stage-out to the output directory completed.
+    
+    Arguments
+    ---------
+    target_path: str
+        Output directory.
+    
+    Returns
+    -------
+    bool
+        If the completion marker exists, or the output directory is packed.
+    """
+    return (os.path.exists(os.path.join(target_path, DONE_MARKER)) or
+            find_archive(target_path) is not None)
+
+
+class StageOut(object):
+    """
+    Asynchronous stage-out of output files by a thread pool, so the next
+    calculation starts before the files of the previous one are staged.
+    Files are moved by in-process renames (or copies across file systems)
+    without spawning processes.
+    
+    Arguments
+    ---------
+    max_workers: int
+        Number of threads staging files.
+    archive: ArchivePolicy or None
+        Archival policy of the staged files.
+    """
+    
+    def __init__(self, max_workers=2, archive=None):
+        self.archive = archive
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._futures = []
+    
+    def submit(self, source_path, target_path, files, remove_source=True):
+        """
+        Submits stage-out of the files.
+        
+        Arguments
+        ---------
+        (same as stage_files())
+        
+        Returns
+        -------
+        concurrent.futures.Future
+            Future of stage_files().
+        """
+        future = self._executor.submit(stage_files, source_path, target_path, files,
+                                       self.archive, remove_source)
+        self._futures.append(future)
+        return future
+    
+    def wait(self):
+        """
+        Waits for all the submitted stage-out, raising the first error.
+        
+        Returns
+        -------
+        int
+            Number of completed stage-out.
+        """
+        futures, self._futures = self._futures, []
+        errors = []
+        for future in futures:
+            error = future.exception()
+            if error is not None:
+                logger.error("Stage-out failed: %s", error)
+                errors.append(error)
+        if errors:
+            raise errors[0]
+        return len(futures)
+    
+    def shutdown(self):
+        """
+        Waits for all the submitted stage-out and stops the threads.
+        """
+        try:
+            self.wait()
+        finally:
+            self._executor.shutdown(wait=True)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
@@ -0,0 +1,497 @@
+# coding: utf-8
+# Copyright (c) 2018-2019, Taku MURAKAMI. All rights reserved.
+# Distributed under the terms of the BSD 3-clause License.
+
+import logging
+import os
+import json
+import numpy
+import pymatgen
+from concurrent.futures import ProcessPoolExecutor
+from pythroughput.core.sources import FileSource
+from pythroughput.core.sources import StructureRef
+from pythroughput.core.sources import load_file
+
+"""
+Binary cache of parsed structure files.
+"""
+
+logger = logging.getLogger(__name__)
+
+# Extension, dtype and shape except the first axis of the array files of the cache.
+ARRAYS = {"lattices": ("f64", numpy.float64, (3, 3)),
+          "offsets": ("i64", numpy.int64, ()),
+          "frac_coords": ("f64", numpy.float64, (3,)),
+          "species": ("i32", numpy.int32, ())}
+
+
+def parse_files(paths, fmt=None):
+    """
+    Parses structure files into arrays,
+    which is called in worker processes of StructureCache.update().
+    
+    Arguments
+    ---------
+    paths: list
+        Paths to the structure files.
+    fmt: str or None
+        Format of the structure files.
+    
+    Returns
+    -------
+    list
+        (lattice, species, frac_coords) of each file, where species are strings,
+        or None when the structure can not be cached, i.e. it is disordered
+        or has site properties.
+    """
+    parsed = []
+    for path in paths:
+        struct = load_file(path, fmt=fmt)
+        if not struct.is_ordered or struct.site_properties:
+            parsed.append(None)
+        else:
+            parsed.append((numpy.array(struct.lattice.matrix),
+                           [str(specie) for specie in struct.species],
+                           numpy.array(struct.frac_coords)))
+    return parsed
+
+
+def load_arrays(lattice, species, frac_coords):
+    """
+    Builds a structure from cached arrays.
+    
+    Arguments
+    ---------
+    lattice: numpy.ndarray
+        Lattice matrix (3 x 3).
+    species: list
+        Species of the sites as strings, e.g. "Fe" or "Fe2+".
+    frac_coords: numpy.ndarray
+        Fractional coordinates of the sites (natoms x 3).
+    
+    Returns
+    -------
+    pymatgen.Structure
+        Atomic structure itself.
+    """
+    return pymatgen.Structure(lattice, species, frac_coords)
+
+
+class StructureCache(object):
+    """
+    Binary cache of parsed structure files, keyed by absolute path,
+    size and modification time of the files.
+    
+    The cache is a directory of raw binary arrays, which are memory-mapped when
+    the cache is opened, so a large library is not parsed nor read again.
+    
+    index.json: {"version", "rows", "sites", "entries": {path: [size, mtime_ns, row]},
+                 "species": [...]}
+    lattices.(version).f64: Lattice matrices of the rows (rows x 3 x 3).
+    offsets.(version).i64: Offsets of the sites of the rows (rows + 1).
+    frac_coords.(version).f64: Fractional coordinates of all the sites (sites x 3).
+    species.(version).i32: Indices of species of all the sites in "species" (sites).
+    
+    New rows are appended to the array files, and only the rows and sites counted
+    in index.json are read, so the cache is switched to the new rows only when
+    index.json is replaced. Bytes written after the counted ones, e.g. by an
+    interrupted update, are overwritten by the next update. Rows of modified files
+    are left unreferenced, and the arrays are compacted into the files of a new
+    version when more than half of the rows are unreferenced.
+    The cache is updated by one process at a time.
+    
+    Files which can not be cached (disordered or with site properties)
+    are recorded with row -1 and parsed whenever they are loaded.
+    
+    Arguments
+    ---------
+    path: str
+        Directory of the cache.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._version = 0
+        self._entries = {}
+        self._species = []
+        self._lattices = numpy.empty((0, 3, 3))
+        self._offsets = numpy.zeros(1, dtype=numpy.int64)
+        self._frac_coords = numpy.empty((0, 3))
+        self._codes = numpy.empty(0, dtype=numpy.int32)
+        self._load()
+    
+    def __len__(self):
+        return sum(1 for entry in self._entries.values() if entry[2] >= 0)
+    
+    def _filename(self, name, version=None):
+        version = self._version if version is None else version
+        return os.path.join(self.path, "{}.{}.{}".format(name, version, ARRAYS[name][0]))
+    
+    def _load(self):
+        """
+        Loads the cache by memory mapping. Broken cache is ignored.
+        """
+        filename = os.path.join(self.path, "index.json")
+        if not os.path.exists(filename):
+            return
+        try:
+            with open(filename) as file:
+                index = json.load(file)
+            version, rows, sites = index["version"], index["rows"], index["sites"]
+            arrays = {name: self._map(name, version, count)
+                      for name, count in (("lattices", rows), ("offsets", rows + 1),
+                                          ("frac_coords", sites), ("species", sites))}
+        except (OSError, ValueError, KeyError) as error:
+            logger.warning("Cache in %s is ignored: %s", self.path, error)
+            return
+        if arrays["offsets"][-1] != sites:
+            logger.warning("Cache in %s is ignored: inconsistent arrays.", self.path)
+            return
+        self._version = version
+        self._entries = index["entries"]
+        self._species = index["species"]
+        self._lattices = arrays["lattices"]
+        self._offsets = arrays["offsets"]
+        self._frac_coords = arrays["frac_coords"]
+        self._codes = arrays["species"]
+    
+    def _map(self, name, version, count):
+        """
+        Maps the first count rows of the array file.
+        """
+        extension, dtype, shape = ARRAYS[name]
+        filename = self._filename(name, version)
+        if count == 0:
+            return numpy.empty((0,) + shape, dtype=dtype)
+        itemsize = numpy.dtype(dtype).itemsize * int(numpy.prod(shape))
+        if os.path.getsize(filename) < count * itemsize:
+            raise ValueError("{} is shorter than the index.".format(filename))
+        return numpy.memmap(filename, dtype=dtype, mode="r", shape=(count,) + shape)
+    
+    def lookup(self, path):
+        """
+        Looks up the row of the structure file.
+        
+        Arguments
+        ---------
+        path: str
+            Path to the structure file.
+        
+        Returns
+        -------
+        int or None
+            Row of the structure, -1 when the structure is not cacheable,
+            or None when the file is not cached or modified after cached.
+        """
+        entry = self._entries.get(os.path.abspath(path))
+        if entry is None:
+            return None
+        stat = os.stat(path)
+        if entry[0] != stat.st_size or entry[1] != stat.st_mtime_ns:
+            return None
+        return entry[2]
+    
+    def update(self, paths, fmt=None, n_jobs=1, chunk_size=64):
+        """
+        Parses the structure files which are not cached (or modified)
+        and appends them to the cache.
+        
+        Arguments
+        ---------
+        paths: list
+            Paths to the structure files.
+        fmt: str or None
+            Format of the structure files. When it is None,
+            the format is guessed from the file names.
+        n_jobs: int
+            Number of processes parsing the files.
+        chunk_size: int
+            Number of files parsed at once in a process.
+        
+        Returns
+        -------
+        int
+            Number of parsed files.
+        """
+        stale = sorted(set(os.path.abspath(path) for path in paths
+                           if self.lookup(path) is None))
+        if not stale:
+            return 0
+        stats = [os.stat(path) for path in stale]
+        chunks = [stale[i:i+chunk_size] for i in range(0, len(stale), chunk_size)]
+        if n_jobs == 1 or len(chunks) == 1:
+            results = [parse_files(chunk, fmt) for chunk in chunks]
+        else:
+            with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+                results = list(executor.map(parse_files, chunks, [fmt] * len(chunks)))
+        parsed = [result for chunk_results in results for result in chunk_results]
+        
+        entries = dict(self._entries)
+        species = list(self._species)
+        species_codes = {specie: i for i, specie in enumerate(species)}
+        new_lattices = []
+        new_frac_coords = []
+        new_codes = []
+        lengths = []
+        num = len(self._lattices)
+        for path, stat, result in zip(stale, stats, parsed):
+            if result is None:
+                entries[path] = [stat.st_size, stat.st_mtime_ns, -1]
+                continue
+            lattice, struct_species, struct_frac_coords = result
+            for specie in struct_species:
+                if specie not in species_codes:
+                    species_codes[specie] = len(species)
+                    species.append(specie)
+            entries[path] = [stat.st_size, stat.st_mtime_ns, num]
+            num += 1
+            new_lattices.append(lattice)
+            new_frac_coords.append(struct_frac_coords)
+            new_codes.append([species_codes[specie] for specie in struct_species])
+            lengths.append(len(struct_species))
+        offsets = int(self._offsets[-1]) + numpy.cumsum(lengths, dtype=numpy.int64)
+        arrays = {"lattices": numpy.array(new_lattices).reshape(-1, 3, 3),
+                  "offsets": offsets,
+                  "frac_coords": numpy.concatenate(new_frac_coords + [numpy.empty((0, 3))]),
+                  "species": numpy.concatenate(new_codes + [[]])}
+        
+        referenced = sum(1 for entry in entries.values() if entry[2] >= 0)
+        if num > 2 * referenced:
+            self._compact(arrays, entries, species)
+        else:
+            self._append(arrays, {"version": self._version, "rows": num,
+                                  "sites": int(self._offsets[-1]) + int(sum(lengths)),
+                                  "entries": entries, "species": species})
+        self._load()
+        logger.info("%d structure files are parsed into cache %s.", len(stale), self.path)
+        return len(stale)
+    
+    def _append(self, arrays, index):
+        """
+        Appends arrays after the rows in the current index, and replaces the index.
+        """
+        counts = {"lattices": len(self._lattices), "offsets": len(self._offsets),
+                  "frac_coords": len(self._frac_coords), "species": len(self._codes)}
+        if len(self._lattices) == 0:
+            # The first offset is written with the first rows.
+            arrays["offsets"] = numpy.concatenate([[0], arrays["offsets"]])
+            counts["offsets"] = 0
+        for name, array in arrays.items():
+            extension, dtype, shape = ARRAYS[name]
+            itemsize = numpy.dtype(dtype).itemsize * int(numpy.prod(shape))
+            filename = self._filename(name)
+            open(filename, mode="ab").close()
+            with open(filename, mode="r+b") as file:
+                file.truncate(counts[name] * itemsize)
+                file.seek(counts[name] * itemsize)
+                file.write(numpy.ascontiguousarray(array, dtype=dtype).tobytes())
+                file.flush()
+                os.fsync(file.fileno())
+        self._write_index(index)
+    
+    def _compact(self, arrays, entries, species):
+        """
+        Writes the referenced rows and the new arrays to the files of a new version,
+        switches the index to them, and removes the files of the old version.
+        """
+        referenced = sorted((entry[2], path) for path, entry in entries.items()
+                            if 0 <= entry[2] < len(self._lattices))
+        rows = numpy.array([row for row, path in referenced], dtype=numpy.int64)
+        lattices, offsets, frac_coords, codes = self._gather(rows)
+        for row, (old_row, path) in enumerate(referenced):
+            entries[path] = entries[path][:2] + [row]
+        num = len(rows)
+        for path, entry in entries.items():
+            if entry[2] >= len(self._lattices):
+                entries[path] = entry[:2] + [entry[2] - len(self._lattices) + num]
+        new_offsets = arrays["offsets"] - int(self._offsets[-1]) + int(offsets[-1])
+        compacted = {"lattices": numpy.concatenate([lattices, arrays["lattices"]]),
+                     "offsets": numpy.concatenate([offsets, new_offsets]),
+                     "frac_coords": numpy.concatenate([frac_coords, arrays["frac_coords"]]),
+                     "species": numpy.concatenate([codes, arrays["species"]])}
+        old_version = self._version
+        version = old_version + 1
+        for name, array in compacted.items():
+            extension, dtype, shape = ARRAYS[name]
+            with open(self._filename(name, version), mode="wb") as file:
+                file.write(numpy.ascontiguousarray(array, dtype=dtype).tobytes())
+                file.flush()
+                os.fsync(file.fileno())
+        self._write_index({"version": version, "rows": len(compacted["lattices"]),
+                           "sites": len(compacted["species"]),
+                           "entries": entries, "species": species})
+        for name in ARRAYS:
+            try:
+                os.remove(self._filename(name, old_version))
+            except OSError:
+                pass
+    
+    def _gather(self, rows):
+        """
+        Gathers arrays of given rows.
+        
+        Returns
+        -------
+        lattices, offsets, frac_coords, codes: numpy.ndarray
+            Arrays in the same layout as the cache.
+        """
+        starts = self._offsets[rows]
+        lengths = self._offsets[rows + 1] - starts
+        offsets = numpy.concatenate([[0], numpy.cumsum(lengths)]).astype(numpy.int64)
+        sites = numpy.repeat(starts - offsets[:-1], lengths) + numpy.arange(offsets[-1])
+        return (numpy.array(self._lattices[rows]).reshape(-1, 3, 3), offsets,
+                numpy.array(self._frac_coords[sites]).reshape(-1, 3),
+                numpy.array(self._codes[sites]))
+    
+    def _write_index(self, index):
+        """
+        Replaces the index atomically, which switches the cache to the new rows.
+        """
+        temporary = os.path.join(self.path, "index.json.tmp")
+        with open(temporary, mode="w") as file:
+            json.dump(index, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, os.path.join(self.path, "index.json"))
+    
+    def get_arrays(self, path):
+        """
+        Gets cached arrays of the structure file.
+        
+        Arguments
+        ---------
+        path: str
+            Path to the structure file.
+        
+        Returns
+        -------
+        lattice: numpy.ndarray
+            Lattice matrix (3 x 3).
+        species: list
+            Species of the sites as strings.
+        frac_coords: numpy.ndarray
+            Fractional coordinates of the sites (natoms x 3).
+        """
+        row = self.lookup(path)
+        if row is None or row < 0:
+            raise KeyError(path)
+        start, stop = self._offsets[row], self._offsets[row + 1]
+        species = [self._species[code] for code in self._codes[start:stop]]
+        return (numpy.array(self._lattices[row]), species,
+                numpy.array(self._frac_coords[start:stop]))
+    
+    def ref(self, path, fmt=None):
+        """
+        Gets the reference to the structure, which is built from the cache,
+        or parsed from the file when it is not cached.
+        
+        Arguments
+        ---------
+        path: str
+            Path to the structure file.
+        fmt: str or None
+            Format of the structure file.
+        
+        Returns
+        -------
+        StructureRef
+            Reference to the structure.
+        """
+        row = self.lookup(path)
+        if row is None or row < 0:
+            return StructureRef(load_file, path, fmt)
+        return StructureRef(load_arrays, *self.get_arrays(path))
+    
+    def load(self, path, fmt=None):
+        """
+        Loads the structure file through the cache, updating the cache if needed.
+        
+        Arguments
+        ---------
+        path: str
+            Path to the structure file.
+        fmt: str or None
+            Format of the structure file.
+        
+        Returns
+        -------
+        pymatgen.Structure
+            Atomic structure itself.
+        """
+        self.update([path], fmt=fmt)
+        return self.ref(path, fmt).load()
+    
+    def stack(self, paths):
+        """
+        Stacks cached lattices and fractional coordinates of the structure files.
+        
+        Arguments
+        ---------
+        paths: list
+            Paths to the structure files, which must be cached
+            and have the same number of sites.
+        
+        Returns
+        -------
+        lattices: numpy.ndarray
+            Lattice matrices (N x 3 x 3).
+        frac_coords: numpy.ndarray
+            Fractional coordinates (N x natoms x 3).
+        """
+        rows = numpy.array([self.lookup(path) for path in paths], dtype=object)
+        if any(row is None or row < 0 for row in rows):
+            raise KeyError("Some of the structure files are not cached.")
+        rows = rows.astype(numpy.int64)
+        lattices, offsets, frac_coords, codes = self._gather(rows)
+        lengths = numpy.diff(offsets)
+        if len(lengths) and numpy.any(lengths != lengths[0]):
+            raise ValueError("All the models must have the same number of sites.")
+        return lattices, frac_coords.reshape(len(rows), -1, 3)
+
+
+class CachedSource(FileSource):
+    """
+    Structure files loaded through StructureCache. The files which are not
+    cached are parsed by a process pool and written to the cache at construction.
+    
+    Arguments
+    ---------
+    paths: list or dict
+        List of paths to the structure files, or dict which consists of
+        the name of the structures as the keys and the paths as the values.
+    cache: str or StructureCache
+        Directory of the cache, or the cache itself.
+    fmt: str or None
+        Format of the structure files. When it is None,
+        the format is guessed from the file names.
+    n_jobs: int
+        Number of processes parsing the files.
+    """
+    
+    def __init__(self, paths, cache, fmt=None, n_jobs=1):
+        super(CachedSource, self).__init__(paths, fmt=fmt)
+        if not isinstance(cache, StructureCache):
+            cache = StructureCache(cache)
+        self.cache = cache
+        self.cache.update(list(self._paths.values()), fmt=fmt, n_jobs=n_jobs)
+    
+    def ref(self, struct_name):
+        return self.cache.ref(self._paths[struct_name], self.fmt)
+    
+    def stack(self):
+        """
+        Stacks lattices and fractional coordinates of all the structures from the cache.
+        
+        Returns
+        -------
+        names: list
+            Names of the structures.
+        lattices: numpy.ndarray
+            Lattice matrices (N x 3 x 3).
+        frac_coords: numpy.ndarray
+            Fractional coordinates (N x natoms x 3).
+        """
+        names = self.names()
+        lattices, frac_coords = self.cache.stack([self._paths[name] for name in names])
+        return names, lattices, frac_coords
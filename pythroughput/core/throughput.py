@@ -0,0 +1,400 @@
+# coding: utf-8
+# Copyright (c) 2018-2019, Taku MURAKAMI. All rights reserved.
+# Distributed under the terms of the BSD 3-clause License.
+
+import logging
+import os
+import sys
+import math
+import json
+import time
+import random
+import shutil
+import itertools
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import wait
+
+"""
+Concurrent jobs on a node, and the autotuner of ranks per job versus concurrent jobs.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def get_size_class(num_sites):
+    """
+    Gets the size class of the structure, which is the number of sites
+    rounded up to a power of 2.
+    
+    Arguments
+    ---------
+    num_sites: int
+        Number of sites in the structure.
+    
+    Returns
+    -------
+    int
+        Size class, e.g. 8 for 5 to 8 sites.
+    """
+    return 2 ** int(math.ceil(math.log(max(num_sites, 1), 2)))
+
+
+class JobPool(object):
+    """
+    Pool of concurrent jobs sharing the cores of a node, in which a job
+    is started when the ranks it uses are free. Jobs are run one by one
+    in the calling thread when only one of them can run at a time.
+    
+    Arguments
+    ---------
+    cores: int
+        Number of cores (MPI ranks) shared by the jobs.
+    max_workers: int or None
+        The upper limit of concurrent jobs. Default: cores
+    """
+    
+    def __init__(self, cores, max_workers=None):
+        self.cores = cores
+        self.max_workers = max_workers if max_workers is not None else cores
+        self._free = cores
+        self._running = {}
+        self._done = []
+        if self.max_workers > 1:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        else:
+            self._executor = None
+    
+    def submit(self, key, ranks, function, *args):
+        """
+        Submits the job, waiting until its ranks are free.
+        
+        Arguments
+        ---------
+        key: str
+            Key of the job, e.g. the name of the structure.
+        ranks: int
+            Number of ranks used by the job.
+        function: function
+            Function of the job called with args.
+        """
+        ranks = min(ranks, self.cores)
+        if self._executor is None:
+            self._done.append((key, function(*args)))
+            return
+        while self._running and (self._free < ranks or len(self._running) >= self.max_workers):
+            self._wait(return_when=FIRST_COMPLETED)
+        self._free -= ranks
+        self._running[self._executor.submit(function, *args)] = (key, ranks)
+    
+    def _wait(self, timeout=None, return_when=FIRST_COMPLETED):
+        done, running = wait(list(self._running), timeout=timeout, return_when=return_when)
+        for future in done:
+            key, ranks = self._running.pop(future)
+            self._free += ranks
+            self._done.append((key, future.result()))
+    
+    def finished(self, block=False):
+        """
+        Gets the finished jobs, which are returned only once.
+        
+        Arguments
+        ---------
+        block: bool
+            If all the running jobs are waited for.
+        
+        Returns
+        -------
+        list
+            Pairs of the key and the return value of the jobs.
+        """
+        if self._running:
+            if block is True:
+                while self._running:
+                    self._wait()
+            else:
+                self._wait(timeout=0)
+        done, self._done = self._done, []
+        return done
+    
+    def shutdown(self):
+        """
+        Shuts down the pool after the running jobs finish.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+
+class ThroughputPlan(object):
+    """
+    Plan of ranks per job and concurrent jobs of each size class on a node,
+    which is given by autotune() and persisted in a JSON file.
+    
+    Arguments
+    ---------
+    path: str or None
+        Path to the JSON file of the plan. It is loaded if it exists.
+    
+    Parameters
+    ----------
+    cores: int or None
+        Number of cores of the node.
+    classes: dict
+        {"n_jobs", "concurrency", "structs_per_hour", "measurements"} keyed by size class.
+    """
+    
+    def __init__(self, path=None):
+        self.path = path
+        self.cores = None
+        self.classes = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as file:
+                plan = json.load(file)
+            self.cores = plan["cores"]
+            self.classes = {int(size_class): entry
+                            for size_class, entry in plan["classes"].items()}
+    
+    def get(self, num_sites):
+        """
+        Gets the plan of the structure, which is that of the nearest size class.
+        
+        Arguments
+        ---------
+        num_sites: int
+            Number of sites in the structure.
+        
+        Returns
+        -------
+        dict or None
+            "n_jobs" (ranks per job) and "concurrency", or None if the plan is empty.
+        """
+        if not self.classes:
+            return None
+        size_class = get_size_class(num_sites)
+        nearest = min(self.classes,
+                      key=lambda key: (abs(math.log(key, 2) - math.log(size_class, 2)), -key))
+        entry = self.classes[nearest]
+        return {"n_jobs": entry["n_jobs"], "concurrency": entry["concurrency"]}
+    
+    def set(self, size_class, measurements):
+        """
+        Sets the fastest configuration of the size class from the measurements.
+        
+        Arguments
+        ---------
+        size_class: int
+            Size class given by get_size_class().
+        measurements: list
+            {"n_jobs", "concurrency", "structs_per_hour", ...} of each configuration.
+        """
+        best = max(measurements, key=lambda measurement: measurement["structs_per_hour"])
+        self.classes[size_class] = {"n_jobs": best["n_jobs"],
+                                    "concurrency": best["concurrency"],
+                                    "structs_per_hour": best["structs_per_hour"],
+                                    "measurements": measurements}
+    
+    def save(self, path=None):
+        """
+        Writes the plan to the JSON file, which is replaced atomically.
+        """
+        path = path if path is not None else self.path
+        plan = {"cores": self.cores,
+                "classes": {str(size_class): entry
+                            for size_class, entry in sorted(self.classes.items())},
+                "time": time.time()}
+        temporary = path + ".part"
+        with open(temporary, mode="w") as file:
+            json.dump(plan, file, indent=2)
+        os.replace(temporary, path)
+
+
+def get_configurations(cores, min_ranks=1):
+    """
+    Gets the configurations of ranks per job and concurrent jobs using all the cores.
+    
+    Arguments
+    ---------
+    cores: int
+        Number of cores of the node.
+    min_ranks: int
+        The lower limit of ranks per job.
+    
+    Returns
+    -------
+    list
+        Pairs of (ranks per job, concurrent jobs), e.g. [(4, 16), (8, 8), ...] for 64 cores.
+    """
+    return [(ranks, cores // ranks) for ranks in range(max(min_ranks, 1), cores + 1)
+            if cores % ranks == 0]
+
+
+def sample_structs(structs, num_per_class=2, random_state=0, num_samples=64):
+    """
+    Samples representative structures of each size class. The names are sampled
+    first, and only the sampled structures are parsed, so size classes rarer than
+    1 / num_samples may be missed, for which the plan of the nearest class is used.
+    
+    Arguments
+    ---------
+    structs: dict or StructureSource
+        Calculating structures.
+    num_per_class: int
+        Number of structures sampled in each size class.
+    random_state: int or None
+        Seed of sampling.
+    num_samples: int
+        Number of structures parsed to find the size classes. The first ones are
+        parsed in IterableSource, whose names are not known before iteration.
+    
+    Returns
+    -------
+    samples: dict
+        Lists of pairs of the name and the structure keyed by size class.
+    """
+    rng = random.Random(random_state)
+    try:
+        names = list(structs.keys())
+    except TypeError:
+        pairs = itertools.islice(structs.items(), num_samples)
+    else:
+        names = rng.sample(names, min(num_samples, len(names)))
+        pairs = ((struct_name, structs[struct_name]) for struct_name in names)
+    classes = {}
+    for struct_name, struct in pairs:
+        samples = classes.setdefault(get_size_class(struct.num_sites), [])
+        if len(samples) < num_per_class:
+            samples.append((struct_name, struct))
+    return dict(sorted(classes.items()))
+
+
+def autotune(calculation, cores, configurations=None, num_per_class=2, steps=1,
+             package="vasp", plan=None, random_state=0, num_samples=64):
+    """
+    Runs a short calibration sweep of ranks per job versus concurrent jobs over
+    sampled structures of each size class, and sets the configuration with the most
+    structures per hour to the plan. Each configuration runs as many jobs as its
+    concurrency (cycling the samples), so that all the cores are busy.
+    The executables on PATH are used, e.g. the stand-in of VASP in benchmarks/bin.
+    
+    Arguments
+    ---------
+    calculation: PyHighThroughput
+        Calculation whose structures are sampled, and whose calculator, input path
+        and options are used in the sweep. Its output is not written.
+    cores: int
+        Number of cores of the node.
+    configurations: list or None
+        Pairs of (ranks per job, concurrent jobs). Default: get_configurations(cores)
+    num_per_class: int
+        Number of structures sampled in each size class.
+    steps: int
+        Number of relaxation steps.
+    package: str
+        First-principles calculation package using in calculation. Only VASP runs
+        concurrent jobs, so the other packages are given configurations of 1 job.
+    plan: str, ThroughputPlan or None
+        Plan (or its file) to which the best configurations are set and saved.
+    random_state: int or None
+        Seed of sampling.
+    num_samples: int
+        Number of structures parsed to find the size classes.
+    
+    Returns
+    -------
+    ThroughputPlan
+        Plan of the node.
+    """
+    from pythroughput.core.calculation import PyHighThroughput
+    if plan is None or isinstance(plan, str):
+        plan = ThroughputPlan(plan)
+    plan.cores = cores
+    if configurations is None:
+        configurations = get_configurations(cores)
+    if package != "vasp" and any(concurrency > 1 for n_jobs, concurrency in configurations):
+        raise ValueError("Only VASP calculations run concurrently.")
+    samples = sample_structs(calculation.structs, num_per_class, random_state, num_samples)
+    
+    for size_class, pairs in samples.items():
+        measurements = []
+        for n_jobs, concurrency in configurations:
+            num_jobs = max(concurrency, len(pairs))
+            structs = {"{}~{}".format(pairs[i % len(pairs)][0], i): pairs[i % len(pairs)][1]
+                       for i in range(num_jobs)}
+            path = tempfile.mkdtemp(prefix="pythroughput-autotune-")
+            try:
+                sweep = PyHighThroughput(calculator=calculation.calculator,
+                                         input_path=calculation.input_path,
+                                         output_path=os.path.join(path, "outputs") + os.sep,
+                                         symmetry=calculation.symmetry,
+                                         primitive=calculation.primitive,
+                                         scratch_path=path,
+                                         parallel_tuner=calculation.parallel_tuner,
+                                         **structs)
+                start = time.perf_counter()
+                sweep.run(steps=steps, package=package, n_jobs=n_jobs, concurrency=concurrency)
+                seconds = time.perf_counter() - start
+            finally:
+                shutil.rmtree(path, ignore_errors=True)
+            measurement = {"n_jobs": n_jobs,
+                           "concurrency": concurrency,
+                           "num_jobs": num_jobs,
+                           "seconds": seconds,
+                           "structs_per_hour": num_jobs / seconds * 3600.0 if seconds > 0 else 0.0}
+            logger.info("Size class %d: %d ranks x %d jobs, %.1f structures per hour.",
+                        size_class, n_jobs, concurrency, measurement["structs_per_hour"])
+            measurements.append(measurement)
+        plan.set(size_class, measurements)
+    if plan.path is not None:
+        plan.save()
+    return plan
+
+
+def main(argv=None):
+    """
+    Autotune command.
+    
+    > python -m pythroughput.core.throughput (directory of structures) --cores 64
+      --input-path (path to POTCARs) --plan plan.json
+    """
+    from pythroughput.core.calculation import PyHighThroughput
+    from pythroughput.core.sources import DirectorySource
+    parser = argparse.ArgumentParser(
+        description="Autotune ranks per job versus concurrent jobs of the node.")
+    parser.add_argument("structs", help="Directory of structure files.")
+    parser.add_argument("--cores", type=int, default=os.cpu_count())
+    parser.add_argument("--plan", default="throughput_plan.json")
+    parser.add_argument("--input-path", default=None)
+    parser.add_argument("--package", default="vasp", choices=["vasp"],
+                        help="GPAW is not autotuned, which runs in the ranks of mpirun.")
+    parser.add_argument("--ranks", type=int, nargs="+", default=None,
+                        help="Ranks per job of the sweep. Default: all the divisors of cores.")
+    parser.add_argument("--num-per-class", type=int, default=2)
+    parser.add_argument("--num-samples", type=int, default=64,
+                        help="Number of structures parsed to find the size classes.")
+    parser.add_argument("--steps", type=int, default=1)
+    args = parser.parse_args(argv)
+    
+    logging.basicConfig(level=logging.INFO)
+    configurations = None
+    if args.ranks is not None:
+        configurations = [(ranks, max(args.cores // ranks, 1)) for ranks in args.ranks]
+    calculation = PyHighThroughput(input_path=args.input_path,
+                                   source=DirectorySource(args.structs))
+    plan = autotune(calculation, args.cores, configurations, args.num_per_class,
+                    args.steps, args.package, args.plan, num_samples=args.num_samples)
+    for size_class, entry in sorted(plan.classes.items()):
+        print("{:>6d} sites: {:>4d} ranks x {:>4d} jobs, {:.1f} structures per hour".format(
+            size_class, entry["n_jobs"], entry["concurrency"], entry["structs_per_hour"]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,305 @@
+# coding: utf-8
+# Copyright (c) 2018-2019, Taku MURAKAMI. All rights reserved.
+# Distributed under the terms of the BSD 3-clause License.
+
+import logging
+import os
+import time
+import json
+import cProfile
+import threading
+import tracemalloc
+
+"""
+Timed spans of the phases of calculation, and their sinks.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class Span(object):
+    """
+    Timed span of a phase, which is used as a context manager.
+    
+    Parameters
+    ----------
+    name: str
+        Name of the phase, e.g. "run_vasp".
+    tags: dict
+        Tags of the span, e.g. struct_name, num_sites and kpoints.
+    start: float
+        Wall-clock time at the start (second since the epoch).
+    duration: float
+        Elapsed time of the span (second).
+    error: str or None
+        Name of the exception raised in the span.
+    """
+    
+    __slots__ = ("_tracer", "name", "tags", "start", "duration", "error", "_counter")
+    
+    def __init__(self, tracer, name, tags):
+        self._tracer = tracer
+        self.name = name
+        self.tags = tags
+        self.start = None
+        self.duration = None
+        self.error = None
+    
+    def __enter__(self):
+        self.start = time.time()
+        self._counter = time.perf_counter()
+        self._tracer.start(self)
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.duration = time.perf_counter() - self._counter
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        self._tracer.finish(self)
+        return False
+
+
+class _NullSpan(object):
+    """
+    Span of the no-op tracer, which does nothing.
+    """
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer(object):
+    """
+    No-op tracer, which is the default of the calculation pipeline.
+    Sinks are subclasses overriding start(), finish() and close().
+    """
+    
+    enabled = False
+    
+    def span(self, name, **tags):
+        """
+        Makes a timed span of the phase.
+        
+        Arguments
+        ---------
+        name: str
+            Name of the phase.
+        tags:
+            Tags of the span, e.g. struct_name, num_sites and kpoints.
+        
+        Returns
+        -------
+        Span
+            Context manager timing the phase.
+        """
+        if self.enabled is False:
+            return _NULL_SPAN
+        return Span(self, name, tags)
+    
+    def start(self, span):
+        """
+        Called at the start of the span.
+        """
+        pass
+    
+    def finish(self, span):
+        """
+        Called at the end of the span.
+        """
+        pass
+    
+    def close(self):
+        """
+        Flushes and closes the sink.
+        """
+        pass
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def get_tracer(tracer):
+    """
+    Gets the tracer, which is the no-op tracer when it is None.
+    """
+    return tracer if tracer is not None else Tracer()
+
+
+class JsonLinesTracer(Tracer):
+    """
+    Tracer appending finished spans to a JSON-lines file,
+    one line of {"name", "start", "duration", "tags", "error"} per span.
+    
+    Arguments
+    ---------
+    path: str
+        Path to the JSON-lines file.
+    """
+    
+    enabled = True
+    
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, mode="a")
+        self._lock = threading.Lock()
+    
+    def finish(self, span):
+        line = json.dumps({"name": span.name,
+                           "start": span.start,
+                           "duration": span.duration,
+                           "tags": span.tags,
+                           "error": span.error}, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+    
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+class ProfileTracer(Tracer):
+    """
+    Tracer profiling the controller process in the spans by cProfile,
+    and optionally taking tracemalloc snapshots at the end of the spans.
+    The external DFT processes are not profiled. cProfile profiles only
+    the thread enabling it, so the spans of the other threads are ignored,
+    and concurrent calculations are not profiled.
+    
+    Arguments
+    ---------
+    path: str
+        Prefix of output files. Statistics of cProfile are dumped to
+        "(path).prof", which is read by pstats, and tracemalloc snapshots
+        to "(path).(number).tracemalloc".
+    phases: list or None
+        Names of the profiled phases. When it is None, all the spans are profiled.
+    memory: bool
+        If tracemalloc snapshots are taken.
+    """
+    
+    enabled = True
+    
+    def __init__(self, path, phases=None, memory=False):
+        self.path = path
+        self.phases = phases
+        self.memory = memory
+        self._profile = cProfile.Profile()
+        self._depth = 0
+        self._thread = threading.get_ident()
+        self._num_snapshots = 0
+        if memory is True and not tracemalloc.is_tracing():
+            tracemalloc.start()
+    
+    def _is_profiled(self, span):
+        if threading.get_ident() != self._thread:
+            return False
+        return self.phases is None or span.name in self.phases
+    
+    def start(self, span):
+        if not self._is_profiled(span):
+            return
+        # Spans are nested, and the profiler is enabled by the outermost one.
+        if self._depth == 0:
+            self._profile.enable()
+        self._depth += 1
+    
+    def finish(self, span):
+        if not self._is_profiled(span):
+            return
+        self._depth -= 1
+        if self._depth == 0:
+            self._profile.disable()
+            if self.memory is True:
+                self.snapshot()
+    
+    def snapshot(self):
+        """
+        Takes a tracemalloc snapshot.
+        
+        Returns
+        -------
+        str
+            Path to the snapshot, which is loaded by tracemalloc.Snapshot.load().
+        """
+        filename = "{}.{}.tracemalloc".format(self.path, self._num_snapshots)
+        tracemalloc.take_snapshot().dump(filename)
+        self._num_snapshots += 1
+        return filename
+    
+    def close(self):
+        if self._depth > 0:
+            self._profile.disable()
+            self._depth = 0
+        self._profile.dump_stats(self.path + ".prof")
+        if self.memory is True and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+class MultiTracer(Tracer):
+    """
+    Tracer sending spans to the tracers.
+    
+    Arguments
+    ---------
+    tracers: list
+        Tracers, e.g. [JsonLinesTracer(...), ProfileTracer(...)].
+    """
+    
+    def __init__(self, *tracers):
+        self.tracers = [tracer for tracer in tracers if tracer.enabled is True]
+        self.enabled = bool(self.tracers)
+    
+    def start(self, span):
+        for tracer in self.tracers:
+            tracer.start(span)
+    
+    def finish(self, span):
+        for tracer in reversed(self.tracers):
+            tracer.finish(span)
+    
+    def close(self):
+        for tracer in self.tracers:
+            tracer.close()
+
+
+def summarize(path):
+    """
+    Summarizes the spans written by JsonLinesTracer per phase.
+    
+    Arguments
+    ---------
+    path: str
+        Path to the JSON-lines file.
+    
+    Returns
+    -------
+    summary: dict
+        {"count", "total", "mean", "max"} of duration (second) keyed by phase.
+    """
+    summary = {}
+    if not os.path.exists(path):
+        return summary
+    with open(path) as file:
+        for line in file:
+            try:
+                span = json.loads(line)
+            except ValueError:
+                continue
+            phase = summary.setdefault(span["name"], {"count": 0, "total": 0.0, "max": 0.0})
+            phase["count"] += 1
+            phase["total"] += span["duration"]
+            phase["max"] = max(phase["max"], span["duration"])
+    for phase in summary.values():
+        phase["mean"] = phase["total"] / phase["count"]
+    return summary
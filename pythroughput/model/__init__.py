@@ -4,3 +4,6 @@
 
 from . import modelgenerator
 from . import modelanalyser
+from . import modelbatch
+from . import swapengine
+from . import fingerprintindex
@@ -0,0 +1,335 @@
+# coding: utf-8
+# Copyright (c) 2018-2019, Taku MURAKAMI. All rights reserved.
+# Distributed under the terms of the BSD 3-clause License.
+
+import logging
+import os
+import json
+import numpy
+
+"""
+Nearest-neighbour index over structure fingerprints.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def periodic_distances(lattice, frac_coords, cutoff):
+    """
+    Calculates distances between all the pairs of sites,
+    including periodic images, shorter than cutoff.
+    
+    Arguments
+    ---------
+    lattice: numpy.ndarray
+        Lattice matrix (3 x 3).
+    frac_coords: numpy.ndarray
+        Fractional coordinates of the sites (natoms x 3).
+    cutoff: float
+        Cutoff distance (angstrom).
+    
+    Returns
+    -------
+    numpy.ndarray
+        Distances, where each pair is counted from both sites.
+    """
+    lattice = numpy.asarray(lattice, dtype=numpy.float64)
+    frac_coords = numpy.asarray(frac_coords, dtype=numpy.float64)
+    frac_coords = frac_coords - numpy.floor(frac_coords)
+    # Number of images along each axis is given by interplanar spacing.
+    spacing = 1.0 / numpy.linalg.norm(numpy.linalg.inv(lattice).T, axis=1)
+    ranges = [numpy.arange(-n, n + 1) for n in numpy.ceil(cutoff / spacing).astype(int)]
+    images = numpy.stack(numpy.meshgrid(*ranges, indexing="ij"), axis=-1).reshape(-1, 3)
+    coords = numpy.dot(frac_coords, lattice)
+    shifts = numpy.dot(images, lattice)
+    distances = []
+    for coord in coords:
+        vectors = (coords[numpy.newaxis, :, :] + shifts[:, numpy.newaxis, :]) - coord
+        lengths = numpy.sqrt(numpy.einsum("ijk,ijk->ij", vectors, vectors)).ravel()
+        distances.append(lengths[(lengths > 1e-8) & (lengths < cutoff)])
+    return numpy.concatenate(distances)
+
+
+def fingerprint(struct, cutoff=6.0, nbins=48):
+    """
+    Calculates the fixed-length fingerprint of a structure, which consists of
+    lattice features, the cube root of volume per atom, sorted a, b and c divided by it,
+    and sorted angles (radian), followed by radial distribution function g(r)
+    histogrammed in "nbins" bins up to "cutoff".
+    
+    Arguments
+    ---------
+    struct: pymatgen.Structure
+        Atomic structure itself.
+    cutoff: float
+        Cutoff distance of radial distribution function (angstrom).
+    nbins: int
+        Number of bins of radial distribution function.
+    
+    Returns
+    -------
+    numpy.ndarray
+        Fingerprint (7 + nbins) in float32.
+    """
+    lattice = struct.lattice
+    scale = (lattice.volume / struct.num_sites) ** (1.0 / 3.0)
+    features = [scale]
+    features += sorted(length / scale for length in lattice.abc)
+    features += sorted(numpy.radians(lattice.angles))
+    
+    edges = numpy.linspace(0.0, cutoff, nbins + 1)
+    counts = numpy.histogram(periodic_distances(lattice.matrix, struct.frac_coords, cutoff),
+                             bins=edges)[0]
+    shells = 4.0 / 3.0 * numpy.pi * (edges[1:]**3 - edges[:-1]**3)
+    density = struct.num_sites / lattice.volume
+    rdf = counts / (struct.num_sites * density * shells)
+    return numpy.concatenate([features, rdf]).astype(numpy.float32)
+
+
+class FingerprintIndex(object):
+    """
+    Nearest-neighbour index over structure fingerprints.
+    
+    Fingerprints are stored in a float32 matrix and searched by brute force
+    with matrix products (BLAS), using |x - y|^2 = |x|^2 + |y|^2 - 2 x.y.
+    When "path" is given, the index is stored in the directory as raw binary
+    "fingerprints.f32" and "names.txt", which are appended by add() as
+    results arrive and loaded by numpy.memmap without reading the whole file.
+    
+    Arguments
+    ---------
+    dim: int
+        Length of the fingerprints.
+    path: str or None
+        Directory of the index on disk. When it is None, the index is kept in memory.
+    params: dict or None
+        Arguments of fingerprint() used to build the fingerprints.
+    
+    Parameters
+    ----------
+    names: list
+        Names of the structures.
+    """
+    
+    def __init__(self, dim, path=None, params=None):
+        self.dim = int(dim)
+        self.path = path
+        self.params = params or {}
+        self.names = []
+        self._blocks = []
+        self._norms = []
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+            if os.path.exists(os.path.join(path, "params.json")):
+                raise ValueError("Index already exists in " + path + ", use load().")
+            with open(os.path.join(path, "params.json"), mode="w") as file:
+                json.dump({"dim": self.dim, "params": self.params}, file)
+            open(os.path.join(path, "fingerprints.f32"), mode="ab").close()
+            open(os.path.join(path, "names.txt"), mode="a").close()
+    
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        """
+        Loads the index from the directory.
+        
+        Arguments
+        ---------
+        path: str
+            Directory of the index.
+        mmap_mode: str or None
+            Mode of numpy.memmap, or None to read fingerprints into memory.
+        
+        Returns
+        -------
+        FingerprintIndex
+            The index, which is appended to the same directory by add().
+        """
+        with open(os.path.join(path, "params.json")) as file:
+            params = json.load(file)
+        index = cls.__new__(cls)
+        index.dim = params["dim"]
+        index.path = path
+        index.params = params["params"]
+        with open(os.path.join(path, "names.txt")) as file:
+            index.names = file.read().splitlines()
+        filename = os.path.join(path, "fingerprints.f32")
+        index._blocks = []
+        index._norms = []
+        if len(index.names) == 0:
+            pass
+        elif mmap_mode is None:
+            index._blocks.append(
+                numpy.fromfile(filename, dtype=numpy.float32).reshape(-1, index.dim))
+        else:
+            index._blocks.append(numpy.memmap(filename, dtype=numpy.float32, mode=mmap_mode,
+                                              shape=(len(index.names), index.dim)))
+        return index
+    
+    def __len__(self):
+        return len(self.names)
+    
+    def add(self, names, fingerprints):
+        """
+        Adds fingerprints to the index.
+        
+        Arguments
+        ---------
+        names: list
+            Names of the structures.
+        fingerprints: numpy.ndarray
+            Fingerprints (n x dim).
+        """
+        fingerprints = numpy.asarray(fingerprints, dtype=numpy.float32).reshape(-1, self.dim)
+        if len(names) != len(fingerprints):
+            raise ValueError("Numbers of names and fingerprints are different.")
+        if any("\n" in name for name in names):
+            raise ValueError("Names must not contain newline.")
+        if self.path is not None:
+            with open(os.path.join(self.path, "fingerprints.f32"), mode="ab") as file:
+                file.write(numpy.ascontiguousarray(fingerprints).tobytes())
+            with open(os.path.join(self.path, "names.txt"), mode="a") as file:
+                file.writelines(name + "\n" for name in names)
+        self.names.extend(names)
+        self._blocks.append(fingerprints)
+        # Small blocks added one by one are merged not to slow down the search.
+        if len(self._blocks) > 16:
+            self._blocks[1:] = [numpy.concatenate(self._blocks[1:])]
+            self._norms = self._norms[:1]
+    
+    def add_structs(self, structs):
+        """
+        Adds structures to the index.
+        
+        Arguments
+        ---------
+        structs: dict or StructureSource
+            Structures, which consist of the name of the structures
+            as the keys and pymatgen.Structure as the values.
+        """
+        names = []
+        fingerprints = []
+        for struct_name, struct in structs.items():
+            names.append(struct_name)
+            fingerprints.append(fingerprint(struct, **self.params))
+        if names:
+            self.add(names, numpy.array(fingerprints))
+    
+    def get_fingerprints(self):
+        """
+        Gets all the fingerprints.
+        
+        Returns
+        -------
+        numpy.ndarray
+            Fingerprints (N x dim), which is memory-mapped when nothing is added after load().
+        """
+        if len(self._blocks) == 1:
+            return self._blocks[0]
+        return numpy.concatenate([numpy.empty((0, self.dim), dtype=numpy.float32)] +
+                                 self._blocks)
+    
+    def _squared_distances(self, fingerprints, chunk_size):
+        """
+        Yields squared distances between queries and the index by chunks of the index.
+        """
+        while len(self._norms) < len(self._blocks):
+            block = self._blocks[len(self._norms)]
+            self._norms.append(numpy.einsum("ij,ij->i", block, block))
+        query_norms = numpy.einsum("ij,ij->i", fingerprints, fingerprints)
+        offset = 0
+        for block, norms in zip(self._blocks, self._norms):
+            for start in range(0, len(block), chunk_size):
+                stop = min(start + chunk_size, len(block))
+                squared = (query_norms[:, numpy.newaxis] + norms[numpy.newaxis, start:stop] -
+                           2.0 * numpy.dot(fingerprints, block[start:stop].T))
+                yield offset + start, numpy.maximum(squared, 0.0)
+            offset += len(block)
+    
+    def query(self, fingerprints, k=1, chunk_size=2**20):
+        """
+        Searches k nearest neighbours.
+        
+        Arguments
+        ---------
+        fingerprints: numpy.ndarray
+            Fingerprints of queries (dim) or (n x dim).
+        k: int
+            Number of neighbours.
+        chunk_size: int
+            Number of fingerprints in the index compared at once.
+        
+        Returns
+        -------
+        names: list
+            Names of the neighbours of each query, sorted by distance.
+        distances: numpy.ndarray
+            Distances to the neighbours (n x k).
+        """
+        fingerprints = numpy.asarray(fingerprints, dtype=numpy.float32).reshape(-1, self.dim)
+        k = min(k, len(self))
+        best_indices = numpy.empty((len(fingerprints), 0), dtype=numpy.int64)
+        best_squared = numpy.empty((len(fingerprints), 0), dtype=numpy.float32)
+        for start, squared in self._squared_distances(fingerprints, chunk_size):
+            indices = numpy.concatenate(
+                [best_indices, numpy.broadcast_to(numpy.arange(start, start + squared.shape[1]),
+                                                  squared.shape)], axis=1)
+            squared = numpy.concatenate([best_squared, squared], axis=1)
+            if squared.shape[1] > k:
+                selected = numpy.argpartition(squared, k - 1, axis=1)[:, :k]
+                indices = numpy.take_along_axis(indices, selected, axis=1)
+                squared = numpy.take_along_axis(squared, selected, axis=1)
+            best_indices, best_squared = indices, squared
+        # Distances of the candidates are recalculated directly, since the expansion
+        # above loses precision of small distances in float32.
+        distances = numpy.linalg.norm(
+            self._take(best_indices) - fingerprints[:, numpy.newaxis, :], axis=2)
+        order = numpy.argsort(distances, axis=1)
+        best_indices = numpy.take_along_axis(best_indices, order, axis=1)
+        names = [[self.names[i] for i in row] for row in best_indices]
+        return names, numpy.take_along_axis(distances, order, axis=1)
+    
+    def query_radius(self, fingerprint, radius, chunk_size=2**20):
+        """
+        Searches all the neighbours within radius.
+        
+        Arguments
+        ---------
+        fingerprint: numpy.ndarray
+            Fingerprint of the query (dim).
+        radius: float
+            Radius of the search.
+        chunk_size: int
+            Number of fingerprints in the index compared at once.
+        
+        Returns
+        -------
+        names: list
+            Names of the neighbours, sorted by distance.
+        distances: numpy.ndarray
+            Distances to the neighbours.
+        """
+        fingerprint = numpy.asarray(fingerprint, dtype=numpy.float32).reshape(1, self.dim)
+        indices = []
+        # Candidates are selected with a margin for rounding errors in float32.
+        margin = 1e-6 * numpy.dot(fingerprint[0], fingerprint[0])
+        for start, squared in self._squared_distances(fingerprint, chunk_size):
+            indices.append(numpy.flatnonzero(squared[0] <= radius**2 + margin) + start)
+        indices = numpy.concatenate([numpy.empty(0, dtype=numpy.int64)] + indices)
+        distances = numpy.linalg.norm(self._take(indices) - fingerprint, axis=1)
+        indices = indices[distances <= radius]
+        distances = distances[distances <= radius]
+        order = numpy.argsort(distances)
+        return [self.names[i] for i in indices[order]], distances[order]
+    
+    def _take(self, indices):
+        """
+        Gets fingerprints at given indices of the index, in any shape.
+        """
+        indices = numpy.asarray(indices, dtype=numpy.int64)
+        taken = numpy.empty(indices.shape + (self.dim,), dtype=numpy.float32)
+        offset = 0
+        for block in self._blocks:
+            selected = (offset <= indices) & (indices < offset + len(block))
+            taken[selected] = block[indices[selected] - offset]
+            offset += len(block)
+        return taken
@@ -6,6 +6,14 @@ import logging
 import numpy
 import pymatgen
 from pymatgen.io.vasp.inputs import Poscar
+from pythroughput.core.sources import StructureSource
+from pythroughput.core.sources import FileSource
+from pythroughput.core.sources import load_file
+from pythroughput.core.structurecache import StructureCache
+from pythroughput.core.structurecache import CachedSource
+from pythroughput.model.modelbatch import ModelBatch
+from pythroughput.model.fingerprintindex import FingerprintIndex
+from pythroughput.model.fingerprintindex import fingerprint
 
 """
 Model analyser.
@@ -20,57 +28,211 @@ class ModelAnalyser(object):
     
     Arguments
     ---------
-    structs: dict
-        dict of analysed models, which format will be specified by "fmt".
+    structs: dict or StructureSource
+        dict of analysed models, which format will be specified by "fmt",
+        or lazy source of the models, which are parsed when they are analysed.
     struct_stable: (fmt)
         Stable structure to analyse model, which format will be specified by "fmt".
     fmt: str
         structure format, default is pymatgen.Structure.
+    cache: str, StructureCache or None
+        Directory of the cache of parsed structure files, used when "fmt" is not
+        pymatgen.Structure. Files are parsed only when they are not cached or modified.
+    n_jobs: int
+        Number of processes parsing the structure files into the cache.
     
     Parameters
     ----------
-    structs: dict
+    structs: dict or StructureSource
         dict of analysed models, format with pymatgen.Structure.
     struct_stable: pymatgen.Structure (or None)
         Stable structure to analyse model.
     """
     
-    def __init__(self, structs, struct_stable=None, fmt="Structure"):
-        if fmt == "Structure":
+    def __init__(self, structs, struct_stable=None, fmt="Structure", cache=None, n_jobs=1):
+        if fmt == "Structure" or isinstance(structs, StructureSource):
             self.structs = structs
-            self.struct_stable = struct_stable
+        elif cache is None:
+            self.structs = FileSource(structs, fmt=fmt)
         else:
-            self.structs = {}
-            for struct_name, struct in structs.items():
-                self.structs[struct_name] = pymatgen.Structure.from_str(
-                    open(struct).read(), fmt=fmt
-                )
-            if struct_stable is not None:
-                self.struct_stable = pymatgen.Structure.from_str(
-                    open(struct_stable).read, fmt=fmt
-                )
+            if not isinstance(cache, StructureCache):
+                cache = StructureCache(cache)
+            self.structs = CachedSource(structs, cache, fmt=fmt, n_jobs=n_jobs)
+        if fmt != "Structure" and struct_stable is not None:
+            if cache is None:
+                self.struct_stable = load_file(struct_stable, fmt=fmt)
             else:
-                self.struct_stable = struct_stable
+                self.struct_stable = cache.load(struct_stable, fmt=fmt)
+        else:
+            self.struct_stable = struct_stable
     
-    def calc_euclid_metric(self):
+    def stack(self):
         """
-        Analyse the metrics of models by calculationg euclidian distance.
+        Stacks lattices and fractional coordinates of all the models into arrays.
+        Models in ModelBatch without swapped species are not materialized,
+        and those in CachedSource are read from the cache.
+        
+        Returns
+        -------
+        names: list
+            Names of the models.
+        lattices: numpy.ndarray
+            Lattice matrices (N x 3 x 3).
+        frac_coords: numpy.ndarray
+            Fractional coordinates (N x natoms x 3).
         """
-        metrics = {}
+        if isinstance(self.structs, ModelBatch) and self.structs.occupancies is None:
+            return self.structs.names(), self.structs.lattices, self.structs.frac_coords
+        if isinstance(self.structs, CachedSource):
+            try:
+                return self.structs.stack()
+            except KeyError:
+                logger.info("Some of the models are not cached, which are parsed.")
+        names = []
+        lattices = []
+        frac_coords = []
         for struct_name, struct in self.structs.items():
-            metric = 0
-            for i in range(3):
-                metric += numpy.linalg.norm(
-                    struct.lattice.matrix[i] - self.struct_stable.lattice.matrix[i]
-                )
-            for j in range(struct.num_sites):
-                metric += numpy.linalg.norm(
-                    numpy.array([struct.sites[j].a,
-                                 struct.sites[j].b,
-                                 struct.sites[j].c])
-                    - numpy.array([self.struct_stable.sites[j].a,
-                                   self.struct_stable.sites[j].b,
-                                   self.struct_stable.sites[j].c])
-                    )
-            metrics[struct_name] = metric
-        return metrics
+            if frac_coords and struct.num_sites != len(frac_coords[0]):
+                raise ValueError("All the models must have the same number of sites.")
+            names.append(struct_name)
+            lattices.append(struct.lattice.matrix)
+            frac_coords.append(struct.frac_coords)
+        return names, numpy.array(lattices), numpy.array(frac_coords)
+    
+    def calc_euclid_metric(self, periodic=False):
+        """
+        Analyse the metrics of models by calculationg euclidian distance
+        from the stable structure, which is the sum of the distances of
+        lattice vectors and those of fractional coordinates of sites.
+        
+        Arguments
+        ---------
+        periodic: bool
+            If the displacements of fractional coordinates are wrapped into
+            [-0.5, 0.5) by the minimum image convention.
+        
+        Returns
+        -------
+        metrics: dict
+            Metrics of the models.
+        """
+        names, lattices, frac_coords = self.stack()
+        reference_lattice = numpy.array(self.struct_stable.lattice.matrix)
+        reference_coords = numpy.array(self.struct_stable.frac_coords)
+        
+        metrics = numpy.linalg.norm(lattices - reference_lattice, axis=2).sum(axis=1)
+        displacements = frac_coords - reference_coords
+        if periodic is True:
+            displacements -= numpy.rint(displacements)
+        metrics += numpy.linalg.norm(displacements, axis=2).sum(axis=1)
+        return dict(zip(names, metrics.tolist()))
+    
+    def calc_pairwise_metric(self, metric="chord", chunk_size=1024, out=None):
+        """
+        Calculates metrics between all the pairs of models.
+        
+        Arguments
+        ---------
+        metric: str
+            "euclid": the metric of calc_euclid_metric() with minimum image convention,
+            which is exact but calculated block by block.
+            "chord": square root of the sum of squared distances of lattice matrices
+            and squared chord distances of fractional coordinates on the unit torus,
+            |exp(2 pi i d) - 1| / (2 pi), which equals to the minimum image distance
+            in small displacement and is calculated by matrix products.
+        chunk_size: int
+            Number of rows calculated at once.
+        out: numpy.ndarray or None
+            Output array (N x N), e.g. numpy.memmap for large N.
+        
+        Returns
+        -------
+        names: list
+            Names of the models.
+        matrix: numpy.ndarray
+            Metrics between the models (N x N).
+        """
+        names, lattices, frac_coords = self.stack()
+        num = len(names)
+        if out is None:
+            out = numpy.empty((num, num))
+        
+        if metric == "chord":
+            angles = 2.0 * numpy.pi * frac_coords.reshape(num, -1)
+            features = numpy.concatenate([lattices.reshape(num, -1),
+                                          numpy.cos(angles) / (2.0 * numpy.pi),
+                                          numpy.sin(angles) / (2.0 * numpy.pi)], axis=1)
+            norms = numpy.einsum("ij,ij->i", features, features)
+            for start in range(0, num, chunk_size):
+                stop = min(start + chunk_size, num)
+                squared = (norms[start:stop, numpy.newaxis] + norms[numpy.newaxis, :] -
+                           2.0 * numpy.dot(features[start:stop], features.T))
+                out[start:stop] = numpy.sqrt(numpy.maximum(squared, 0.0))
+        elif metric == "euclid":
+            # Blocks are limited to about 2**22 elements of displacements.
+            block = max(2**22 // max(frac_coords[0].size, 1) // chunk_size, 1)
+            for start in range(0, num, chunk_size):
+                stop = min(start + chunk_size, num)
+                for column in range(0, num, block):
+                    end = min(column + block, num)
+                    lattice_metric = numpy.linalg.norm(
+                        lattices[start:stop, numpy.newaxis] - lattices[numpy.newaxis, column:end],
+                        axis=3).sum(axis=2)
+                    displacements = (frac_coords[start:stop, numpy.newaxis] -
+                                     frac_coords[numpy.newaxis, column:end])
+                    displacements -= numpy.rint(displacements)
+                    out[start:stop, column:end] = lattice_metric + numpy.sqrt(
+                        numpy.einsum("abnk,abnk->abn", displacements, displacements)).sum(axis=2)
+        else:
+            raise ValueError("Unknown metric: " + str(metric))
+        return names, out
+    
+    def calc_fingerprints(self, cutoff=6.0, nbins=48):
+        """
+        Calculates fixed-length fingerprints of the models,
+        lattice features and radial distribution function.
+        
+        Arguments
+        ---------
+        cutoff: float
+            Cutoff distance of radial distribution function (angstrom).
+        nbins: int
+            Number of bins of radial distribution function.
+        
+        Returns
+        -------
+        names: list
+            Names of the models.
+        fingerprints: numpy.ndarray
+            Fingerprints (N x (7 + nbins)).
+        """
+        names = []
+        fingerprints = []
+        for struct_name, struct in self.structs.items():
+            names.append(struct_name)
+            fingerprints.append(fingerprint(struct, cutoff=cutoff, nbins=nbins))
+        return names, numpy.array(fingerprints, dtype=numpy.float32).reshape(-1, 7 + nbins)
+    
+    def build_index(self, path=None, cutoff=6.0, nbins=48):
+        """
+        Builds the nearest-neighbour index over fingerprints of the models.
+        
+        Arguments
+        ---------
+        path: str or None
+            Directory of the index on disk, which can be loaded
+            by FingerprintIndex.load() later.
+        cutoff: float
+            Cutoff distance of radial distribution function (angstrom).
+        nbins: int
+            Number of bins of radial distribution function.
+        
+        Returns
+        -------
+        FingerprintIndex
+            The index.
+        """
+        index = FingerprintIndex(7 + nbins, path=path, params={"cutoff": cutoff, "nbins": nbins})
+        names, fingerprints = self.calc_fingerprints(cutoff=cutoff, nbins=nbins)
+        index.add(names, fingerprints)
+        return index
@@ -0,0 +1,278 @@
+# coding: utf-8
+# Copyright (c) 2018-2019, Taku MURAKAMI. All rights reserved.
+# Distributed under the terms of the BSD 3-clause License.
+
+import logging
+import numpy
+import pymatgen
+from pythroughput.core.sources import StructureSource
+from pythroughput.core.sources import StructureRef
+
+"""
+Batch of models generated by ModelGenerator.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def load_model(lattice, species, frac_coords, site_properties, occupancy=None):
+    """
+    Builds a model from arrays.
+    
+    Arguments
+    ---------
+    lattice: numpy.ndarray
+        Lattice matrix (3x3).
+    species: list
+        Species of the sites, or species indexed by occupancy.
+    frac_coords: numpy.ndarray
+        Fractional coordinates of the sites (natoms x 3).
+    site_properties: dict or None
+        Site properties of the model.
+    occupancy: numpy.ndarray or None
+        Indices of species of the sites. When it is given,
+        the sites are sorted by species as ModelGenerator.sort_atom().
+    
+    Returns
+    -------
+    pymatgen.Structure
+        The model.
+    """
+    if occupancy is not None:
+        order = numpy.argsort(occupancy, kind="stable")
+        species = [species[i] for i in occupancy[order]]
+        frac_coords = numpy.asarray(frac_coords)[order]
+    return pymatgen.Structure(lattice, species, frac_coords,
+                              site_properties=site_properties)
+
+
+def lattice_parameters(lattices):
+    """
+    Calculates lattice parameters of lattices.
+    
+    Arguments
+    ---------
+    lattices: numpy.ndarray
+        Lattice matrices (n x 3 x 3).
+    
+    Returns
+    -------
+    numpy.ndarray
+        Lattice parameters, a, b, c, alpha, beta and gamma (n x 6).
+    """
+    lengths = numpy.linalg.norm(lattices, axis=2)
+    angles = numpy.empty_like(lengths)
+    for i, (j, k) in enumerate(((1, 2), (0, 2), (0, 1))):
+        cosine = (numpy.einsum("ni,ni->n", lattices[:, j], lattices[:, k]) /
+                  (lengths[:, j] * lengths[:, k]))
+        angles[:, i] = numpy.degrees(numpy.arccos(numpy.clip(cosine, -1.0, 1.0)))
+    return numpy.concatenate([lengths, angles], axis=1)
+
+
+def check_lattices(lattices, lower, upper):
+    """
+    Checks constrains for lattices as ModelGenerator.check_constrains().
+    
+    Arguments
+    ---------
+    lattices: numpy.ndarray
+        Lattice matrices (n x 3 x 3).
+    lower, upper: numpy.ndarray
+        Lower and upper bounds of (a, b, c, alpha, beta, gamma).
+    
+    Returns
+    -------
+    numpy.ndarray
+        If constrains holds for each lattice.
+    """
+    parameters = lattice_parameters(lattices)
+    return numpy.all((lower < parameters) & (parameters < upper), axis=1)
+
+
+class ModelBatch(StructureSource):
+    """
+    Batch of models generated by ModelGenerator.generate(),
+    which keeps models as numpy arrays and materializes them as
+    pymatgen.Structure only on demand.
+    
+    As a StructureSource, it can be given to PyHighThroughput as source
+    and to ModelAnalyser as structs.
+    
+    Arguments
+    ---------
+    lattices: numpy.ndarray
+        Lattice matrices of the models (n x 3 x 3).
+    frac_coords: numpy.ndarray
+        Fractional coordinates of the models (n x natoms x 3),
+        or those shared by all the models (natoms x 3).
+    species: list
+        Species of the sites, shared by all the models,
+        or species indexed by occupancies.
+    site_properties: dict or None
+        Site properties, shared by all the models.
+    occupancies: numpy.ndarray or None
+        Indices of species of the sites of the models (n x natoms),
+        e.g. generated by SwapEngine.
+    name: str
+        Prefix of the names of models, which are followed by zero-padded index.
+    
+    Parameters
+    ----------
+    lattices: numpy.ndarray
+        Lattice matrices of the models (n x 3 x 3).
+    frac_coords: numpy.ndarray
+        Fractional coordinates of the models (n x natoms x 3).
+        When coordinates are not modified, it is a broadcasted read-only view.
+    acceptance_rate: float
+        Rate of generated models satisfying constraints in ModelGenerator.generate().
+    seed: int or None
+        Seed of the per-model streams of random numbers.
+    indices: numpy.ndarray or None
+        Indices of the models in the streams, the model i is reproduced by
+        ModelGenerator.regenerate(seed, indices[i], **generation_params).
+    generation_params: dict or None
+        Arguments given to ModelGenerator.generate().
+    """
+    
+    def __init__(self, lattices, frac_coords, species, site_properties=None,
+                 occupancies=None, name="model"):
+        self.lattices = numpy.asarray(lattices, dtype=numpy.float64)
+        frac_coords = numpy.asarray(frac_coords, dtype=numpy.float64)
+        if frac_coords.ndim == 2:
+            frac_coords = numpy.broadcast_to(frac_coords, (len(self.lattices),) + frac_coords.shape)
+        self.frac_coords = frac_coords
+        self.species = list(species)
+        self.site_properties = site_properties
+        self.occupancies = occupancies
+        self.name = name
+        self.acceptance_rate = 1.0
+        self.seed = None
+        self.indices = None
+        self.generation_params = None
+    
+    def __len__(self):
+        return len(self.lattices)
+    
+    def names(self):
+        return [self.get_name(i) for i in range(len(self))]
+    
+    def lattice_parameters(self):
+        """
+        Gets lattice parameters of the models.
+        
+        Returns
+        -------
+        numpy.ndarray
+            Lattice parameters, a, b, c, alpha, beta and gamma (n x 6).
+        """
+        return lattice_parameters(self.lattices)
+    
+    def get_provenance(self, index):
+        """
+        Gets the seed and index in the streams of random numbers of the model.
+        
+        Arguments
+        ---------
+        index: int
+            Index of the model in the batch.
+        
+        Returns
+        -------
+        (seed, index): tuple
+            Arguments of ModelGenerator.regenerate().
+        """
+        if self.seed is None:
+            raise ValueError("The models are not generated with a seed.")
+        return self.seed, int(self.indices[index])
+    
+    def get_name(self, index):
+        """
+        Gets the name of the model, which is followed by the index in
+        the streams of random numbers when the models are generated with a seed.
+        
+        Arguments
+        ---------
+        index: int
+            Index of the model.
+        
+        Returns
+        -------
+        str
+            Name of the model, e.g. "model0042".
+        """
+        if self.indices is not None:
+            width = len(str(int(self.indices[-1]) if len(self.indices) else 0))
+            return self.name + str(int(self.indices[index])).zfill(width)
+        return self.name + str(index).zfill(len(str(max(len(self) - 1, 0))))
+    
+    def get_index(self, struct_name):
+        """
+        Gets the index of the model.
+        
+        Arguments
+        ---------
+        struct_name: str
+            Name of the model.
+        
+        Returns
+        -------
+        int
+            Index of the model.
+        """
+        if not struct_name.startswith(self.name):
+            raise KeyError(struct_name)
+        try:
+            index = int(struct_name[len(self.name):])
+        except ValueError:
+            raise KeyError(struct_name)
+        if self.indices is not None:
+            position = int(numpy.searchsorted(self.indices, index))
+            if position < len(self.indices) and self.indices[position] == index:
+                return position
+            raise KeyError(struct_name)
+        if not 0 <= index < len(self):
+            raise KeyError(struct_name)
+        return index
+    
+    def ref(self, struct_name):
+        index = self.get_index(struct_name)
+        return StructureRef(load_model, self.lattices[index], self.species,
+                            numpy.array(self.frac_coords[index]), self.site_properties,
+                            self._get_occupancy(index))
+    
+    def get_struct(self, index):
+        """
+        Gets the model as pymatgen.Structure.
+        
+        Arguments
+        ---------
+        index: int
+            Index of the model.
+        
+        Returns
+        -------
+        pymatgen.Structure
+            The model.
+        """
+        return load_model(self.lattices[index], self.species, self.frac_coords[index],
+                          self.site_properties, self._get_occupancy(index))
+    
+    def _get_occupancy(self, index):
+        """
+        Gets indices of species of the model, or None.
+        """
+        if self.occupancies is None:
+            return None
+        return self.occupancies[index]
+    
+    def get_structs(self):
+        """
+        Gets all the models as pymatgen.Structure.
+        
+        Returns
+        -------
+        generator
+            The models.
+        """
+        for index in range(len(self)):
+            yield self.get_struct(index)
@@ -5,8 +5,17 @@
 import logging
 import random
 import math
+import numpy
+from concurrent.futures import ProcessPoolExecutor
 import pymatgen
 from pymatgen.io.vasp.inputs import Poscar
+from pythroughput.core.sources import load_file
+from pythroughput.core.structurecache import StructureCache
+from pythroughput.model.modelbatch import ModelBatch
+from pythroughput.model.modelbatch import lattice_parameters
+from pythroughput.model.modelbatch import check_lattices
+from pythroughput.model.swapengine import NON_METALS
+from pythroughput.model.swapengine import SwapEngine
 
 """
 Model generator.
@@ -32,6 +41,9 @@ class ModelGenerator(object):
         The original structure.
     fmt: str
         The format of "struct".
+    cache: str, StructureCache or None
+        Directory of the cache of parsed structure files, used when "fmt" is not
+        pymatgen.Structure.
     
     Parameters
     ----------
@@ -41,7 +53,7 @@ class ModelGenerator(object):
         The (modified) structure with dict-type representation.
     """
     
-    def __init__(self, struct, fmt="Structure"):
+    def __init__(self, struct, fmt="Structure", cache=None):
         """
         Arguments
         ---------
@@ -49,11 +61,17 @@ class ModelGenerator(object):
             The original structure.
         fmt: str
             The format of "struct".
+        cache: str, StructureCache or None
+            Directory of the cache of parsed structure files.
         """
-        if fmt is "Structure":
+        if fmt == "Structure":
             self.struct = struct
+        elif cache is None:
+            self.struct = load_file(struct, fmt=fmt)
         else:
-            self.struct = pymatgen.Structure.from_str(open(struct).read(), fmt=fmt)
+            if not isinstance(cache, StructureCache):
+                cache = StructureCache(cache)
+            self.struct = cache.load(struct, fmt=fmt)
         self.struct_dict = self.struct.as_dict()
     
     def get_struct(self):
@@ -95,6 +113,378 @@ class ModelGenerator(object):
                 self.struct_dict["lattice"]["matrix"][i][j] = column
         return self
     
+    def generate(self, num, symmetrical=False, modify_cell=True, modify_shape=False,
+                 modify_atom=False, cell_min=-0.01, cell_max=0.01, atom_modify_prob=10.0,
+                 atom_min=-0.01, atom_max=0.01, constraints=None, max_trials=None,
+                 random_state=None, seed=None, start=0, n_jobs=1, chunk_size=4096,
+                 name="model"):
+        """
+        Generates modified structures in a batch.
+        
+        All the modifications of "num" models are drawn at once as numpy arrays,
+        lattices (num x 3 x 3) and fractional coordinates (num x natoms x 3),
+        with the same distributions as modify_symmetrical() and modify_unsymmetrical(),
+        and the models are materialized as pymatgen.Structure only on demand.
+        The original structure is used as the starting point of every model,
+        so reset_struct() is not needed between models.
+        
+        Constraints of lattice parameters are taken into account in generation.
+        Scaling cell length (symmetrical, or modify_cell without modify_shape)
+        never changes cell angles, so the scaling factors are sampled directly
+        within the range allowed by the constraints of a, b and c, which gives
+        the same distribution as rejecting models by check_constrains().
+        Models with modified shape are rejected in batches, up to "max_trials".
+        The acceptance rate is stored in ModelBatch.acceptance_rate.
+        
+        When "seed" is given, every model is drawn from its own stream of random
+        numbers spawned by numpy.random.SeedSequence(seed) with the index of the model,
+        so a model is reproducible from (seed, index) alone, independently of
+        the number of models, the process generating it and the other models.
+        Models can then be generated in parallel by a process pool ("n_jobs"),
+        sharded by "start", and regenerated on demand by regenerate().
+        The seed and indices are stored in the ModelBatch.
+        
+        Arguments
+        ---------
+        num: int
+            Number of generated models.
+        symmetrical: bool
+            If modify cell length isometrically as modify_symmetrical(),
+            then the other modifications are ignored.
+        modify_cell: bool
+            If modify cell length.
+        modify_shape: bool
+            If modify cell shape.
+        modify_atom: bool
+            If modify atom fractional coordinates.
+        cell_min: float
+            Minimum of changing cell (%/100).
+        cell_max: float
+            Maxmum of changing cell (%/100).
+        atom_modify_prob: float
+            Probability of changing atom coordinates (%).
+        atom_min: float
+            Minimum of changing atom fractional coordinates.
+        atom_max: float
+            Maxmum of changing atom fractional coordinates.
+        constraints: dict or None
+            Constraints for lattice parameters with the same keys as
+            the arguments of check_constrains(), e.g. {"alpha_min": 89.9}.
+        max_trials: int or None
+            Maximum number of candidates drawn in rejection, default is 1000 * num,
+            or 1000 per model when "seed" is given.
+            Fewer models are returned when it is reached.
+        random_state: int, numpy.random.Generator or None
+            Seed or generator of a single stream of random numbers,
+            which is used when "seed" is None.
+        seed: int or None
+            Seed of the per-model streams of random numbers.
+        start: int
+            Index of the first model, used with "seed" to generate a shard of models.
+        n_jobs: int
+            Number of processes generating models, used with "seed".
+        chunk_size: int
+            Number of models drawn at once, which limits temporary memory.
+        name: str
+            Prefix of the names of models.
+        
+        Returns
+        -------
+        ModelBatch
+            Generated models.
+        """
+        if seed is not None:
+            params = {"symmetrical": symmetrical, "modify_cell": modify_cell,
+                      "modify_shape": modify_shape, "modify_atom": modify_atom,
+                      "cell_min": cell_min, "cell_max": cell_max,
+                      "atom_modify_prob": atom_modify_prob,
+                      "atom_min": atom_min, "atom_max": atom_max, "constraints": constraints}
+            return self._generate_seeded(num, seed, start, n_jobs, max_trials,
+                                         chunk_size, name, params)
+        
+        rng = numpy.random.default_rng(random_state)
+        base_lattice = numpy.array(self.struct.lattice.matrix)
+        base_coords = numpy.array(self.struct.frac_coords)
+        bounds = self._constraint_bounds(constraints)
+        if max_trials is None:
+            max_trials = 1000 * num
+        
+        lattices, trials, acceptance_rate = self._generate_lattices(
+            rng, num, base_lattice, symmetrical, modify_cell, modify_shape,
+            cell_min, cell_max, bounds, max_trials, chunk_size)
+        if len(lattices) < num:
+            logger.warning("Only %d models satisfy the constraints in %d trials.",
+                           len(lattices), trials)
+            num = len(lattices)
+        
+        if modify_atom is True and symmetrical is False:
+            frac_coords = numpy.empty((num,) + base_coords.shape)
+            for start in range(0, num, chunk_size):
+                stop = min(start + chunk_size, num)
+                frac_coords[start:stop] = self._draw_atom(
+                    rng, stop - start, base_coords, atom_modify_prob, atom_min, atom_max)
+        else:
+            frac_coords = base_coords
+        
+        batch = ModelBatch(lattices, frac_coords, self.struct.species,
+                           site_properties=self.struct.site_properties or None, name=name)
+        batch.acceptance_rate = acceptance_rate
+        return batch
+    
+    def _generate_seeded(self, num, seed, start, n_jobs, max_trials, chunk_size, name, params):
+        """
+        Generates models from per-model streams of random numbers.
+        
+        Returns
+        -------
+        ModelBatch
+            Generated models with their seed and indices.
+        """
+        if max_trials is None:
+            max_trials = 1000
+        else:
+            max_trials = max(-(-max_trials // max(num, 1)), 1)
+        indices = numpy.arange(start, start + num)
+        chunks = [indices[i:i+chunk_size] for i in range(0, num, chunk_size)]
+        args = ([self] * len(chunks), [seed] * len(chunks), chunks,
+                [params] * len(chunks), [max_trials] * len(chunks))
+        if n_jobs == 1:
+            results = list(map(generate_models, *args))
+        else:
+            with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+                results = list(executor.map(generate_models, *args))
+        
+        lattices = numpy.concatenate([numpy.empty((0, 3, 3))] +
+                                     [result[0] for result in results])
+        accepted = numpy.concatenate([indices[:0]] + [result[2] for result in results])
+        trials = sum(result[3] for result in results)
+        if params["modify_atom"] is True and params["symmetrical"] is False:
+            frac_coords = numpy.concatenate(
+                [numpy.empty((0,) + self.struct.frac_coords.shape)] +
+                [result[1] for result in results])
+        else:
+            frac_coords = numpy.array(self.struct.frac_coords)
+        if len(accepted) < num:
+            logger.warning("Only %d models satisfy the constraints in %d trials.",
+                           len(accepted), trials)
+        
+        batch = ModelBatch(lattices, frac_coords, self.struct.species,
+                           site_properties=self.struct.site_properties or None, name=name)
+        batch.acceptance_rate = sum(result[4] for result in results) / float(max(trials, 1))
+        batch.seed = seed
+        batch.indices = accepted
+        batch.generation_params = params
+        return batch
+    
+    def _generate_model(self, seed, index, params, bounds, max_trials):
+        """
+        Generates a model from the stream of random numbers of (seed, index).
+        
+        Returns
+        -------
+        lattice: numpy.ndarray or None
+            Lattice (3 x 3), None if no candidate satisfies the constraints.
+        frac_coords: numpy.ndarray or None
+            Fractional coordinates (natoms x 3), None if they are not modified.
+        trials, hits: int
+            Number of drawn candidates and those satisfying the constraints.
+        """
+        rng = numpy.random.default_rng(numpy.random.SeedSequence(seed, spawn_key=(int(index),)))
+        base_lattice = numpy.array(self.struct.lattice.matrix)
+        lattices, trials, acceptance_rate = self._generate_lattices(
+            rng, 1, base_lattice, params["symmetrical"], params["modify_cell"],
+            params["modify_shape"], params["cell_min"], params["cell_max"],
+            bounds, max_trials, 16)
+        if len(lattices) == 0:
+            return None, None, trials, 0
+        frac_coords = None
+        if params["modify_atom"] is True and params["symmetrical"] is False:
+            frac_coords = self._draw_atom(
+                rng, 1, numpy.array(self.struct.frac_coords), params["atom_modify_prob"],
+                params["atom_min"], params["atom_max"])[0]
+        return lattices[0], frac_coords, trials, int(round(acceptance_rate * trials))
+    
+    def regenerate(self, seed, index, max_trials=1000, **params):
+        """
+        Regenerates a model generated by generate() with "seed".
+        
+        Arguments
+        ---------
+        seed: int
+            Seed of the per-model streams of random numbers.
+        index: int
+            Index of the model.
+        max_trials: int
+            Maximum number of candidates drawn in rejection.
+        params:
+            The other arguments given to generate(), or ModelBatch.generation_params.
+        
+        Returns
+        -------
+        pymatgen.Structure
+            The model.
+        """
+        defaults = {"symmetrical": False, "modify_cell": True, "modify_shape": False,
+                    "modify_atom": False, "cell_min": -0.01, "cell_max": 0.01,
+                    "atom_modify_prob": 10.0, "atom_min": -0.01, "atom_max": 0.01,
+                    "constraints": None}
+        for key in params:
+            if key not in defaults:
+                raise TypeError("Unknown argument: " + str(key))
+        defaults.update(params)
+        lattice, frac_coords, trials, hits = self._generate_model(
+            seed, index, defaults, self._constraint_bounds(defaults["constraints"]), max_trials)
+        if lattice is None:
+            raise ValueError("No model satisfies the constraints in "+str(trials)+" trials.")
+        if frac_coords is None:
+            frac_coords = self.struct.frac_coords
+        return pymatgen.Structure(lattice, self.struct.species, frac_coords,
+                                  site_properties=self.struct.site_properties or None)
+    
+    def _generate_lattices(self, rng, num, base_lattice, symmetrical, modify_cell, modify_shape,
+                           cell_min, cell_max, bounds, max_trials, chunk_size):
+        """
+        Generates lattices satisfying constraints.
+        
+        Returns
+        -------
+        lattices: numpy.ndarray
+            Lattices (num x 3 x 3), fewer when "max_trials" is reached.
+        trials: int
+            Number of drawn candidates.
+        acceptance_rate: float
+            Rate of candidates satisfying constraints.
+        """
+        if symmetrical is True or (modify_cell is True and modify_shape is False):
+            low, high = self._scale_bounds(base_lattice, symmetrical, cell_min, cell_max, bounds)
+            if symmetrical is True:
+                return self._draw_symmetrical(rng, num, base_lattice, low, high), num, 1.0
+            return self._draw_cell(rng, num, base_lattice, False, low, high), num, 1.0
+        
+        if modify_cell is False:
+            if bounds is not None and not check_lattices(base_lattice[numpy.newaxis], *bounds)[0]:
+                raise ValueError("The original structure does not satisfy the constraints.")
+            return numpy.repeat(base_lattice[numpy.newaxis], num, axis=0), num, 1.0
+        
+        if bounds is None:
+            lattices = numpy.empty((num, 3, 3))
+            for start in range(0, num, chunk_size):
+                stop = min(start + chunk_size, num)
+                lattices[start:stop] = self._draw_cell(
+                    rng, stop - start, base_lattice, True, cell_min, cell_max)
+            return lattices, num, 1.0
+        
+        accepted = [numpy.empty((0, 3, 3))]
+        count = 0
+        hits = 0
+        trials = 0
+        while count < num and trials < max_trials:
+            size = min(chunk_size, max_trials - trials)
+            candidates = self._draw_cell(rng, size, base_lattice, True, cell_min, cell_max)
+            candidates = candidates[check_lattices(candidates, *bounds)]
+            hits += len(candidates)
+            trials += size
+            accepted.append(candidates[:num-count])
+            count += len(accepted[-1])
+        return numpy.concatenate(accepted), trials, float(hits) / max(trials, 1)
+    
+    def _constraint_bounds(self, constraints):
+        """
+        Converts constraints to bounds of lattice parameters.
+        
+        Arguments
+        ---------
+        constraints: dict or None
+            Constraints for lattice parameters with the same keys as
+            the arguments of check_constrains().
+        
+        Returns
+        -------
+        (lower, upper): tuple or None
+            Lower and upper bounds of (a, b, c, alpha, beta, gamma).
+        """
+        if constraints is None:
+            return None
+        bounds = {"a_min": -1.0, "a_max": 100.0, "b_min": -1.0, "b_max": 100.0,
+                  "c_min": -1.0, "c_max": 100.0, "alpha_min": 0.0, "alpha_max": 360.0,
+                  "beta_min": 0.0, "beta_max": 360.0, "gamma_min": 0.0, "gamma_max": 360.0}
+        for key, value in constraints.items():
+            if key not in bounds:
+                raise TypeError("Unknown constraint: " + str(key))
+            bounds[key] = value
+        keys = ("a", "b", "c", "alpha", "beta", "gamma")
+        return (numpy.array([bounds[key+"_min"] for key in keys]),
+                numpy.array([bounds[key+"_max"] for key in keys]))
+    
+    def _scale_bounds(self, lattice, symmetrical, min, max, bounds):
+        """
+        Gets the range of scaling factors of cell length satisfying constraints.
+        
+        Returns
+        -------
+        low, high: float or numpy.ndarray
+            Range of scaling factors, which are arrays (3 x 1) of each lattice vector
+            if not symmetrical.
+        """
+        low = numpy.full(3, 1.00+min)
+        high = numpy.full(3, 1.00+max)
+        if bounds is not None:
+            lower, upper = bounds
+            parameters = lattice_parameters(lattice[numpy.newaxis])[0]
+            if not numpy.all((lower[3:] < parameters[3:]) & (parameters[3:] < upper[3:])):
+                raise ValueError("Cell angles of the original structure "
+                                 "do not satisfy the constraints.")
+            low = numpy.maximum(low, lower[:3] / parameters[:3])
+            high = numpy.minimum(high, upper[:3] / parameters[:3])
+        if symmetrical is True:
+            low, high = low.max(), high.min()
+        else:
+            low, high = low[:, numpy.newaxis], high[:, numpy.newaxis]
+        if numpy.any(low >= high):
+            raise ValueError("No model satisfies the constraints.")
+        return low, high
+    
+    def _draw_symmetrical(self, rng, num, lattice, low, high):
+        """
+        Draws lattices modified as modify_symmetrical(),
+        whose scaling factor is in [low, high).
+        
+        Returns
+        -------
+        numpy.ndarray
+            Lattices (num x 3 x 3).
+        """
+        return lattice * rng.uniform(low, high, size=(num, 1, 1))
+    
+    def _draw_cell(self, rng, num, lattice, modify_shape, min, max):
+        """
+        Draws lattices modified as modify_cell().
+        Without modify_shape, "min" and "max" are the range of scaling factors.
+        
+        Returns
+        -------
+        numpy.ndarray
+            Lattices (num x 3 x 3).
+        """
+        if modify_shape is True:
+            var_shape = rng.uniform(min, max, size=(num, 3, 3))
+            var_cell = rng.uniform(1.00+min, 1.00+max, size=(num, 3, 3))
+            return (lattice + var_shape) * var_cell
+        return lattice * rng.uniform(min, max, size=(num, 3, 1))
+    
+    def _draw_atom(self, rng, num, frac_coords, prob, min, max):
+        """
+        Draws fractional coordinates modified as modify_atom().
+        
+        Returns
+        -------
+        numpy.ndarray
+            Fractional coordinates (num x natoms x 3).
+        """
+        shape = (num,) + frac_coords.shape
+        modified = rng.uniform(0.0, 100.0, size=shape) < prob
+        return frac_coords + numpy.where(modified, rng.uniform(min, max, size=shape), 0.0)
+    
     def modify_unsymmetrical(self, modify_cell=True, modify_shape=False, modify_atom=False,
                              swap_atom=False, cell_min=-0.01, cell_max=0.01,
                              atom_modify_prob=10.0, atom_min=-0.01, atom_max=0.01,
@@ -204,23 +594,33 @@ class ModelGenerator(object):
             The index of two swapping atoms.
         dummy: pymatgen.Structure.element
             The intermidiate of swapping atoms.
+        pools: list
+            Indices of atoms for each sublattice class, computed once
+            because restricted swaps never move atoms between classes.
         """
+        pools = self._swap_pools(restrict)
         for i in range(num):
-            atom1, atom2 = self.select_atoms(restrict)
+            atom1, atom2 = self.select_atoms(restrict, pools)
             dummy = self.struct_dict["sites"][atom1]["species"][0]["element"]
             self.struct_dict["sites"][atom1]["species"][0]["element"] = \
                 self.struct_dict["sites"][atom2]["species"][0]["element"]
             self.struct_dict["sites"][atom2]["species"][0]["element"] = dummy
         self.sort_atom()
     
-    def select_atoms(self, restrict):
+    def select_atoms(self, restrict, pools=None):
         """
         Selects two swapping atoms.
         
+        A sublattice class is chosen with the weight of the number of atom pairs
+        in it and two atoms are sampled from it directly, which gives the same
+        distribution as rejecting random pairs of different classes.
+        
         Arguments
         ---------
         restrict: bool
             If swapping restrict to metal(non-metal)-metal(non-metal).
+        pools: list or None
+            Indices of atoms for each sublattice class given by _swap_pools().
         
         Parameters
         ----------
@@ -232,13 +632,61 @@ class ModelGenerator(object):
         atom1, atom2: int
             The index of two swapping atoms.
         """
-        while True:
-            atom1 = random.randint(0, len(self.struct_dict["sites"])-1)
-            atom2 = random.randint(0, len(self.struct_dict["sites"])-1)
-            if not restrict or (self.is_metal(atom1) is self.is_metal(atom2)):
+        if pools is None:
+            pools = self._swap_pools(restrict)
+        draw = random.uniform(0.0, sum(len(pool)**2 for pool in pools))
+        for pool in pools:
+            draw -= len(pool)**2
+            if draw <= 0.0:
                 break
+        atom1 = pool[random.randint(0, len(pool)-1)]
+        atom2 = pool[random.randint(0, len(pool)-1)]
         return atom1, atom2
     
+    def _swap_pools(self, restrict):
+        """
+        Groups atoms into sublattice classes.
+        
+        Arguments
+        ---------
+        restrict: bool
+            If swapping restrict to metal(non-metal)-metal(non-metal).
+        
+        Returns
+        -------
+        pools: list
+            Lists of indices of atoms in each (non-empty) class.
+        """
+        if not restrict:
+            return [list(range(len(self.struct_dict["sites"])))]
+        metals = []
+        non_metals = []
+        for atom in range(len(self.struct_dict["sites"])):
+            if self.is_metal(atom):
+                metals.append(atom)
+            else:
+                non_metals.append(atom)
+        return [pool for pool in (metals, non_metals) if pool]
+    
+    def get_swap_engine(self, restrict=True, random_state=None):
+        """
+        Gets the species-swap engine for the original structure,
+        which samples valid pairs directly and rejects duplicated configurations.
+        
+        Arguments
+        ---------
+        restrict: bool
+            If swapping restrict to metal(non-metal)-metal(non-metal).
+        random_state: int, numpy.random.Generator or None
+            Seed or generator of random numbers.
+        
+        Returns
+        -------
+        SwapEngine
+            The species-swap engine.
+        """
+        return SwapEngine(self.struct, restrict=restrict, random_state=random_state)
+    
     def is_metal(self, atom):
         """
         If given atom is metal.
@@ -253,9 +701,7 @@ class ModelGenerator(object):
         bool
             If given atom is metal.
         """
-        return self.struct_dict["sites"][atom]["species"][0]["element"] not in [
-            "H", "He", "B", "C", "N", "O", "F", "Ne", "Si", "P", "S", "Cl",
-            "Ar", "As", "Se", "Br", "Kr", "Te", "I", "Xe", "At", "Rn"]
+        return self.struct_dict["sites"][atom]["species"][0]["element"] not in NON_METALS
     
     def sort_atom(self):
         """
@@ -264,43 +710,39 @@ class ModelGenerator(object):
         self.struct_dict["sites"] = \
             sorted(self.struct_dict["sites"], key=lambda x:x["species"][0]["element"])
     
-    def make_enough_large_supercell(self, num=10):
+    def make_enough_large_supercell(self, num=10, min_image_distance=0.0):
         """
         Makes enough large supercell for effective swapping.
         
+        The supercell is made by the diagonal transformation matrix
+        with the smallest determinant, which makes the number of atoms
+        and the distance between periodic images large enough.
+        
         Arguments
         ---------
         num: int
             The lower limit of the number of atoms in the cell.
-            If the number is lower than it, make shortest lattice vector
-            twice larger by using pymatgen.Structure.make_supercell() method.
+        min_image_distance: float
+            The lower limit of the distance between periodic images (angstrom),
+            which is checked by interplanar spacings of the supercell.
         
         Parameters
         ----------
-        supercell: list
-            The magnification rate of supercell,
-            [2, 1, 1], [1, 2, 1] or [1, 1, 2].
-        lattice: list
-            The list of lattice length.
-        min_lattice: int
-            The index of lattice with minimum length.
+        supercell: tuple
+            The magnification rate of supercell, e.g. (2, 1, 1).
         
         Returns
         -------
         bool
             If structure is largened.
         """
-        if not self.struct.num_sites < num:
+        supercell = supercell_scaling(self.struct.lattice.matrix, self.struct.num_sites,
+                                      num, min_image_distance)
+        if supercell == (1, 1, 1):
             return False
-        while True:
-            supercell = [1, 1, 1]
-            lattice = [self.struct.lattice.a, self.struct.lattice.b, self.struct.lattice.c]
-            min_lattice = lattice.index(min(lattice))
-            supercell[min_lattice] = 2
-            self.struct.make_supercell(supercell)
-            if self.struct.num_sites < num:
-                self.struct = self.get_struct()
-                return True
+        self.struct.make_supercell(supercell)
+        self.struct_dict = self.struct.as_dict()
+        return True
     
     def reset_struct(self):
         """
@@ -338,3 +780,108 @@ class ModelGenerator(object):
                 alpha_min < self.struct_dict["lattice"]["alpha"] < alpha_max and
                 beta_min  < self.struct_dict["lattice"]["beta"]  < beta_max  and
                 gamma_min < self.struct_dict["lattice"]["gamma"] < gamma_max )
+
+
+def generate_models(generator, seed, indices, params, max_trials):
+    """
+    Generates models from per-model streams of random numbers,
+    which is called in worker processes of ModelGenerator.generate().
+    
+    Arguments
+    ---------
+    generator: ModelGenerator
+        The model generator.
+    seed: int
+        Seed of the per-model streams of random numbers.
+    indices: numpy.ndarray
+        Indices of the models.
+    params: dict
+        Arguments given to generate().
+    max_trials: int
+        Maximum number of candidates drawn in rejection per model.
+    
+    Returns
+    -------
+    lattices: numpy.ndarray
+        Lattices of accepted models.
+    frac_coords: numpy.ndarray or None
+        Fractional coordinates of accepted models, None if they are not modified.
+    accepted: numpy.ndarray
+        Indices of accepted models.
+    trials, hits: int
+        Number of drawn candidates and those satisfying the constraints.
+    """
+    bounds = generator._constraint_bounds(params["constraints"])
+    lattices = []
+    frac_coords = []
+    accepted = []
+    trials = 0
+    hits = 0
+    for index in indices:
+        lattice, coords, model_trials, model_hits = generator._generate_model(
+            seed, index, params, bounds, max_trials)
+        trials += model_trials
+        hits += model_hits
+        if lattice is None:
+            continue
+        lattices.append(lattice)
+        frac_coords.append(coords)
+        accepted.append(index)
+    natoms = generator.struct.num_sites
+    lattices = numpy.array(lattices).reshape(-1, 3, 3)
+    if params["modify_atom"] is True and params["symmetrical"] is False:
+        frac_coords = numpy.array(frac_coords).reshape(-1, natoms, 3)
+    else:
+        frac_coords = None
+    return lattices, frac_coords, numpy.array(accepted, dtype=numpy.int64), trials, hits
+
+
+def supercell_scaling(lattice, num_sites, num=1, min_image_distance=0.0, tolerance=0.1):
+    """
+    Searches the diagonal transformation matrix of supercell, which satisfies
+    the number of atoms and the distance between periodic images. Among the matrices
+    whose determinants exceed the smallest one by at most "tolerance",
+    the one with the longest distance between periodic images (the smallest
+    interplanar spacing) is chosen, then the most isotropic and the smallest one.
+    
+    For each pair of the first two elements, only the smallest third element
+    satisfying the number of atoms is searched.
+    
+    Arguments
+    ---------
+    lattice: numpy.ndarray
+        Lattice matrix (3 x 3).
+    num_sites: int
+        Number of sites in the cell.
+    num: int
+        The lower limit of the number of atoms in the supercell.
+    min_image_distance: float
+        The lower limit of interplanar spacings of the supercell (angstrom).
+    tolerance: float
+        Relative excess of the determinant allowed for a more isotropic supercell.
+    
+    Returns
+    -------
+    tuple
+        Diagonal elements of the transformation matrix, e.g. (2, 1, 1).
+    """
+    spacing = [float(value)
+               for value in 1.0 / numpy.linalg.norm(numpy.linalg.inv(lattice).T, axis=1)]
+    lower = [max(int(math.ceil(min_image_distance / value - 1e-8)), 1) for value in spacing]
+    required = max(-(-int(num) // max(int(num_sites), 1)), 1)
+    candidates = []
+    # No element is larger than that reaching "required" with the others at lower bounds.
+    for n1 in range(lower[0], max(lower[0], -(-required // (lower[1] * lower[2]))) + 1):
+        for n2 in range(lower[1], max(lower[1], -(-required // (n1 * lower[2]))) + 1):
+            n3 = max(lower[2], -(-required // (n1 * n2)))
+            candidates.append((n1 * n2 * n3, (n1, n2, n3)))
+    limit = min(determinant for determinant, scaling in candidates) * (1.0 + tolerance)
+    best = None
+    for determinant, scaling in candidates:
+        if determinant > limit:
+            continue
+        spacings = [value * n for value, n in zip(spacing, scaling)]
+        key = (-min(spacings), max(spacings), determinant)
+        if best is None or key < best[0]:
+            best = (key, scaling)
+    return best[1]
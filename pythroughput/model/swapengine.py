@@ -0,0 +1,244 @@
+# coding: utf-8
+# Copyright (c) 2018-2019, Taku MURAKAMI. All rights reserved.
+# Distributed under the terms of the BSD 3-clause License.
+
+import logging
+import numpy
+from pythroughput.model.modelbatch import ModelBatch
+
+"""
+Species-swap engine.
+"""
+
+logger = logging.getLogger(__name__)
+
+NON_METALS = frozenset([
+    "H", "He", "B", "C", "N", "O", "F", "Ne", "Si", "P", "S", "Cl",
+    "Ar", "As", "Se", "Br", "Kr", "Te", "I", "Xe", "At", "Rn"])
+
+
+class SwapEngine(object):
+    """
+    Species-swap engine.
+    
+    The species of the sites are held as an integer array (occupancy),
+    whose values are the indices of the species sorted by element symbol.
+    Indices of the sites are precomputed for every species, and swapped pairs
+    are sampled directly from the pairs of different species in the same
+    sublattice class (metal or non-metal when restricted), so no pair is rejected.
+    Configurations are hashed by Zobrist hashing, which is updated in O(1)
+    by every swap, and duplicated configurations are rejected in O(1).
+    
+    Arguments
+    ---------
+    struct: pymatgen.Structure
+        The original structure.
+    restrict: bool
+        If swapping restrict to metal(non-metal)-metal(non-metal).
+    random_state: int, numpy.random.Generator or None
+        Seed or generator of random numbers.
+    
+    Parameters
+    ----------
+    species: list
+        Species sorted by element symbol, indexed by occupancy.
+    occupancy: numpy.ndarray
+        Indices of species of the sites in the current configuration.
+    """
+    
+    def __init__(self, struct, restrict=True, random_state=None):
+        self.struct = struct
+        self.restrict = restrict
+        self._rng = numpy.random.default_rng(random_state)
+        
+        self.species = sorted(set(struct.species),
+                              key=lambda specie: (specie.symbol, str(specie)))
+        codes = {specie: i for i, specie in enumerate(self.species)}
+        self._initial = numpy.array([codes[specie] for specie in struct.species],
+                                    dtype=numpy.int32)
+        
+        self._pairs, self._cum_weights = self._pair_weights()
+        self._zobrist = self._rng.integers(0, 2**63, dtype=numpy.int64,
+                                           size=(len(self._initial), len(self.species)))
+        self.reset()
+    
+    def reset(self):
+        """
+        Resets the configuration to the original one.
+        """
+        self.occupancy = self._initial.copy()
+        self._sites = [numpy.flatnonzero(self.occupancy == i)
+                       for i in range(len(self.species))]
+        self._position = numpy.empty(len(self.occupancy), dtype=numpy.int64)
+        for sites in self._sites:
+            self._position[sites] = numpy.arange(len(sites))
+        self._hash = int(numpy.bitwise_xor.reduce(
+            self._zobrist[numpy.arange(len(self.occupancy)), self.occupancy]))
+    
+    def is_metal(self, specie):
+        """
+        If given species is metal.
+        
+        Arguments
+        ---------
+        specie: pymatgen.Element or pymatgen.Specie
+            The species.
+        
+        Returns
+        -------
+        bool
+            If given species is metal.
+        """
+        return specie.symbol not in NON_METALS
+    
+    def _pair_weights(self):
+        """
+        Lists the pairs of species which can be swapped,
+        weighted by the number of site pairs.
+        
+        Returns
+        -------
+        pairs: numpy.ndarray
+            Pairs of the indices of species (npairs x 2).
+        cum_weights: numpy.ndarray
+            Normalized cumulative weights of the pairs.
+        """
+        counts = numpy.bincount(self._initial, minlength=len(self.species))
+        pairs = []
+        weights = []
+        for i in range(len(self.species)):
+            for j in range(i + 1, len(self.species)):
+                if (self.restrict is True and
+                        self.is_metal(self.species[i]) is not self.is_metal(self.species[j])):
+                    continue
+                pairs.append((i, j))
+                weights.append(counts[i] * counts[j])
+        if sum(weights) == 0:
+            raise ValueError("No pair of sites can be swapped in this structure.")
+        cum_weights = numpy.cumsum(weights, dtype=numpy.float64)
+        return numpy.array(pairs, dtype=numpy.int64), cum_weights / cum_weights[-1]
+    
+    def swap(self, atom1, atom2):
+        """
+        Swaps species of two sites.
+        
+        Arguments
+        ---------
+        atom1, atom2: int
+            The index of two swapping sites.
+        """
+        specie1 = self.occupancy[atom1]
+        specie2 = self.occupancy[atom2]
+        if specie1 == specie2:
+            return
+        position1 = self._position[atom1]
+        position2 = self._position[atom2]
+        self._sites[specie1][position1] = atom2
+        self._sites[specie2][position2] = atom1
+        self._position[atom1] = position2
+        self._position[atom2] = position1
+        self.occupancy[atom1] = specie2
+        self.occupancy[atom2] = specie1
+        self._hash ^= int(self._zobrist[atom1, specie1] ^ self._zobrist[atom1, specie2] ^
+                          self._zobrist[atom2, specie2] ^ self._zobrist[atom2, specie1])
+    
+    def swap_random(self, num):
+        """
+        Swaps species of "num" pairs of sites sampled randomly.
+        
+        Arguments
+        ---------
+        num: int
+            Number of swapping two sites.
+        
+        Returns
+        -------
+        swapped: list
+            Pairs of swapped sites, which restore the configuration
+            when they are swapped again in reverse order.
+        """
+        pairs = self._pairs[numpy.searchsorted(self._cum_weights, self._rng.random(num),
+                                               side="right")]
+        draws = self._rng.random((num, 2))
+        swapped = []
+        for (specie1, specie2), (draw1, draw2) in zip(pairs, draws):
+            sites1 = self._sites[specie1]
+            sites2 = self._sites[specie2]
+            atom1 = sites1[int(draw1 * len(sites1))]
+            atom2 = sites2[int(draw2 * len(sites2))]
+            self.swap(atom1, atom2)
+            swapped.append((atom1, atom2))
+        return swapped
+    
+    def get_hash(self):
+        """
+        Gets the hash of the current configuration.
+        
+        Returns
+        -------
+        int
+            Zobrist hash of the configuration.
+        """
+        return self._hash
+    
+    def generate(self, num, swap_num=10, unique=True, max_trials=None):
+        """
+        Generates configurations, each of which is made by "swap_num" swaps
+        from the original configuration.
+        
+        Arguments
+        ---------
+        num: int
+            Number of generated configurations.
+        swap_num: int
+            Number of swapping two sites for each configuration.
+        unique: bool
+            If duplicated configurations, including the original one, are rejected.
+        max_trials: int or None
+            Maximum number of trials, default is 10 * num.
+            Fewer configurations are returned when it is reached.
+        
+        Returns
+        -------
+        numpy.ndarray
+            Occupancies of the configurations (num x natoms).
+        """
+        if max_trials is None:
+            max_trials = 10 * num
+        self.reset()
+        seen = set([self.get_hash()])
+        occupancies = []
+        trials = 0
+        while len(occupancies) < num and trials < max_trials:
+            trials += 1
+            swapped = self.swap_random(swap_num)
+            if unique is False or self._hash not in seen:
+                seen.add(self._hash)
+                occupancies.append(self.occupancy.copy())
+            for atom1, atom2 in reversed(swapped):
+                self.swap(atom1, atom2)
+        if len(occupancies) < num:
+            logger.warning("Only %d unique configurations are found in %d trials.",
+                           len(occupancies), trials)
+        self.reset()
+        return numpy.array(occupancies, dtype=numpy.int32).reshape(-1, len(self._initial))
+    
+    def generate_batch(self, num, swap_num=10, unique=True, max_trials=None, name="model"):
+        """
+        Generates swapped models as ModelBatch.
+        
+        Arguments
+        ---------
+        (same as generate())
+        name: str
+            Prefix of the names of models.
+        
+        Returns
+        -------
+        ModelBatch
+            Generated models, whose sites are sorted by species.
+        """
+        occupancies = self.generate(num, swap_num, unique, max_trials)
+        lattices = numpy.broadcast_to(self.struct.lattice.matrix, (len(occupancies), 3, 3))
+        return ModelBatch(lattices, self.struct.frac_coords, self.species,
+                          occupancies=occupancies, name=name)
@@ -3,3 +3,7 @@
 # Distributed under the terms of the BSD 3-clause License.
 
 from . import pythroughcsv
+from . import resulttable
+from . import trajectorystore
+from . import manifest
+from . import telemetry
@@ -0,0 +1,229 @@
+# coding: utf-8
+# Copyright (c) 2018-2019, Taku MURAKAMI. All rights reserved.
+# Distributed under the terms of the BSD 3-clause License.
+
+import logging
+import os
+import json
+import time
+import hashlib
+import numpy
+
+"""
+Sharded layout of output files and the manifest of calculations.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def shard_path(output_path, struct_name, levels=2, width=2):
+    """
+    Gets the output path of the structure in the sharded layout,
+    e.g. "(output path)/3f/a2/(structure name)", so that no directory
+    has more than 16^width entries of shards.
+    
+    Arguments
+    ---------
+    output_path: str
+        Root of output files.
+    struct_name: str
+        Name of the structure.
+    levels: int
+        Number of levels of hash-prefix directories.
+    width: int
+        Number of hexadecimal digits of the name of each directory.
+    
+    Returns
+    -------
+    str
+        Output path of the structure.
+    """
+    digest = hashlib.sha1(struct_name.encode("utf-8")).hexdigest()
+    prefixes = [digest[i*width:(i+1)*width] for i in range(levels)]
+    return os.path.join(output_path, *prefixes, struct_name)
+
+
+def _to_json(value):
+    """
+    Converts a value which is not serializable by json, e.g. numpy.ndarray.
+    """
+    if isinstance(value, numpy.ndarray):
+        return value.tolist()
+    if isinstance(value, numpy.generic):
+        return value.item()
+    if hasattr(value, "as_dict"):
+        return value.as_dict()
+    return str(value)
+
+
+def get_digest(results):
+    """
+    Gets the digest of calculation results.
+    
+    Arguments
+    ---------
+    results: dict or ResultView
+        Calculation results.
+    
+    Returns
+    -------
+    str
+        SHA-1 digest of the results serialized by json with sorted keys.
+    """
+    if hasattr(results, "keys"):
+        results = {key: results[key] for key in results.keys()}
+    serialized = json.dumps(results, sort_keys=True, default=_to_json)
+    return hashlib.sha1(serialized.encode("utf-8")).hexdigest()
+
+
+def get_status(results):
+    """
+    Gets the status of calculation from the results.
+    
+    Arguments
+    ---------
+    results: dict or None
+        Calculation results.
+    
+    Returns
+    -------
+    str
+        "done", "failed", "unconverged" or "invalid".
+    """
+    if not hasattr(results, "get") or "error" in results:
+        return "failed"
+    if any(isinstance(value, str) and value == "Unconverged" for value in results.values()):
+        return "unconverged"
+    if results.get("results") == "Invalid geometry":
+        return "invalid"
+    return "done"
+
+
+class Manifest(object):
+    """
+    Manifest of calculations, which maps the name of structure to its output
+    path, status and digest of results, so that finished calculations are
+    found without walking the output tree.
+    
+    Records are appended to a JSON-lines file one line at a time, and
+    the latest record of each structure is used. A line interrupted while
+    writing is ignored.
+    
+    Arguments
+    ---------
+    path: str
+        Path to the manifest file, e.g. "(output path)/manifest.jsonl".
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._entries = {}
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            self._load()
+    
+    def _load(self):
+        """
+        Loads the records from the manifest file.
+        """
+        with open(self.path) as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    logger.warning("Broken line in %s is ignored.", self.path)
+                    continue
+                self._entries[entry["struct_name"]] = entry
+        if not line.endswith("\n"):
+            # The interrupted line is terminated not to break the next record.
+            with open(self.path, mode="a") as file:
+                file.write("\n")
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def __contains__(self, struct_name):
+        return struct_name in self._entries
+    
+    def get(self, struct_name, default=None):
+        """
+        Gets the latest record of the structure.
+        
+        Arguments
+        ---------
+        struct_name: str
+            Name of the structure.
+        
+        Returns
+        -------
+        entry: dict
+            "struct_name", "path", "status", "digest" and "time".
+        """
+        return self._entries.get(struct_name, default)
+    
+    def names(self, status=None):
+        """
+        Gets the names of the recorded structures.
+        
+        Arguments
+        ---------
+        status: str or None
+            Status of the structures, e.g. "done". When it is None,
+            all the structures are returned.
+        
+        Returns
+        -------
+        list
+            Names of structures.
+        """
+        return [struct_name for struct_name, entry in self._entries.items()
+                if status is None or entry["status"] == status]
+    
+    def is_done(self, struct_name):
+        """
+        Is the calculation of the structure finished.
+        """
+        entry = self._entries.get(struct_name)
+        return entry is not None and entry["status"] == "done"
+    
+    def record(self, struct_name, path, results=None, status=None):
+        """
+        Appends the record of the structure.
+        
+        Arguments
+        ---------
+        struct_name: str
+            Name of the structure.
+        path: str or None
+            Output path of the structure.
+        results: dict or None
+            Calculation results, from which the digest is calculated.
+        status: str or None
+            Status of calculation. When it is None, it is given by the results.
+        
+        Returns
+        -------
+        entry: dict
+            Appended record.
+        """
+        entry = {"struct_name": struct_name,
+                 "path": path,
+                 "status": status if status is not None else get_status(results),
+                 "digest": get_digest(results) if results is not None else None,
+                 "time": time.time()}
+        with open(self.path, mode="a") as file:
+            file.write(json.dumps(entry) + "\n")
+        self._entries[struct_name] = entry
+        return entry
+    
+    def compact(self):
+        """
+        Rewrites the manifest file with only the latest record of each structure.
+        """
+        temporary = self.path + ".part"
+        with open(temporary, mode="w") as file:
+            for entry in self._entries.values():
+                file.write(json.dumps(entry) + "\n")
+        os.replace(temporary, self.path)
@@ -4,6 +4,7 @@
 
 import logging
 import csv
+import numpy
 
 """
 CSV writer implimented to pythroughput package.
@@ -20,8 +21,8 @@ class PyThroughCsv(object):
     ---------
     filename: str
         CSV filename.
-    results: list
-        List of calculation results from pythroughput.Calculation classes.
+    results: dict or ResultTable
+        Calculation results from pythroughput.Calculation classes.
     write_title: bool
         If title line is written automatically with formatting CSV file.
     parameters: list
@@ -91,7 +92,10 @@ class PyThroughCsv(object):
         
         for parameter in self.parameters:
             try:
-                result_line.append(result[parameter])
+                value = result[parameter]
+                if isinstance(value, numpy.ndarray):
+                    value = value.tolist()
+                result_line.append(value)
             except KeyError:
                 result_line.append("Undefined key")
         
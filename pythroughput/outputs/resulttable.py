@@ -0,0 +1,484 @@
+# coding: utf-8
+# Copyright (c) 2018-2019, Taku MURAKAMI. All rights reserved.
+# Distributed under the terms of the BSD 3-clause License.
+
+import logging
+import numbers
+import numpy
+
+"""
+Compact array-backed table of calculation results.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class ResultTable(object):
+    """
+    Compact array-backed table of calculation results.
+    
+    It behaves like the dictionary of calculation results returned by
+    PyHighThroughput, which consists of the name of structure as a key and
+    the result of calculation as a value, but does not keep one python dict
+    per structure. Scalar values (e.g. total energy) are stored in one numpy
+    array (int64 or float64) per field, and array values (e.g. forces) are stored in one
+    contiguous float64 buffer with offsets. The other values (e.g. formula,
+    "Unconverged" or relaxed structure) are kept as python objects.
+    
+    results[struct_name] returns a lightweight ResultView,
+    which can be used as the dictionary of calculation results.
+    
+    Arguments
+    ---------
+    capacity: int
+        Initial number of rows allocated.
+    
+    Parameters
+    ----------
+    fields: list
+        Names of fields in order of appearance.
+    """
+    
+    def __init__(self, capacity=1024):
+        self._capacity = max(int(capacity), 1)
+        self._names = []
+        self._rows = {}
+        self.fields = []
+        # Scalar fields: values and presence of each row.
+        self._scalars = {}
+        self._scalar_mask = {}
+        # Array fields: (offset, length) of each row in self._buffer,
+        # and the shape except the first axis.
+        self._arrays = {}
+        self._array_mask = {}
+        self._array_shapes = {}
+        self._buffer = numpy.empty(self._capacity * 64, dtype=numpy.float64)
+        self._buffer_size = 0
+        # Python objects keyed by (row, field), and results which are not dict.
+        self._objects = {}
+        self._raw = {}
+    
+    def __len__(self):
+        return len(self._names)
+    
+    def __iter__(self):
+        return iter(self._names)
+    
+    def __contains__(self, struct_name):
+        return struct_name in self._rows
+    
+    def __getitem__(self, struct_name):
+        row = self._rows[struct_name]
+        if row in self._raw:
+            return self._raw[row]
+        return ResultView(self, row)
+    
+    def __setitem__(self, struct_name, result):
+        # Values are taken before the row is cleared, since the result may be its view.
+        items = list(result.items()) if isinstance(result, (dict, ResultView)) else None
+        row = self._rows.get(struct_name)
+        if row is None:
+            row = self._append_row(struct_name)
+        else:
+            self._clear_row(row)
+        if items is not None:
+            for key, value in items:
+                self.set_value(row, key, value)
+        else:
+            self._raw[row] = result
+    
+    def __repr__(self):
+        return "<ResultTable: {} results, {} fields>".format(len(self), len(self.fields))
+    
+    def keys(self):
+        """
+        Gets the names of structures.
+        
+        Returns
+        -------
+        list
+            Names of structures.
+        """
+        return list(self._names)
+    
+    def values(self):
+        """
+        Gets the results of structures.
+        
+        Returns
+        -------
+        generator
+            ResultView (or raw result) of every structure.
+        """
+        return (self[struct_name] for struct_name in self._names)
+    
+    def items(self):
+        """
+        Gets pairs of the name and result of structures.
+        
+        Returns
+        -------
+        generator
+            Pairs of the name of structure and ResultView.
+        """
+        return ((struct_name, self[struct_name]) for struct_name in self._names)
+    
+    def get(self, struct_name, default=None):
+        """
+        Gets result of the structure.
+        
+        Arguments
+        ---------
+        struct_name: str
+            Name of the structure.
+        default: object
+            Returned value when the structure is not found.
+        
+        Returns
+        -------
+        ResultView or default
+        """
+        if struct_name in self._rows:
+            return self[struct_name]
+        return default
+    
+    def update(self, results):
+        """
+        Updates results by other results.
+        
+        Arguments
+        ---------
+        results: dict or ResultTable
+            Dictionary of calculation results.
+        """
+        for struct_name, result in results.items():
+            self[struct_name] = result
+    
+    def to_dict(self):
+        """
+        Converts results to the plain dictionary of calculation results.
+        
+        Returns
+        -------
+        dict
+            Dictionary of calculation results.
+        """
+        results = {}
+        for struct_name, result in self.items():
+            if isinstance(result, ResultView):
+                result = result.to_dict()
+            results[struct_name] = result
+        return results
+    
+    def column(self, field):
+        """
+        Gets values of a scalar field of all structures.
+        
+        Arguments
+        ---------
+        field: str
+            Name of the scalar field, e.g. "total_energy".
+        
+        Returns
+        -------
+        numpy.ndarray
+            Values of the field as float64, nan for missing or non-numerical values.
+        """
+        num = len(self._names)
+        if field not in self._scalars:
+            return numpy.full(num, numpy.nan)
+        return numpy.where(self._scalar_mask[field][:num],
+                           self._scalars[field][:num].astype(numpy.float64), numpy.nan)
+    
+    def nbytes(self):
+        """
+        Gets the number of bytes used by the numpy arrays.
+        
+        Returns
+        -------
+        int
+            Number of bytes.
+        """
+        arrays = [self._buffer]
+        arrays += list(self._scalars.values()) + list(self._scalar_mask.values())
+        arrays += list(self._arrays.values()) + list(self._array_mask.values())
+        return sum(array.nbytes for array in arrays)
+    
+    def get_value(self, row, field):
+        """
+        Gets a value of the row.
+        
+        Arguments
+        ---------
+        row: int
+            Index of the row.
+        field: str
+            Name of the field.
+        
+        Returns
+        -------
+        object
+            Stored value. Array values are returned as read-only numpy views.
+        """
+        if (row, field) in self._objects:
+            return self._objects[(row, field)]
+        if field in self._scalars and self._scalar_mask[field][row]:
+            return self._scalars[field][row].item()
+        if field in self._arrays and self._array_mask[field][row]:
+            offset, length = self._arrays[field][row]
+            view = self._buffer[offset:offset+length].reshape(
+                (-1,) + self._array_shapes[field])
+            view.flags.writeable = False
+            return view
+        raise KeyError(field)
+    
+    def has_value(self, row, field):
+        """
+        Is the value stored in the row.
+        
+        Returns
+        -------
+        bool
+        """
+        return ((row, field) in self._objects or
+                (field in self._scalars and bool(self._scalar_mask[field][row])) or
+                (field in self._arrays and bool(self._array_mask[field][row])))
+    
+    def set_value(self, row, field, value):
+        """
+        Sets a value of the row.
+        
+        Arguments
+        ---------
+        row: int
+            Index of the row.
+        field: str
+            Name of the field.
+        value: object
+            Value to store.
+        """
+        self._remove_value(row, field)
+        if field not in self.fields:
+            self.fields.append(field)
+        
+        if isinstance(value, numbers.Real) and not isinstance(value, bool):
+            if isinstance(value, numbers.Integral):
+                dtype = numpy.int64
+            else:
+                dtype = numpy.float64
+            if field not in self._scalars or self._scalars[field].dtype == dtype:
+                self._set_scalar(row, field, value, dtype)
+                return
+        
+        array = self._as_float_array(value)
+        if array is not None and array.ndim > 0 and (
+                field not in self._array_shapes or
+                self._array_shapes[field] == array.shape[1:]):
+            self._set_array(row, field, array)
+        else:
+            self._objects[(row, field)] = value
+    
+    def del_value(self, row, field):
+        """
+        Deletes a value of the row.
+        
+        Arguments
+        ---------
+        row: int
+            Index of the row.
+        field: str
+            Name of the field.
+        """
+        if not self.has_value(row, field):
+            raise KeyError(field)
+        self._remove_value(row, field)
+    
+    def row_fields(self, row):
+        """
+        Gets fields stored in the row.
+        
+        Arguments
+        ---------
+        row: int
+            Index of the row.
+        
+        Returns
+        -------
+        list
+            Names of fields in order of appearance.
+        """
+        return [field for field in self.fields if self.has_value(row, field)]
+    
+    def _append_row(self, struct_name):
+        """
+        Appends a new row.
+        
+        Arguments
+        ---------
+        struct_name: str
+            Name of the structure.
+        
+        Returns
+        -------
+        row: int
+            Index of the new row.
+        """
+        row = len(self._names)
+        if row >= self._capacity:
+            self._grow_rows(2 * self._capacity)
+        self._names.append(struct_name)
+        self._rows[struct_name] = row
+        return row
+    
+    def _clear_row(self, row):
+        """
+        Clears all values in the row. The buffer is not compacted.
+        """
+        self._raw.pop(row, None)
+        for field in self.fields:
+            self._remove_value(row, field)
+    
+    def _remove_value(self, row, field):
+        self._objects.pop((row, field), None)
+        if field in self._scalar_mask:
+            self._scalar_mask[field][row] = False
+        if field in self._array_mask:
+            self._array_mask[field][row] = False
+    
+    def _grow_rows(self, capacity):
+        """
+        Grows all columns to given capacity.
+        """
+        for columns in (self._scalars, self._scalar_mask, self._arrays, self._array_mask):
+            for field, column in columns.items():
+                grown = numpy.zeros((capacity,) + column.shape[1:], dtype=column.dtype)
+                grown[:self._capacity] = column
+                columns[field] = grown
+        self._capacity = capacity
+    
+    def _set_scalar(self, row, field, value, dtype):
+        if field not in self._scalars:
+            self._scalars[field] = numpy.zeros(self._capacity, dtype=dtype)
+            self._scalar_mask[field] = numpy.zeros(self._capacity, dtype=bool)
+        self._scalars[field][row] = value
+        self._scalar_mask[field][row] = True
+    
+    def _set_array(self, row, field, array):
+        if field not in self._arrays:
+            self._arrays[field] = numpy.zeros((self._capacity, 2), dtype=numpy.int64)
+            self._array_mask[field] = numpy.zeros(self._capacity, dtype=bool)
+            self._array_shapes[field] = array.shape[1:]
+        length = array.size
+        if self._buffer_size + length > self._buffer.size:
+            grown = numpy.empty(max(2 * self._buffer.size, self._buffer_size + length),
+                                dtype=numpy.float64)
+            grown[:self._buffer_size] = self._buffer[:self._buffer_size]
+            self._buffer = grown
+        self._buffer[self._buffer_size:self._buffer_size+length] = array.ravel()
+        self._arrays[field][row] = (self._buffer_size, length)
+        self._array_mask[field][row] = True
+        self._buffer_size += length
+    
+    def _as_float_array(self, value):
+        """
+        Converts value to float64 array if it is numerical list or array.
+        
+        Returns
+        -------
+        numpy.ndarray or None
+        """
+        if not isinstance(value, (list, tuple, numpy.ndarray)):
+            return None
+        try:
+            array = numpy.asarray(value)
+        except (TypeError, ValueError):
+            return None
+        if array.dtype.kind not in "iuf":
+            return None
+        return array.astype(numpy.float64)
+
+
+class ResultView(object):
+    """
+    Lightweight view to a row of ResultTable,
+    which can be used as the dictionary of calculation results.
+    """
+    
+    __slots__ = ("_table", "_row")
+    
+    def __init__(self, table, row):
+        self._table = table
+        self._row = row
+    
+    def __getitem__(self, field):
+        return self._table.get_value(self._row, field)
+    
+    def __setitem__(self, field, value):
+        self._table.set_value(self._row, field, value)
+    
+    def __delitem__(self, field):
+        self._table.del_value(self._row, field)
+    
+    def __contains__(self, field):
+        return self._table.has_value(self._row, field)
+    
+    def __iter__(self):
+        return iter(self.keys())
+    
+    def __len__(self):
+        return len(self.keys())
+    
+    def __eq__(self, other):
+        if isinstance(other, ResultView):
+            other = other.to_dict()
+        if not isinstance(other, dict):
+            return NotImplemented
+        return self.keys() == list(other.keys()) and all(
+            numpy.array_equal(self[key], other[key])
+            if isinstance(self[key], numpy.ndarray) else self[key] == other[key]
+            for key in self.keys())
+    
+    def __repr__(self):
+        return "ResultView({!r})".format(self.to_dict())
+    
+    def get(self, field, default=None):
+        """
+        Gets a value of the result, default if it is not stored.
+        """
+        if field in self:
+            return self[field]
+        return default
+    
+    def keys(self):
+        """
+        Gets the names of stored values.
+        """
+        return self._table.row_fields(self._row)
+    
+    def values(self):
+        """
+        Gets the stored values.
+        """
+        return [self[field] for field in self.keys()]
+    
+    def items(self):
+        """
+        Gets pairs of the name and stored value.
+        """
+        return [(field, self[field]) for field in self.keys()]
+    
+    def to_dict(self):
+        """
+        Converts the view to the dictionary of calculation results.
+        
+        Returns
+        -------
+        dict
+            Dictionary of caluclation results, where array values are copied as lists.
+        """
+        result = {}
+        for field, value in self.items():
+            if isinstance(value, numpy.ndarray):
+                value = value.tolist()
+            result[field] = value
+        return result
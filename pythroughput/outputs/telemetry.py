@@ -0,0 +1,307 @@
+# coding: utf-8
+# Copyright (c) 2018-2019, Taku MURAKAMI. All rights reserved.
+# Distributed under the terms of the BSD 3-clause License.
+
+import logging
+import os
+import time
+import json
+import tempfile
+import threading
+from pythroughput.outputs.manifest import get_status
+
+"""
+Live telemetry of high-throughput calculation written to files.
+"""
+
+logger = logging.getLogger(__name__)
+
+# Name, type and help of the metrics exported to the Prometheus textfile.
+METRICS = (("jobs_total", "gauge", "Number of structures in the campaign."),
+           ("jobs_finished", "counter", "Number of finished structures."),
+           ("jobs_failed", "counter", "Number of failed structures."),
+           ("jobs_unconverged", "counter", "Number of unconverged structures."),
+           ("jobs_invalid", "counter", "Number of structures with invalid geometry."),
+           ("jobs_running", "gauge", "Number of running structures."),
+           ("queue_depth", "gauge", "Number of structures waiting for dispatch."),
+           ("jobs_per_hour", "gauge", "Throughput of finished structures."),
+           ("core_hours", "counter", "Core-hours consumed by finished and running jobs."),
+           ("mean_scf_iterations", "gauge", "Mean SCF iterations per job."),
+           ("mean_ionic_steps", "gauge", "Mean ionic steps per job."),
+           ("failure_rate", "gauge", "Fraction of failed structures."),
+           ("unconverged_rate", "gauge", "Fraction of unconverged structures."),
+           ("elapsed_seconds", "gauge", "Elapsed time of the campaign."),
+           ("eta_seconds", "gauge", "Projected time to completion."),
+           ("projected_completion_timestamp_seconds", "gauge",
+            "Projected completion time since the epoch."))
+
+
+def write_atomically(path, text):
+    """
+    Writes text to the file, which is replaced atomically,
+    so readers (e.g. node_exporter) never see a partial file.
+    The temporary file has a unique name, so concurrent writers do not share it.
+    
+    Arguments
+    ---------
+    path: str
+        Path to the file.
+    text: str
+        Contents of the file.
+    """
+    descriptor, temporary = tempfile.mkstemp(prefix=os.path.basename(path) + ".",
+                                             suffix=".part",
+                                             dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(descriptor, mode="w") as file:
+            file.write(text)
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+class CampaignTelemetry(object):
+    """
+    Live telemetry of a calculation campaign, which reports throughput,
+    queue depth, running jobs, core-hours, SCF and ionic statistics,
+    failure and unconverged rates, and projected completion time.
+    
+    Metrics are exported as a Prometheus textfile (for the textfile collector
+    of node_exporter) and a JSON status file, which are rewritten atomically
+    when jobs finish and every "interval" seconds by a background thread.
+    No network service is used. Errors in writing the files are logged
+    and never interrupt the calculation.
+    
+    Arguments
+    ---------
+    textfile: str or None
+        Path to the Prometheus textfile, e.g. "(directory)/pythroughput.prom".
+    status_path: str or None
+        Path to the JSON status file.
+    cores_per_job: int
+        Number of cores used by a job, from which core-hours are calculated.
+    interval: float or None
+        Interval of periodic rewrite (second). When it is None,
+        the files are rewritten only when jobs finish.
+    prefix: str
+        Prefix of the names of the metrics.
+    labels: dict or None
+        Labels of the metrics, e.g. {"campaign": "Al-Cu"}.
+    """
+    
+    def __init__(self, textfile=None, status_path=None, cores_per_job=1, interval=30.0,
+                 prefix="pythroughput", labels=None):
+        self.textfile = textfile
+        self.status_path = status_path
+        self.cores_per_job = cores_per_job
+        self.interval = interval
+        self.prefix = prefix
+        self.labels = labels if labels is not None else {}
+        self._lock = threading.Lock()
+        # The files are written by the background thread and the calculation.
+        self._write_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.reset()
+    
+    def reset(self, num_jobs=None):
+        """
+        Resets the metrics.
+        
+        Arguments
+        ---------
+        num_jobs: int or None
+            Number of structures in the campaign, if it is known.
+        """
+        with self._lock:
+            self.num_jobs = num_jobs
+            self.started = time.time()
+            self.counts = {"done": 0, "failed": 0, "unconverged": 0, "invalid": 0}
+            self.running = {}
+            self.core_seconds = 0.0
+            self.scf_iterations = []
+            self.ionic_steps = []
+            self.last_struct_name = None
+    
+    def start(self, num_jobs=None):
+        """
+        Starts the campaign and the periodic rewrite.
+        
+        Arguments
+        ---------
+        num_jobs: int or None
+            Number of structures in the campaign, if it is known.
+        """
+        self.reset(num_jobs)
+        self.write()
+        if self.interval is not None and self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+    
+    def stop(self):
+        """
+        Stops the periodic rewrite and writes the final metrics.
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.write()
+    
+    def job_started(self, struct_name, cores=None):
+        """
+        Records the start of the job.
+        
+        Arguments
+        ---------
+        struct_name: str
+            Name of the structure.
+        cores: int or None
+            Number of cores used by the job. When it is None, cores_per_job is used.
+        """
+        with self._lock:
+            self.running[struct_name] = (time.time(),
+                                         cores if cores is not None else self.cores_per_job)
+    
+    def job_skipped(self, struct_name):
+        """
+        Records the structure skipped in the campaign, e.g. finished before resume.
+        
+        Arguments
+        ---------
+        struct_name: str
+            Name of the structure.
+        """
+        with self._lock:
+            if self.num_jobs is not None:
+                self.num_jobs = max(self.num_jobs - 1, 0)
+    
+    def job_finished(self, struct_name, results, statistics=None):
+        """
+        Records the end of the job and rewrites the files.
+        
+        Arguments
+        ---------
+        struct_name: str
+            Name of the structure.
+        results: dict or None
+            Calculation results, from which the status is given.
+        statistics: dict or None
+            "scf_iterations" and "ionic_steps" of the job.
+        """
+        with self._lock:
+            started, cores = self.running.pop(struct_name, (time.time(), 0))
+            self.core_seconds += (time.time() - started) * cores
+            self.counts[get_status(results)] += 1
+            if statistics is not None:
+                if statistics.get("scf_iterations") is not None:
+                    self.scf_iterations.append(statistics["scf_iterations"])
+                if statistics.get("ionic_steps") is not None:
+                    self.ionic_steps.append(statistics["ionic_steps"])
+            self.last_struct_name = struct_name
+        self.write()
+    
+    def get_metrics(self):
+        """
+        Gets the current metrics.
+        
+        Returns
+        -------
+        metrics: dict
+            Values of the metrics in METRICS, which are None when they are unknown.
+        """
+        with self._lock:
+            now = time.time()
+            elapsed = now - self.started
+            finished = sum(self.counts.values())
+            core_seconds = self.core_seconds + sum((now - started) * cores
+                                                   for started, cores in self.running.values())
+            metrics = {"jobs_total": self.num_jobs,
+                       "jobs_finished": finished,
+                       "jobs_failed": self.counts["failed"],
+                       "jobs_unconverged": self.counts["unconverged"],
+                       "jobs_invalid": self.counts["invalid"],
+                       "jobs_running": len(self.running),
+                       "queue_depth": None,
+                       "jobs_per_hour": finished / elapsed * 3600.0 if elapsed > 0 else None,
+                       "core_hours": core_seconds / 3600.0,
+                       "mean_scf_iterations": _mean(self.scf_iterations),
+                       "mean_ionic_steps": _mean(self.ionic_steps),
+                       "failure_rate": self.counts["failed"] / finished if finished else None,
+                       "unconverged_rate": (self.counts["unconverged"] / finished
+                                            if finished else None),
+                       "elapsed_seconds": elapsed,
+                       "eta_seconds": None,
+                       "projected_completion_timestamp_seconds": None}
+            if self.num_jobs is not None:
+                remaining = max(self.num_jobs - finished, 0)
+                metrics["queue_depth"] = max(remaining - len(self.running), 0)
+                if finished > 0:
+                    metrics["eta_seconds"] = remaining * elapsed / finished
+                    metrics["projected_completion_timestamp_seconds"] = \
+                        now + metrics["eta_seconds"]
+        return metrics
+    
+    def to_prometheus(self, metrics=None):
+        """
+        Formats the metrics in the Prometheus text exposition format.
+        
+        Arguments
+        ---------
+        metrics: dict or None
+            Metrics given by get_metrics().
+        
+        Returns
+        -------
+        str
+        """
+        if metrics is None:
+            metrics = self.get_metrics()
+        labels = ",".join('{}="{}"'.format(key, str(value).replace('"', '\\"'))
+                          for key, value in sorted(self.labels.items()))
+        labels = "{" + labels + "}" if labels else ""
+        lines = []
+        for name, metric_type, help_text in METRICS:
+            if metrics.get(name) is None:
+                continue
+            full_name = self.prefix + "_" + name
+            lines.append("# HELP {} {}".format(full_name, help_text))
+            lines.append("# TYPE {} {}".format(full_name, metric_type))
+            lines.append("{}{} {}".format(full_name, labels, repr(float(metrics[name]))))
+        return "\n".join(lines) + "\n"
+    
+    def write(self):
+        """
+        Rewrites the Prometheus textfile and the JSON status file atomically.
+        Errors in writing them are logged and not raised.
+        """
+        with self._write_lock:
+            metrics = self.get_metrics()
+            try:
+                if self.textfile is not None:
+                    write_atomically(self.textfile, self.to_prometheus(metrics))
+                if self.status_path is not None:
+                    status = dict(metrics)
+                    status["updated"] = time.time()
+                    status["labels"] = self.labels
+                    with self._lock:
+                        status["running"] = sorted(self.running.keys())
+                        status["last_struct_name"] = self.last_struct_name
+                    write_atomically(self.status_path, json.dumps(status, indent=2))
+            except (OSError, ValueError, TypeError) as error:
+                logger.warning("Telemetry is not written: %s", error)
+
+
+def _mean(values):
+    """
+    Gets the mean of the values, or None if there is no value.
+    """
+    return float(sum(values)) / len(values) if values else None
@@ -0,0 +1,334 @@
+# coding: utf-8
+# Copyright (c) 2018-2019, Taku MURAKAMI. All rights reserved.
+# Distributed under the terms of the BSD 3-clause License.
+
+import logging
+import os
+import threading
+import contextlib
+import numpy
+try:
+    import fcntl
+except ModuleNotFoundError:
+    fcntl = None
+
+"""
+Memory-mapped store of trajectories of relaxation.
+"""
+
+logger = logging.getLogger(__name__)
+
+# 1 eV/angstrom^3 in kBar.
+EV_PER_ANG3_IN_KBAR = 1602.1766208
+
+# Name, dtype and shape except the first axis of the arrays stored per step
+# ("steps") and per atom of each step ("frames").
+STEP_ARRAYS = (("energies", numpy.float64, ()),
+               ("lattices", numpy.float64, (3, 3)),
+               ("stresses", numpy.float64, (3, 3)))
+FRAME_ARRAYS = (("positions", numpy.float64, (3,)),
+                ("forces", numpy.float64, (3,)))
+
+
+def trajectory_from_vasprun(vasprun):
+    """
+    Extracts the trajectory from vasprun.xml.
+    
+    Arguments
+    ---------
+    vasprun: pymatgen.io.vasp.outputs.Vasprun
+        vasprun.xml file, which includes all calculation results.
+    
+    Returns
+    -------
+    trajectory: dict
+        Arrays of the trajectory given to TrajectoryStore.append().
+        Stresses are converted from kBar in VASP to eV/angstrom^3 with the sign of ASE.
+    """
+    steps = vasprun.ionic_steps
+    energies = []
+    stresses = []
+    for step in steps:
+        energies.append(step.get("e_0_energy", step.get("e_wo_entrp")))
+        if step.get("stress") is not None:
+            stresses.append(-numpy.array(step["stress"]) / EV_PER_ANG3_IN_KBAR)
+        else:
+            stresses.append(numpy.full((3, 3), numpy.nan))
+    return {"numbers": [site.specie.Z for site in steps[0]["structure"]],
+            "energies": energies,
+            "lattices": [step["structure"].lattice.matrix for step in steps],
+            "positions": [step["structure"].cart_coords for step in steps],
+            "forces": [step["forces"] for step in steps],
+            "stresses": stresses}
+
+
+class TrajectoryStore(object):
+    """
+    Memory-mapped store of trajectories of relaxation, e.g. for training
+    interatomic potentials.
+    
+    Each array is kept in a raw binary file in the directory, and trajectories
+    are appended to the end of the files. Per-step arrays (energies, lattices
+    and stresses) and per-atom arrays (positions and forces) are indexed by
+    "index.i64", which has (step offset, number of steps, atom offset,
+    number of atoms, frame offset) of each trajectory, and "names.txt".
+    The index and the name are appended after the arrays. When the store is opened,
+    all the files are truncated to the last trajectory which has all of its arrays,
+    its index and its name, so a trajectory interrupted while writing is dropped
+    and does not shift the later ones. Trajectories are appended under a lock
+    of the threads and a lock of the file "lock" (flock), so concurrent calculations
+    and processes, e.g. the leaders of MPI groups, can append to the same store.
+    They are read as numpy views of memory-mapped files without parsing vasprun.xml again.
+    
+    Units are eV, angstrom, eV/angstrom and eV/angstrom^3 (the sign of ASE).
+    
+    Arguments
+    ---------
+    path: str
+        Directory of the store, which is created if it does not exist.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        for name in ("index.i64", "names.txt", "numbers.i32", "lock"):
+            open(os.path.join(path, name), mode="ab").close()
+        for name, dtype, shape in STEP_ARRAYS + FRAME_ARRAYS:
+            open(self._filename(name), mode="ab").close()
+        self._maps = {}
+        self._lock = threading.Lock()
+        with self._locked():
+            self._load_index()
+    
+    @contextlib.contextmanager
+    def _locked(self):
+        """
+        Locks the store against the other threads and processes.
+        """
+        with self._lock:
+            with open(os.path.join(self.path, "lock"), mode="ab") as file:
+                if fcntl is not None:
+                    fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+    
+    def _filename(self, name):
+        if name == "numbers":
+            return os.path.join(self.path, "numbers.i32")
+        return os.path.join(self.path, name + ".f64")
+    
+    def _load_index(self):
+        """
+        Loads the index of trajectories, and truncates the files to
+        the last complete trajectory.
+        """
+        index = numpy.fromfile(os.path.join(self.path, "index.i64"), dtype=numpy.int64)
+        with open(os.path.join(self.path, "names.txt"), mode="rb") as file:
+            lines = file.read().split(b"\n")[:-1]
+        index = index[:5 * (len(index) // 5)].reshape(-1, 5)
+        num = min(len(index), len(lines))
+        sizes = {name: self._size(name, numpy.dtype(dtype).itemsize * int(numpy.prod(shape)))
+                 for name, dtype, shape in STEP_ARRAYS + FRAME_ARRAYS}
+        sizes["numbers"] = self._size("numbers", 4)
+        while num > 0:
+            step, nsteps, atom, natoms, frame = index[num - 1]
+            if (all(sizes[name] >= step + nsteps for name, dtype, shape in STEP_ARRAYS)
+                    and all(sizes[name] >= frame + nsteps * natoms
+                            for name, dtype, shape in FRAME_ARRAYS)
+                    and sizes["numbers"] >= atom + natoms):
+                break
+            num -= 1
+        self._index = index[:num].copy()
+        self._names = [line.decode() for line in lines[:num]]
+        self._names_size = sum(len(line) + 1 for line in lines[:num])
+        if num > 0:
+            step, nsteps, atom, natoms, frame = (int(value) for value in self._index[-1])
+            self._ends = {"steps": step + nsteps, "atoms": atom + natoms,
+                          "frames": frame + nsteps * natoms}
+        else:
+            self._ends = {"steps": 0, "atoms": 0, "frames": 0}
+        self._truncate(num, self._names_size)
+        # The latest trajectory is used when a name is appended more than once.
+        self._rows = {name: row for row, name in enumerate(self._names)}
+        self._maps = {}
+    
+    def _truncate(self, num, names_size):
+        """
+        Truncates the files to the first num trajectories.
+        """
+        lengths = {"index.i64": 5 * num * 8,
+                   "names.txt": names_size,
+                   "numbers.i32": self._ends["atoms"] * 4}
+        for name, dtype, shape in STEP_ARRAYS:
+            lengths[name + ".f64"] = self._ends["steps"] * 8 * int(numpy.prod(shape))
+        for name, dtype, shape in FRAME_ARRAYS:
+            lengths[name + ".f64"] = self._ends["frames"] * 8 * int(numpy.prod(shape))
+        for name, length in lengths.items():
+            filename = os.path.join(self.path, name)
+            if os.path.getsize(filename) > length:
+                logger.warning("Interrupted trajectory is dropped from %s.", filename)
+                with open(filename, mode="r+b") as file:
+                    file.truncate(length)
+    
+    def __len__(self):
+        return len(self._rows)
+    
+    def __contains__(self, struct_name):
+        return struct_name in self._rows
+    
+    def names(self):
+        """
+        Gets the names of the stored trajectories.
+        
+        Returns
+        -------
+        list
+            Names of structures.
+        """
+        return list(self._rows.keys())
+    
+    def append(self, struct_name, numbers, energies, lattices, positions, forces,
+               stresses=None):
+        """
+        Appends a trajectory.
+        
+        Arguments
+        ---------
+        struct_name: str
+            Name of the structure.
+        numbers: list
+            Atomic numbers of the sites (natoms).
+        energies: list
+            Total energies of the steps (nsteps).
+        lattices: list
+            Lattice matrices of the steps (nsteps x 3 x 3).
+        positions: list
+            Cartesian coordinates of the sites of the steps (nsteps x natoms x 3).
+        forces: list
+            Forces of the sites of the steps (nsteps x natoms x 3).
+        stresses: list or None
+            Stress tensors of the steps (nsteps x 3 x 3), nan when they are None.
+        """
+        if "\n" in struct_name:
+            raise ValueError("Names must not contain newline.")
+        numbers = numpy.asarray(numbers, dtype=numpy.int32).ravel()
+        energies = numpy.asarray(energies, dtype=numpy.float64).ravel()
+        nsteps, natoms = len(energies), len(numbers)
+        if stresses is None:
+            stresses = numpy.full((nsteps, 3, 3), numpy.nan)
+        arrays = {"energies": energies,
+                  "lattices": numpy.asarray(lattices, dtype=numpy.float64),
+                  "stresses": numpy.asarray(stresses, dtype=numpy.float64),
+                  "positions": numpy.asarray(positions, dtype=numpy.float64),
+                  "forces": numpy.asarray(forces, dtype=numpy.float64)}
+        for name, dtype, shape in STEP_ARRAYS:
+            if arrays[name].shape != (nsteps,) + shape:
+                raise ValueError("Shape of " + name + " is " + str(arrays[name].shape))
+        for name, dtype, shape in FRAME_ARRAYS:
+            if arrays[name].shape != (nsteps, natoms) + shape:
+                raise ValueError("Shape of " + name + " is " + str(arrays[name].shape))
+        
+        with self._locked():
+            # Trajectories appended by the other processes are loaded.
+            if (os.path.getsize(os.path.join(self.path, "index.i64")) != self._index.nbytes
+                    or os.path.getsize(os.path.join(self.path, "names.txt"))
+                    != self._names_size):
+                self._load_index()
+            offsets = [self._ends["steps"], nsteps, self._ends["atoms"], natoms,
+                       self._ends["frames"]]
+            with open(self._filename("numbers"), mode="ab") as file:
+                file.write(numbers.tobytes())
+            for name, array in arrays.items():
+                with open(self._filename(name), mode="ab") as file:
+                    file.write(numpy.ascontiguousarray(array).tobytes())
+            with open(os.path.join(self.path, "index.i64"), mode="ab") as file:
+                file.write(numpy.array(offsets, dtype=numpy.int64).tobytes())
+            with open(os.path.join(self.path, "names.txt"), mode="ab") as file:
+                file.write(struct_name.encode() + b"\n")
+            self._index = numpy.concatenate([self._index, [offsets]]).astype(numpy.int64)
+            self._names.append(struct_name)
+            self._names_size += len(struct_name.encode()) + 1
+            self._rows[struct_name] = len(self._names) - 1
+            self._ends = {"steps": offsets[0] + nsteps, "atoms": offsets[2] + natoms,
+                          "frames": offsets[4] + nsteps * natoms}
+    
+    def _size(self, name, itemsize):
+        """
+        Gets the number of rows in the file of the array.
+        """
+        return os.path.getsize(self._filename(name)) // itemsize
+    
+    def _map(self, name, dtype, shape, stop):
+        """
+        Maps the file of the array, which is mapped again when it is appended.
+        """
+        array = self._maps.get(name)
+        if array is None or len(array) < stop:
+            filename = self._filename(name)
+            itemsize = numpy.dtype(dtype).itemsize * int(numpy.prod(shape))
+            rows = os.path.getsize(filename) // itemsize
+            if rows == 0:
+                return numpy.empty((0,) + shape, dtype=dtype)
+            array = numpy.memmap(filename, dtype=dtype, mode="r", shape=(rows,) + shape)
+            self._maps[name] = array
+        return array
+    
+    def get(self, struct_name):
+        """
+        Gets the trajectory as read-only views of the memory-mapped files.
+        
+        Arguments
+        ---------
+        struct_name: str
+            Name of the structure.
+        
+        Returns
+        -------
+        trajectory: dict
+            "numbers" (natoms), "energies" (nsteps), "lattices" (nsteps x 3 x 3),
+            "stresses" (nsteps x 3 x 3), "positions" (nsteps x natoms x 3)
+            and "forces" (nsteps x natoms x 3).
+        """
+        step, nsteps, atom, natoms, frame = self._index[self._rows[struct_name]]
+        if nsteps == 0:
+            raise KeyError(struct_name + " has no steps.")
+        trajectory = {}
+        if natoms > 0:
+            numbers = self._map("numbers", numpy.int32, (), atom + natoms)
+            trajectory["numbers"] = numbers[atom:atom+natoms]
+        else:
+            trajectory["numbers"] = numpy.empty(0, dtype=numpy.int32)
+        for name, dtype, shape in STEP_ARRAYS:
+            trajectory[name] = self._map(name, dtype, shape, step + nsteps)[step:step+nsteps]
+        for name, dtype, shape in FRAME_ARRAYS:
+            if natoms > 0:
+                frames = self._map(name, dtype, shape, frame + nsteps * natoms)
+                trajectory[name] = frames[frame:frame+nsteps*natoms].reshape(
+                    (nsteps, natoms) + shape)
+            else:
+                trajectory[name] = numpy.empty((nsteps, 0) + shape)
+        return trajectory
+    
+    def get_all(self, name):
+        """
+        Gets an array of all the stored steps, e.g. for training.
+        
+        Arguments
+        ---------
+        name: str
+            "energies", "lattices" or "stresses" (per step),
+            or "positions" or "forces" (per atom of each step, flattened).
+        
+        Returns
+        -------
+        numpy.ndarray
+            Memory-mapped array of all the steps, including overwritten trajectories.
+        """
+        for array_name, dtype, shape in STEP_ARRAYS + FRAME_ARRAYS:
+            if array_name == name:
+                self._maps.pop(name, None)
+                return self._map(name, dtype, shape, 0)
+        raise KeyError(name)
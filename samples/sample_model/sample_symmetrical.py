@@ -19,14 +19,10 @@ logger = logging.getLogger(__name__)
 
 if __name__ == "__main__":
     gen = ModelGenerator("inputs/cif/Al2O3_hR30_R-3c_167.cif", fmt="cif")
-    for i in range(10):
-        while True:
-            gen.modify_symmetrical(min=-0.05, max=0.05)
-            constrains = gen.check_constrains(alpha_min=89.9, alpha_max=90.1,
-                                              beta_min=89.9, beta_max=90.1,
-                                              gamma_min=119.9, gamma_max=120.1)
-            if constrains is True:
-                break
+    batch = gen.generate(10, symmetrical=True, cell_min=-0.05, cell_max=0.05,
+                         constraints={"alpha_min": 89.9, "alpha_max": 90.1,
+                                      "beta_min": 89.9, "beta_max": 90.1,
+                                      "gamma_min": 119.9, "gamma_max": 120.1})
+    for i, struct in enumerate(batch.get_structs()):
         with open("outputs/symmetrical/POSCAR"+str(i).zfill(2), mode="w") as file:
-            file.writelines(str(Poscar(gen.get_struct())))
-        gen.reset_struct()
+            file.writelines(str(Poscar(struct)))
@@ -0,0 +1,1005 @@
+# coding: utf-8
+# Copyright (c) 2018-2019, Taku MURAKAMI. All rights reserved.
+# Distributed under the terms of the BSD 3-clause License.
+
+from .context import model
+from pythroughput.core.sources import DirectorySource
+from pythroughput.core.sources import GlobSource
+from pythroughput.core.sources import IterableSource
+from pythroughput.core.sources import JsonLinesSource
+from pythroughput.core.sources import StructureRef
+from pythroughput.core.sources import StructureSource
+from pythroughput.core.structurecache import StructureCache
+from pythroughput.core.structurecache import CachedSource
+from pythroughput.core.costmodel import detect_symmetry
+from pythroughput.core.costmodel import count_time_reversal_kpoints
+from pythroughput.core.calculation import PyHighThroughput
+from pythroughput.core.geometry import GeometryFilter
+from pythroughput.core.geometry import min_distances
+from pythroughput.core.stageout import StageOut
+from pythroughput.core.stageout import stage_files
+from pythroughput.core.stageout import is_staged
+from pythroughput.core.archive import ArchivePolicy
+from pythroughput.core.archive import open_output
+from pythroughput.core.archive import find_archive
+from pythroughput.core.restart import RestartLadder
+from pythroughput.core.restart import is_unconverged
+from pythroughput.core.calculation_vasp import Calculation_vasp
+from pythroughput.core.tracer import JsonLinesTracer
+from pythroughput.core.tracer import ProfileTracer
+from pythroughput.core.tracer import MultiTracer
+from pythroughput.core.tracer import summarize
+from pythroughput.core.mpigroups import MpiGroups
+from pythroughput.core.mpigroups import split_ranks
+from pythroughput.core.paralleltuning import ParallelTuner
+from pythroughput.core.paralleltuning import read_nelect
+from pythroughput.core.paralleltuning import estimate_nbands
+from pythroughput.core.throughput import JobPool
+from pythroughput.core.throughput import ThroughputPlan
+from pythroughput.core.throughput import autotune
+from pythroughput.core.throughput import get_configurations
+from pythroughput.core.throughput import get_size_class
+from pythroughput.core.throughput import sample_structs
+from pythroughput.core.prioritizer import BayesianRidge
+from pythroughput.core.prioritizer import SurrogatePrioritizer
+from pythroughput.outputs.trajectorystore import TrajectoryStore
+import pymatgen
+import unittest
+import logging
+import pickle
+import pstats
+import json
+import tempfile
+import shutil
+import os
+import gzip
+import numpy
+import threading
+import time
+import sys
+import re
+import importlib.util
+import multiprocessing
+
+"""
+Test for core package.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class StructureSourceTestSuite(unittest.TestCase):
+    """
+    Test for sources.py
+    """
+    
+    def test_directory_source(self):
+        """
+        Test for listing names without parsing and parsing lazily.
+        """
+        source = DirectorySource("tests/samples", fmt="poscar")
+        assert source.names() == ["POSCAR_sym", "POSCAR_unsym"]
+        struct_name, ref = next(source.refs())
+        struct = pickle.loads(pickle.dumps(ref)).load()
+        assert struct.num_sites == 30
+        assert source["POSCAR_unsym"].formula == struct.formula
+    
+    def test_glob_and_iterable_source(self):
+        """
+        Test for glob pattern and generator.
+        """
+        source = GlobSource("tests/inputs/**/*.cif")
+        assert source.names() == ["Al2O3_hR30_R-3c_167.cif"]
+        struct = source["Al2O3_hR30_R-3c_167.cif"]
+        source = IterableSource(("model"+str(i), struct.as_dict()) for i in range(3))
+        assert [name for name, struct in source.items()] == ["model0", "model1", "model2"]
+    
+    def test_json_lines_source(self):
+        """
+        Test for indexing names of JSON-lines without decoding the structures.
+        """
+        struct = pymatgen.Structure(pymatgen.Lattice.cubic(4.05), ["Al"], [[0, 0, 0]])
+        path = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(path, "structs.jsonl")
+            with open(filename, mode="w") as file:
+                file.write(json.dumps({"name": "Al", "structure": struct.as_dict()}) + "\n")
+                # The structure is not decoded when "name" is the first key.
+                file.write('{"name": "broken \\"Al\\"", "structure": {broken\n')
+                file.write("\n")
+                file.write(json.dumps({"structure": struct.as_dict(), "name": "last"}) + "\n")
+            source = JsonLinesSource(filename)
+            assert source.names() == ["Al", 'broken "Al"', "last"]
+            assert source["last"].formula == source["Al"].formula == struct.formula
+        finally:
+            shutil.rmtree(path)
+    
+
+class StructureCacheTestSuite(unittest.TestCase):
+    """
+    Test for structurecache.py
+    """
+    
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.path)
+    
+    def test_cached_source(self):
+        """
+        Test for parsing into the cache and reloading from the cache.
+        """
+        paths = [os.path.join("tests/samples", name) for name in ("POSCAR_sym", "POSCAR_unsym")]
+        source = CachedSource(paths, self.path, fmt="poscar")
+        assert len(source.cache) == 2
+        cache = StructureCache(self.path)
+        assert cache.update(paths, fmt="poscar") == 0
+        struct = pickle.loads(pickle.dumps(cache.ref(paths[1], fmt="poscar"))).load()
+        assert struct == DirectorySource("tests/samples", fmt="poscar")["POSCAR_unsym"]
+        names, lattices, frac_coords = CachedSource(paths, cache, fmt="poscar").stack()
+        assert lattices.shape == (2, 3, 3) and frac_coords.shape == (2, 30, 3)
+        
+        copied = os.path.join(self.path, "POSCAR")
+        shutil.copy(paths[0], copied)
+        cache.update([copied], fmt="poscar")
+        os.utime(copied, ns=(0, 0))
+        assert cache.lookup(copied) is None
+        assert cache.update([copied], fmt="poscar") == 1 and len(cache) == 3
+        
+        # Bytes after the rows in the index, e.g. of an interrupted update, are not read.
+        for name in ("lattices.0.f64", "offsets.0.i64", "frac_coords.0.f64", "species.0.i32"):
+            with open(os.path.join(self.path, name), mode="ab") as file:
+                file.write(b"\x01" * 40)
+        cache = StructureCache(self.path)
+        assert len(cache) == 3
+        assert cache.ref(copied, fmt="poscar").load() == cache.ref(paths[0], fmt="poscar").load()
+        
+        # Rows of modified files are compacted into a new version.
+        for i in range(3):
+            os.utime(copied, ns=(i + 1, i + 1))
+            assert cache.update([copied], fmt="poscar") == 1
+        assert os.path.exists(os.path.join(self.path, "lattices.1.f64"))
+        assert not os.path.exists(os.path.join(self.path, "lattices.0.f64"))
+        cache = StructureCache(self.path)
+        assert len(cache) == 3 and cache.update(paths + [copied], fmt="poscar") == 0
+        struct = cache.ref(paths[1], fmt="poscar").load()
+        assert struct == DirectorySource("tests/samples", fmt="poscar")["POSCAR_unsym"]
+
+    
+
+class SymmetryTestSuite(unittest.TestCase):
+    """
+    Test for costmodel.py and symmetry mode of PyHighThroughput.
+    """
+    
+    def test_symmetry_mode(self):
+        """
+        Test for symmetry detection and irreducible k-points.
+        """
+        struct = pymatgen.Structure(pymatgen.Lattice.cubic(4.05), ["Al"] * 4,
+                                    [[0, 0, 0], [0.5, 0.5, 0], [0.5, 0, 0.5], [0, 0.5, 0.5]])
+        symmetry = detect_symmetry(struct, {"size": (4, 4, 4)})
+        assert symmetry["spacegroup"] == 225
+        assert symmetry["num_kpoints"] < symmetry["num_kpoints_full"] == 64
+        
+        distorted = struct.copy()
+        distorted.translate_sites([0], [0.01, 0.02, 0.03])
+        calculation = PyHighThroughput(symmetry=True, struct=struct, distorted=distorted)
+        assert calculation._set_default_calculator("struct", struct, "vasp")["isym"] == 2
+        assert calculation._set_default_calculator("distorted", distorted, "vasp")["isym"] == 0
+        assert calculation.costs["struct"] < calculation.costs["distorted"]
+        assert "isym" not in calculation._set_default_calculator("struct", struct, "gpaw")
+        assert "isym" not in calculation.calculator
+    
+    def test_primitive_reduction(self):
+        """
+        Test for reduction to primitive cell and scaling energies back.
+        """
+        struct = pymatgen.Structure(pymatgen.Lattice.cubic(4.05), ["Al"] * 4,
+                                    [[0, 0, 0], [0.5, 0.5, 0], [0.5, 0, 0.5], [0, 0.5, 0.5]])
+        calculation = PyHighThroughput(primitive=True, struct=struct)
+        primitive, ratio = calculation._reduce_struct(struct)
+        assert primitive.num_sites == 1 and ratio == 4
+        assert calculation._reduce_struct(primitive) == (primitive, 1)
+        results = {"total_energy": -3.5, "initial_energy": "Unconverged", "formula": "Al1"}
+        results = calculation._scale_results(results, struct, ratio)
+        assert results == {"total_energy": -14.0, "initial_energy": "Unconverged",
+                           "formula": "Al4", "primitive_ratio": 4}
+    
+    def test_time_reversal_kpoints(self):
+        """
+        Test for k-points reduced only by time reversal against spglib.
+        """
+        import spglib
+        identity = numpy.array([numpy.eye(3, dtype="intc")])
+        for size in [(1, 1, 1), (2, 3, 4), (4, 4, 4), (5, 5, 3), (6, 1, 2)]:
+            for gamma in [True, False]:
+                shift = [0 if gamma else 1 - n % 2 for n in size]
+                mapping, grid = spglib.get_stabilized_reciprocal_mesh(
+                    size, identity, is_shift=shift, is_time_reversal=True)
+                kpts = {"size": size, "gamma": gamma}
+                assert count_time_reversal_kpoints(kpts) == len(numpy.unique(mapping))
+
+    
+
+class GeometryFilterTestSuite(unittest.TestCase):
+    """
+    Test for geometry.py
+    """
+    
+    def test_min_distances(self):
+        """
+        Test for minimum interatomic distances including periodic images.
+        """
+        lattices = numpy.array([numpy.diag([4.0, 4.0, 4.0]), numpy.diag([4.0, 4.0, 0.3])])
+        frac_coords = numpy.array([[[0.0, 0.0, 0.0], [0.9, 0.0, 0.0]],
+                                   [[0.0, 0.0, 0.0], [0.5, 0.5, 0.5]]])
+        distances = min_distances(lattices, frac_coords, 1.0)
+        assert numpy.allclose(distances, [0.4, 0.3])
+        assert numpy.all(numpy.isinf(min_distances(lattices, frac_coords, 0.2)))
+    
+    def test_geometry_filter(self):
+        """
+        Test for rejecting structures before dispatch.
+        """
+        struct = pymatgen.Structure(pymatgen.Lattice.cubic(4.05), ["Al"] * 4,
+                                    [[0, 0, 0], [0.5, 0.5, 0], [0.5, 0, 0.5], [0, 0.5, 0.5]])
+        overlapped = struct.copy()
+        overlapped.translate_sites([1], [-0.49, -0.49, 0.0])
+        flat = pymatgen.Structure([[4.0, 0, 0], [0, 4.0, 0], [3.9, 3.9, 0.05]], ["Al"], [[0, 0, 0]])
+        geometry_filter = GeometryFilter()
+        assert geometry_filter.check(struct) is None
+        assert geometry_filter.check(overlapped).startswith("Interatomic distance")
+        assert geometry_filter.check(flat).startswith("Condition number")
+        
+        calculation = PyHighThroughput(geometry_filter=geometry_filter,
+                                       overlapped=overlapped, flat=flat)
+        results = calculation.run(package="vasp")
+        assert results["overlapped"]["results"] == "Invalid geometry"
+        assert results["flat"]["reason"] == geometry_filter.check(flat)
+
+
+
+class StageOutTestSuite(unittest.TestCase):
+    """
+    Test for stageout.py
+    """
+    
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.path)
+    
+    def _make_work_path(self, name):
+        work_path = os.path.join(self.path, "scratch", name)
+        os.makedirs(work_path)
+        for file_name in ("INCAR", "vasprun.xml"):
+            with open(os.path.join(work_path, file_name), mode="w") as file:
+                file.write(file_name + " of " + name)
+        return work_path
+    
+    def test_stage_files(self):
+        """
+        Test for staging files with the completion marker.
+        """
+        work_path = self._make_work_path("Al")
+        output_path = os.path.join(self.path, "output", "Al")
+        staged = stage_files(work_path, output_path, ["INCAR", "vasprun.xml", "CONTCAR"])
+        assert staged == ["INCAR", "vasprun.xml"]
+        assert is_staged(output_path)
+        assert not os.path.exists(os.path.join(work_path, "INCAR"))
+        with open(os.path.join(output_path, "INCAR")) as file:
+            assert file.read() == "INCAR of Al"
+    
+    def test_asynchronous_stage_out(self):
+        """
+        Test for asynchronous stage-out with compression and removal of work directories.
+        """
+        with StageOut(archive=ArchivePolicy(compress=["vasprun.xml"])) as stage_out:
+            for name in ("Al", "Cu"):
+                stage_out.submit(self._make_work_path(name),
+                                 os.path.join(self.path, "output", name),
+                                 ["INCAR", "vasprun.xml"])
+            assert stage_out.wait() == 2
+        for name in ("Al", "Cu"):
+            output_path = os.path.join(self.path, "output", name)
+            with gzip.open(os.path.join(output_path, "vasprun.xml.gz"), mode="rt") as file:
+                assert file.read() == "vasprun.xml of " + name
+            assert is_staged(output_path)
+        assert os.listdir(os.path.join(self.path, "scratch")) == []
+        
+        calculation = PyHighThroughput(scratch_path=os.path.join(self.path, "scratch"))
+        work_path = calculation._make_work_path("Al")
+        assert os.path.dirname(work_path) == os.path.join(self.path, "scratch")
+        assert isinstance(calculation.stage_out, StageOut)
+    
+    def test_archive_policy(self):
+        """
+        Test for packing output directories and reading them transparently.
+        """
+        work_path = self._make_work_path("Al")
+        output_path = os.path.join(self.path, "output", "Al")
+        stage_files(work_path, output_path, ["INCAR", "vasprun.xml"],
+                    archive=ArchivePolicy(pack=True))
+        assert not os.path.exists(output_path)
+        assert find_archive(output_path) == output_path + ".tar.gz"
+        assert is_staged(output_path)
+        with open_output(output_path, "vasprun.xml", mode="rt") as file:
+            assert file.read() == "vasprun.xml of Al"
+        with self.assertRaises(FileNotFoundError):
+            with open_output(output_path, "OUTCAR") as file:
+                pass
+        # Reading the packed output, which makes Calculation_vasp, does not make its directory.
+        struct = pymatgen.Structure(pymatgen.Lattice.cubic(4.05), ["Al"], [[0, 0, 0]])
+        struct_calculator = PyHighThroughput()._set_default_calculator("Al", struct, "vasp")
+        struct_calculator["txt"] = output_path + ".txt"
+        Calculation_vasp("Al", struct, struct_calculator, None,
+                         work_path=self._make_work_path("Al2"))
+        assert not os.path.exists(output_path)
+        
+        output_path = os.path.join(self.path, "output", "Cu")
+        stage_files(self._make_work_path("Cu"), output_path, ["INCAR", "vasprun.xml"],
+                    archive=ArchivePolicy(min_size=16))
+        assert sorted(os.listdir(output_path)) == [".done", "INCAR", "vasprun.xml.gz"]
+        with open_output(output_path, "vasprun.xml") as file:
+            assert file.read() == b"vasprun.xml of Cu"
+
+
+class RestartTestSuite(unittest.TestCase):
+    """
+    Test for restart.py
+    """
+    
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.path)
+    
+    def test_restart_ladder(self):
+        """
+        Test for bounded attempts of restart.
+        """
+        restart = RestartLadder(max_attempts=2)
+        assert restart.get_num_attempts("vasp") == 2
+        assert restart.get_changes("vasp", 1)["algo"] == "Normal"
+        with self.assertRaises(IndexError):
+            restart.get_changes("vasp", 3)
+        assert is_unconverged({"total_energy": "Unconverged"})
+        assert not is_unconverged({"total_energy": -1.0, "final_forces": numpy.zeros(3)})
+    
+    def test_prepare_restart(self):
+        """
+        Test for restart of VASP calculation from its last state.
+        """
+        struct = pymatgen.Structure(pymatgen.Lattice.cubic(4.05), ["Al"], [[0, 0, 0]])
+        calculation = PyHighThroughput()
+        struct_calculator = calculation._set_default_calculator("Al", struct, "vasp")
+        calculation = Calculation_vasp("Al", struct, struct_calculator, None,
+                                       work_path=self.path)
+        for name in ("CONTCAR", "CHGCAR"):
+            with open(os.path.join(self.path, name), mode="w") as file:
+                file.write(name)
+        calculation._prepare_restart(RestartLadder().get_changes("vasp", 3), steps=10)
+        with open(os.path.join(self.path, "POSCAR")) as file:
+            assert file.read() == "CONTCAR"
+        with open(os.path.join(self.path, "INCAR")) as file:
+            incar = file.read()
+        for tag in ("ALGO = All", "AMIX = 0.1", "ICHARG = 1", "NELM = 800", "NSW=10"):
+            assert tag in incar
+        assert "ISTART = 1" not in incar
+        assert "LWAVE = False" in incar
+        
+        # WAVECAR is written for the next restart, and read by it.
+        with open(os.path.join(self.path, "WAVECAR"), mode="w") as file:
+            file.write("WAVECAR")
+        calculation._prepare_restart(RestartLadder().get_changes("vasp", 1), steps=1, lwave=True)
+        with open(os.path.join(self.path, "INCAR")) as file:
+            incar = file.read()
+        assert "ISTART = 1" in incar and "LWAVE = True" in incar and "NSW" not in incar
+        
+        # Files older than the calculation are not read.
+        os.utime(os.path.join(self.path, "WAVECAR"), (0, 0))
+        calculation._started = time.time()
+        assert not calculation._has_work_file("WAVECAR")
+    
+    def test_restart_nelm(self):
+        """
+        Test for more electronic steps (NELM) in each restart than in the previous run.
+        """
+        struct = pymatgen.Structure(pymatgen.Lattice.cubic(4.05), ["Al"], [[0, 0, 0]])
+        struct_calculator = PyHighThroughput()._set_default_calculator("Al", struct, "vasp")
+        for ladder in (RestartLadder(), RestartLadder(vasp=[{"maxiter": 100}, {"algo": "All"}])):
+            calculation = Calculation_vasp("Al", struct, struct_calculator, None,
+                                           work_path=self.path)
+            nelms = [struct_calculator["maxiter"]]
+            for attempt in range(1, ladder.get_num_attempts("vasp") + 1):
+                calculation._prepare_restart(ladder.get_changes("vasp", attempt), steps=1)
+                with open(os.path.join(self.path, "INCAR")) as file:
+                    nelms.append(int(re.search(r"NELM = (\d+)", file.read()).group(1)))
+            assert all(nelm < next_nelm for nelm, next_nelm in zip(nelms, nelms[1:]))
+
+
+class TracerTestSuite(unittest.TestCase):
+    """
+    Test for tracer.py
+    """
+    
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.path)
+    
+    def test_spans(self):
+        """
+        Test for spans of the phases written to JSON-lines and cProfile.
+        """
+        path = os.path.join(self.path, "spans.jsonl")
+        tracer = MultiTracer(JsonLinesTracer(path),
+                             ProfileTracer(os.path.join(self.path, "controller"),
+                                           phases=["run"]))
+        struct = pymatgen.Structure(pymatgen.Lattice.cubic(4.05), ["Al"], [[0, 0, 0]])
+        calculation = PyHighThroughput(geometry_filter=GeometryFilter(), tracer=tracer,
+                                       Al=struct)
+        calculation.run(package="none")
+        struct_calculator = calculation._set_default_calculator("Al", struct, "vasp")
+        Calculation_vasp("Al", struct, struct_calculator, None, work_path=self.path,
+                         tracer=tracer)
+        tracer.close()
+        
+        summary = summarize(path)
+        for name in ("run", "check_geometry", "calc", "write_inputs", "write_potcar"):
+            assert summary[name]["count"] == 1
+        assert summary["run"]["total"] >= summary["calc"]["total"]
+        with open(path) as file:
+            spans = [json.loads(line) for line in file]
+        assert spans[-1]["name"] == "write_inputs"
+        assert spans[-1]["tags"] == {"struct_name": "Al", "num_sites": 1,
+                                     "kpoints": [4, 4, 4]}
+        assert spans[-2]["error"] == "TypeError"
+        assert pstats.Stats(os.path.join(self.path, "controller.prof")).total_calls > 0
+    
+    def test_profile_threads(self):
+        """
+        Test for the profiler, which ignores the spans of the other threads
+        and is not used with concurrent calculations.
+        """
+        tracer = ProfileTracer(os.path.join(self.path, "controller"))
+        depths = []
+        
+        def run():
+            with tracer.span("calc"):
+                depths.append(tracer._depth)
+        
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+        assert depths == [0]
+        with tracer.span("run"):
+            assert tracer._depth == 1
+        tracer.close()
+        assert os.path.exists(os.path.join(self.path, "controller.prof"))
+        
+        struct = pymatgen.Structure(pymatgen.Lattice.cubic(4.05), ["Al"], [[0, 0, 0]])
+        tracer = MultiTracer(ProfileTracer(os.path.join(self.path, "calculation")))
+        calculation = PyHighThroughput(scratch_path=self.path, tracer=tracer, Al=struct)
+        with self.assertRaises(ValueError):
+            calculation.run(package="vasp", n_jobs=1, concurrency=2)
+
+
+class ThreadWorld(object):
+    """
+    World communicator of ranks running in threads, used for testing MpiGroups.
+    """
+    
+    def __init__(self, rank, size, shared):
+        self.rank = rank
+        self.size = size
+        self.shared = shared
+    
+    def new_communicator(self, ranks):
+        return list(ranks) if self.rank in ranks else None
+    
+    @staticmethod
+    def broadcast(obj, root, comm):
+        if comm.rank == root:
+            comm.shared["object"] = obj
+        comm.shared["barrier"].wait()
+        obj = comm.shared["object"]
+        comm.shared["barrier"].wait()
+        return obj
+
+
+class ProcessWorld(object):
+    """
+    World communicator of ranks running in processes, which sends objects
+    through a queue of each pair of ranks, used for testing MpiGroups.
+    """
+    
+    def __init__(self, rank, size, queues):
+        self.rank = rank
+        self.size = size
+        self.queues = queues
+    
+    def new_communicator(self, ranks):
+        ranks = [int(rank) for rank in ranks]
+        if self.rank not in ranks:
+            return None
+        return {"ranks": ranks, "rank": ranks.index(self.rank)}
+    
+    @staticmethod
+    def broadcast(obj, root, comm):
+        if comm.rank == root:
+            for rank in range(comm.size):
+                if rank != root:
+                    comm.queues[root, rank].put(obj)
+            return obj
+        return comm.queues[root, comm.rank].get()
+
+
+def make_process_structs(num_structs):
+    """
+    Makes structures of 1 to 3 sites run by the processes.
+    """
+    return {"Al{}".format(i): pymatgen.Structure(pymatgen.Lattice.cubic(4.05),
+                                                 ["Al"] * (i % 3 + 1),
+                                                 [[0.3 * j, 0, 0] for j in range(i % 3 + 1)])
+            for i in range(num_structs)}
+
+
+def run_process_rank(rank, size, queues, outputs, num_structs, trajectory_path):
+    """
+    Runs the structures of the group of the rank with the fake GPAW of the benchmarks,
+    and puts the communicators given to GPAW and the gathered results into outputs.
+    """
+    os.environ["FAKE_VASP_SCALE"] = "0"
+    from pythroughput.core import calculation
+    communicators = []
+    GPAW = calculation.GPAW
+    
+    class RecordingGPAW(GPAW):
+        def __init__(self, **kwargs):
+            communicators.append(kwargs.get("communicator"))
+            GPAW.__init__(self, **kwargs)
+    
+    calculation.GPAW = RecordingGPAW
+    structs = make_process_structs(num_structs)
+    groups = MpiGroups(group_size=2, world=ProcessWorld(rank, size, queues),
+                       broadcast=ProcessWorld.broadcast)
+    output_path = tempfile.mkdtemp()
+    try:
+        pht = calculation.PyHighThroughput(output_path=output_path, mpi_groups=groups,
+                                           trajectory_store=trajectory_path, **structs)
+        results = pht.run(package="gpaw").to_dict()
+    finally:
+        shutil.rmtree(output_path)
+    outputs.put((rank, communicators, results))
+
+
+class MpiGroupsTestSuite(unittest.TestCase):
+    """
+    Test for mpigroups.py
+    """
+    
+    def test_split_ranks(self):
+        """
+        Test for splitting ranks into groups.
+        """
+        assert split_ranks(8, 4) == [[0, 1, 2, 3], [4, 5, 6, 7]]
+        assert split_ranks(5, 2) == [[0, 1, 2], [3, 4]]
+        assert split_ranks(2, 4) == [[0, 1]]
+        with self.assertRaises(ValueError):
+            split_ranks(4, 0)
+    
+    def test_groups_run(self):
+        """
+        Test for running structures in groups of ranks and gathering their results.
+        """
+        size = 6
+        shared = {"barrier": threading.Barrier(size)}
+        structs = {"Al{}".format(i): pymatgen.Structure(pymatgen.Lattice.cubic(4.05), ["Al"],
+                                                        [[0, 0, 0]])
+                   for i in range(5)}
+        structs["Al2"] = pymatgen.Structure(pymatgen.Lattice.cubic(4.05), ["Al", "Al"],
+                                            [[0, 0, 0], [0.01, 0, 0]])
+        calculated = {}
+        results = {}
+        
+        def run(rank):
+            groups = MpiGroups(group_size=2, world=ThreadWorld(rank, size, shared),
+                               broadcast=ThreadWorld.broadcast)
+            calculation = PyHighThroughput(geometry_filter=GeometryFilter(), mpi_groups=groups,
+                                           **structs)
+            calculated[rank] = [struct_name for struct_name, struct
+                                in calculation._iter_structs()]
+            results[rank] = calculation.run(package="none").to_dict()
+        
+        threads = [threading.Thread(target=run, args=(rank,)) for rank in range(size)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert calculated[0] == calculated[1] == ["Al0", "Al3"]
+        assert calculated[4] == ["Al2"]
+        assert sorted(results[0].keys()) == sorted(structs.keys())
+        assert results[0]["Al2"]["results"] == "Invalid geometry"
+        assert results[5] == results[0]
+    
+    def run_processes(self, size, num_structs, trajectory_path=None):
+        """
+        Runs the fake GPAW in groups of 2 ranks in processes.
+        
+        Returns
+        -------
+        outputs: dict
+            Pairs of the communicators given to GPAW and the gathered results keyed by rank.
+        """
+        context = multiprocessing.get_context("spawn")
+        queues = {(root, rank): context.Queue() for root in range(size) for rank in range(size)}
+        outputs = context.Queue()
+        fake_gpaw = os.path.abspath(os.path.join(os.path.dirname(__file__), "..",
+                                                 "benchmarks", "fake_gpaw"))
+        # The spawned processes import the fake GPAW from the path of this process.
+        sys.path.insert(0, fake_gpaw)
+        try:
+            processes = [context.Process(target=run_process_rank,
+                                         args=(rank, size, queues, outputs, num_structs,
+                                               trajectory_path))
+                         for rank in range(size)]
+            for process in processes:
+                process.start()
+        finally:
+            sys.path.remove(fake_gpaw)
+        outputs = dict((rank, (communicators, results)) for rank, communicators, results
+                       in (outputs.get(timeout=60) for process in processes))
+        for process in processes:
+            process.join()
+        assert all(process.exitcode == 0 for process in processes)
+        return outputs
+    
+    @unittest.skipIf(importlib.util.find_spec("ase") is None, "ASE is not installed.")
+    def test_groups_run_processes(self):
+        """
+        Test for running the fake GPAW in groups of ranks in processes, each of which
+        is given the sub-communicator of its group, and gathering their results.
+        """
+        outputs = self.run_processes(4, 5)
+        for rank, (communicators, results) in outputs.items():
+            group = [0, 1] if rank < 2 else [2, 3]
+            assert len(communicators) == (3 if rank < 2 else 2)
+            assert all(comm["ranks"] == group for comm in communicators)
+            assert all(comm["rank"] == group.index(rank) for comm in communicators)
+        assert sorted(outputs[0][1].keys()) == ["Al{}".format(i) for i in range(5)]
+        assert all("total_energy" in results for results in outputs[0][1].values())
+    
+    @unittest.skipIf(importlib.util.find_spec("ase") is None, "ASE is not installed.")
+    def test_groups_trajectory_processes(self):
+        """
+        Test for appending trajectories to a store from the leaders of the groups
+        in processes, which do not overlap.
+        """
+        path = tempfile.mkdtemp()
+        try:
+            self.run_processes(4, 40, os.path.join(path, "trajectories"))
+            store = TrajectoryStore(os.path.join(path, "trajectories"))
+            structs = make_process_structs(40)
+            assert sorted(store.names()) == sorted(structs)
+            for struct_name, struct in structs.items():
+                trajectory = store.get(struct_name)
+                assert trajectory["numbers"].tolist() == [13] * struct.num_sites
+                assert numpy.allclose(trajectory["positions"][-1], struct.cart_coords)
+                assert numpy.allclose(trajectory["lattices"][-1], struct.lattice.matrix)
+        finally:
+            shutil.rmtree(path)
+
+
+class ParallelTunerTestSuite(unittest.TestCase):
+    """
+    Test for paralleltuning.py
+    """
+    
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.path)
+    
+    def test_bands(self):
+        """
+        Test for estimating bands from ZVAL in POTCAR.
+        """
+        struct = pymatgen.Structure(pymatgen.Lattice.cubic(4.0), ["Al", "O", "O"],
+                                    [[0, 0, 0], [0.5, 0, 0], [0, 0.5, 0]])
+        filename = os.path.join(self.path, "POTCAR")
+        with open(filename, mode="w") as file:
+            for symbol in struct.symbol_set:
+                zval = {"Al": 3.0, "O": 6.0}[symbol]
+                file.write("  PAW_PBE {}\n   POMASS =  1.0; ZVAL   =    {:.3f}\n".format(
+                    symbol, zval))
+        assert read_nelect(filename, struct) == 15.0
+        assert estimate_nbands(15.0, 3) == 9
+        assert read_nelect(os.path.join(self.path, "none"), struct) is None
+    
+    def test_choice(self):
+        """
+        Test for choosing KPAR and NCORE, which is refined by measured timings.
+        """
+        filename = os.path.join(self.path, "tuning.jsonl")
+        tuner = ParallelTuner(filename, explore=2)
+        candidates = tuner.get_candidates(16, 8, 32)
+        assert all(16 % (kpar * ncore) == 0 and kpar <= 8 for kpar, ncore in candidates)
+        assert tuner.get_candidates(16, 1, 32)[0][0] == 1
+        
+        settings = tuner.choose(16, 8, 32)
+        assert (settings["kpar"], settings["ncore"]) == candidates[0]
+        tuner.record(16, 8, 32, settings, 10.0, 10)
+        settings = tuner.choose(16, 8, 32)
+        assert (settings["kpar"], settings["ncore"]) == candidates[1]
+        tuner.record(16, 8, 32, settings, 5.0, 10)
+        
+        tuner = ParallelTuner(filename, explore=2)
+        assert tuner.get_timings(16, 8, 30) == {candidates[0]: 1.0, candidates[1]: 0.5}
+        settings = tuner.choose(16, 8, 32)
+        assert (settings["kpar"], settings["ncore"]) == candidates[1]
+    
+    def test_concurrent_record(self):
+        """
+        Test for recording timings from concurrent calculations in threads.
+        """
+        filename = os.path.join(self.path, "tuning.jsonl")
+        tuner = ParallelTuner(filename, explore=2)
+        
+        def run():
+            for i in range(200):
+                settings = tuner.choose(16, 8, 32)
+                tuner.record(16, 8, 32, settings, 1.0, 10)
+        
+        threads = [threading.Thread(target=run) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        tuner = ParallelTuner(filename)
+        assert sum(len(seconds) for seconds in tuner._timings[(16, 8, 32)].values()) == 800
+    
+    def test_incar(self):
+        """
+        Test for writing KPAR and NCORE to INCAR.
+        """
+        struct = pymatgen.Structure(pymatgen.Lattice.cubic(4.05), ["Al"], [[0, 0, 0]])
+        struct_calculator = PyHighThroughput()._set_default_calculator("Al", struct, "vasp")
+        calculation = Calculation_vasp("Al", struct, struct_calculator, None,
+                                       work_path=self.path, tuner=ParallelTuner())
+        calculation._tune_parallel(8)
+        # A 4x4x4 gamma-centered mesh reduced by time reversal (ISYM = 0).
+        assert calculation.parallel["num_kpoints"] == 36
+        with open(os.path.join(self.path, "INCAR")) as file:
+            incar = file.read()
+        assert "KPAR = {}".format(calculation.parallel["kpar"]) in incar
+        assert "NCORE = {}".format(calculation.parallel["ncore"]) in incar
+
+
+class ThroughputTestSuite(unittest.TestCase):
+    """
+    Test for throughput.py
+    """
+    
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.path)
+    
+    def test_job_pool(self):
+        """
+        Test for concurrent jobs sharing cores.
+        """
+        lock = threading.Lock()
+        usage = {"ranks": 0, "max": 0}
+        
+        def job(ranks):
+            with lock:
+                usage["ranks"] += ranks
+                usage["max"] = max(usage["max"], usage["ranks"])
+            time.sleep(0.02)
+            with lock:
+                usage["ranks"] -= ranks
+            return ranks
+        
+        finished = []
+        with JobPool(4) as pool:
+            for i, ranks in enumerate([2, 1, 1, 4, 2, 2, 3]):
+                pool.submit(i, ranks, job, ranks)
+                finished += pool.finished()
+            finished += pool.finished(block=True)
+        assert sorted(finished) == list(enumerate([2, 1, 1, 4, 2, 2, 3]))
+        assert usage["max"] <= 4
+        
+        pool = JobPool(4, max_workers=1)
+        pool.submit("a", 4, job, 4)
+        assert pool.finished() == [("a", 4)]
+    
+    def test_plan(self):
+        """
+        Test for the plan of ranks per job and concurrent jobs.
+        """
+        assert get_size_class(1) == 1
+        assert get_size_class(5) == get_size_class(8) == 8
+        assert get_configurations(8) == [(1, 8), (2, 4), (4, 2), (8, 1)]
+        
+        filename = os.path.join(self.path, "plan.json")
+        plan = ThroughputPlan(filename)
+        assert plan.get(10) is None
+        plan.cores = 8
+        plan.set(8, [{"n_jobs": 2, "concurrency": 4, "structs_per_hour": 10.0},
+                     {"n_jobs": 4, "concurrency": 2, "structs_per_hour": 20.0}])
+        plan.set(64, [{"n_jobs": 8, "concurrency": 1, "structs_per_hour": 1.0}])
+        plan.save()
+        plan = ThroughputPlan(filename)
+        assert plan.cores == 8
+        assert plan.get(6) == {"n_jobs": 4, "concurrency": 2}
+        assert plan.get(100)["n_jobs"] == 8
+        assert plan.get(1)["n_jobs"] == 4
+    
+    def test_sample_structs(self):
+        """
+        Test for sampling structures, which parses only the sampled ones.
+        """
+        structs = {"Al{}".format(i): pymatgen.Structure(pymatgen.Lattice.cubic(4.05),
+                                                        ["Al"] * (i % 3 + 1),
+                                                        [[0.2 * j, 0, 0] for j in range(i % 3 + 1)])
+                   for i in range(30)}
+        loaded = []
+        
+        def load(struct_name):
+            loaded.append(struct_name)
+            return structs[struct_name]
+        
+        class Source(StructureSource):
+            def names(self):
+                return list(structs.keys())
+            
+            def ref(self, struct_name):
+                return StructureRef(load, struct_name)
+        
+        samples = sample_structs(Source(), num_per_class=2, num_samples=10)
+        assert len(loaded) == 10
+        assert sorted(samples.keys()) == [1, 2, 4]
+        for size_class, pairs in samples.items():
+            assert len(pairs) <= 2
+            for struct_name, struct in pairs:
+                assert struct_name in loaded
+                assert get_size_class(struct.num_sites) == size_class
+        samples = sample_structs(IterableSource(structs.items()), num_samples=3)
+        assert [pairs[0][0] for pairs in samples.values()] == ["Al0", "Al1", "Al2"]
+    
+    def test_autotune(self):
+        """
+        Test for the calibration sweep and the run with its plan.
+        """
+        structs = {"Al{}".format(i): pymatgen.Structure(pymatgen.Lattice.cubic(4.05),
+                                                        ["Al"] * (i + 1),
+                                                        [[0.2 * j, 0, 0] for j in range(i + 1)])
+                   for i in range(4)}
+        calculation = PyHighThroughput(**structs)
+        filename = os.path.join(self.path, "plan.json")
+        plan = autotune(calculation, 2, configurations=[(1, 1), (2, 1)], package="none",
+                        plan=filename)
+        assert sorted(plan.classes.keys()) == [1, 2, 4]
+        assert len(plan.classes[4]["measurements"]) == 2
+        assert os.path.exists(filename)
+        with self.assertRaises(ValueError):
+            autotune(calculation, 2, configurations=[(1, 2)], package="gpaw")
+        
+        calculation = PyHighThroughput(throughput_plan=filename, **structs)
+        assert calculation._get_ranks(structs["Al3"], None) == plan.get(4)["n_jobs"]
+        assert calculation._get_ranks(structs["Al3"], 8) == 8
+        with self.assertRaises(ValueError):
+            calculation.run(package="vasp", n_jobs=1, concurrency=2)
+
+
+class PrioritizerTestSuite(unittest.TestCase):
+    """
+    Test for prioritizer.py
+    """
+    
+    def setUp(self):
+        rng = numpy.random.RandomState(0)
+        self.structs = {}
+        self.energies = {}
+        for i in range(60):
+            a = rng.uniform(3.6, 4.4)
+            species = ["Al" if rng.rand() < 0.5 else "Cu" for j in range(4)]
+            x = species.count("Cu") / 4.0
+            self.structs["s{}".format(i)] = pymatgen.Structure(
+                pymatgen.Lattice.cubic(a), species,
+                [[0, 0, 0], [0.5, 0.5, 0], [0.5, 0, 0.5], [0, 0.5, 0.5]])
+            self.energies["s{}".format(i)] = 4 * (-3.7 - 0.3 * x + 2.0 * (a - 3.9 - 0.2 * x)**2
+                                                  + 0.01 * rng.randn())
+    
+    def test_bayesian_ridge(self):
+        """
+        Test for the surrogate model.
+        """
+        features = numpy.linspace(0.0, 1.0, 40)[:, numpy.newaxis]
+        values = numpy.sin(2.0 * numpy.pi * features[:, 0])
+        model = BayesianRidge().fit(features, values)
+        mean, std = model.predict(features)
+        assert numpy.sqrt(numpy.mean((mean - values)**2)) < 0.1
+        assert numpy.all(std > 0.0)
+        mean, std = BayesianRidge(num_features=0).fit(features, 2.0 * features[:, 0]).predict(
+            [[0.5], [3.0]])
+        assert numpy.allclose(mean, [1.0, 6.0], atol=1e-3)
+        assert std[1] > std[0]
+    
+    def test_observe(self):
+        """
+        Test for values of the results.
+        """
+        prioritizer = SurrogatePrioritizer(references={"Al": -3.0, "Cu": -4.0})
+        prioritizer.add_candidates(self.structs.items())
+        struct = self.structs["s0"]
+        fraction = struct.composition.get_atomic_fraction("Cu")
+        value = prioritizer.get_value("s0", {"total_energy": -16.0})
+        assert abs(value - (-4.0 + 3.0 + fraction)) < 1e-8
+        prioritizer.observe("s0", {"results": "Unconverged"})
+        prioritizer.observe("s1", {"total_energy": None})
+        prioritizer.observe("unknown", {"total_energy": -16.0})
+        assert prioritizer.num_observations == 0
+        assert prioritizer.rank([]) == []
+        with self.assertRaises(ValueError):
+            prioritizer.predict(["s0"])
+    
+    def test_prioritized_run(self):
+        """
+        Test for the campaign stopped when the lowest energies are found.
+        """
+        calls = []
+        
+        def calc(struct_name, struct, steps, package, n_jobs=4):
+            calls.append(struct_name)
+            return {"total_energy": self.energies[struct_name]}
+        
+        prioritizer = SurrogatePrioritizer(top_k=3, confidence=0.9)
+        calculation = PyHighThroughput(prioritizer=prioritizer, **self.structs)
+        calculation._calc = calc
+        results = calculation.run(package="none")
+        lowest = sorted(self.energies, key=self.energies.get)[:3]
+        assert sorted(name for name, value in prioritizer.get_top()) == sorted(lowest)
+        assert 0 < len(calculation.pruned) and len(calls) < len(self.structs) // 2
+        assert sorted(calls + calculation.pruned) == sorted(self.structs)
+        assert sorted(results.keys()) == sorted(calls)
+        
+        prioritizer = SurrogatePrioritizer(target=lambda prioritizer, names:
+                                           prioritizer.num_observations >= 5)
+        calculation = PyHighThroughput(prioritizer=prioritizer, **self.structs)
+        calculation._calc = calc
+        assert len(calculation.run(package="none").keys()) == 5
+        
+        # Structures of a source are parsed to be featurized and again when they are run.
+        structs = self.structs
+        loaded = []
+        
+        def load(struct_name):
+            loaded.append(struct_name)
+            return structs[struct_name]
+        
+        class Source(StructureSource):
+            def names(self):
+                return list(structs.keys())
+            
+            def ref(self, struct_name):
+                return StructureRef(load, struct_name)
+        
+        calls.clear()
+        prioritizer = SurrogatePrioritizer(top_k=3, confidence=0.9)
+        calculation = PyHighThroughput(prioritizer=prioritizer, source=Source())
+        calculation._calc = calc
+        calculation.run(package="none")
+        assert sorted(loaded) == sorted(list(self.structs) + calls)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,7 +4,10 @@
 
 from .context import model
 from model.modelgenerator import ModelGenerator
+from model.modelgenerator import supercell_scaling
+from model.modelanalyser import ModelAnalyser
 import random
+import numpy
 import unittest
 import logging
 import pymatgen
@@ -41,6 +44,92 @@ class ModelGeneratorTestSuite(unittest.TestCase):
         )
         assert str(Poscar(gen.get_struct())) == str(Poscar(struct))
     
+    def test_batch_model_generation(self):
+        """
+        Test for generating models in a batch.
+        """
+        batch = gen.generate(20, symmetrical=True, cell_min=-0.05, cell_max=0.05,
+                             random_state=0)
+        assert len(batch) == 20
+        assert batch.lattices.shape == (20, 3, 3)
+        struct = batch.get_struct(3)
+        assert abs(struct.lattice.gamma - gen.struct.lattice.gamma) < 1e-6
+        assert 0.95 <= struct.lattice.a / gen.struct.lattice.a <= 1.05
+        
+        batch = gen.generate(5, modify_shape=True, modify_atom=True, atom_modify_prob=50.0,
+                             random_state=0)
+        assert batch.frac_coords.shape == (5, gen.struct.num_sites, 3)
+        assert numpy.abs(batch.frac_coords - gen.struct.frac_coords).max() <= 0.01
+        assert batch["model3"].num_sites == gen.struct.num_sites
+    
+    def test_constrained_model_generation(self):
+        """
+        Test for generating models satisfying constraints.
+        """
+        constraints = {"a_min": 4.77, "a_max": 4.78, "gamma_min": 119.8, "gamma_max": 120.2}
+        batch = gen.generate(50, symmetrical=True, cell_min=-0.05, cell_max=0.05,
+                             constraints=constraints, random_state=0)
+        assert len(batch) == 50 and batch.acceptance_rate == 1.0
+        for struct in batch.get_structs():
+            gen.struct_dict = struct.as_dict()
+            assert gen.check_constrains(**constraints)
+        gen.reset_struct()
+        
+        batch = gen.generate(50, modify_shape=True, constraints=constraints, random_state=0)
+        parameters = batch.lattice_parameters()
+        assert len(batch) == 50 and 0.0 < batch.acceptance_rate < 1.0
+        assert numpy.all((4.77 < parameters[:, 0]) & (parameters[:, 0] < 4.78))
+        
+        with self.assertRaises(ValueError):
+            gen.generate(5, symmetrical=True, constraints={"alpha_max": 80.0})
+    
+    def test_seeded_model_generation(self):
+        """
+        Test for reproducing models from (seed, index).
+        """
+        params = {"modify_shape": True, "modify_atom": True,
+                  "constraints": {"gamma_min": 119.8, "gamma_max": 120.2}}
+        batch = gen.generate(40, seed=7, **params)
+        shard = gen.generate(10, seed=7, start=20, n_jobs=2, chunk_size=5, **params)
+        assert numpy.array_equal(batch.lattices[20:30], shard.lattices)
+        assert numpy.array_equal(batch.frac_coords[20:30], shard.frac_coords)
+        struct = gen.regenerate(*batch.get_provenance(25), **batch.generation_params)
+        assert numpy.allclose(struct.lattice.matrix, batch.lattices[25])
+        assert numpy.allclose(struct.frac_coords, batch.frac_coords[25])
+    
+    def test_swap_engine(self):
+        """
+        Test for swapping species without duplicated configurations.
+        """
+        struct = gen.struct.copy()
+        struct.replace(0, "Fe")
+        struct.replace(1, "Fe")
+        engine = ModelGenerator(struct).get_swap_engine(restrict=True, random_state=0)
+        occupancies = engine.generate(100, swap_num=1, max_trials=1000)
+        # Two Fe atoms and one Al atom can be swapped in 2 * 10 ways.
+        assert len(occupancies) == 20
+        assert len(set(occupancy.tobytes() for occupancy in occupancies)) == 20
+        batch = engine.generate_batch(3, swap_num=5)
+        for model in batch.get_structs():
+            assert model.composition == struct.composition
+            assert [str(specie) for specie in model.species[-18:]] == ["O"] * 18
+    
+    def test_supercell(self):
+        """
+        Test for the smallest supercell reaching the number of atoms and image distance.
+        """
+        lattice = numpy.diag([3.0, 4.0, 5.0])
+        assert supercell_scaling(lattice, 2, num=30) == (4, 2, 2)
+        assert supercell_scaling(lattice, 2, num=30, tolerance=0.0) == (5, 3, 1)
+        hexagonal = pymatgen.Lattice.hexagonal(4.76, 12.99).matrix
+        assert supercell_scaling(hexagonal, 30, num=1000) == (6, 6, 1)
+        assert supercell_scaling(lattice, 2, min_image_distance=9.0) == (3, 3, 2)
+        assert supercell_scaling(lattice, 30, num=10) == (1, 1, 1)
+        generator = ModelGenerator(gen.struct.copy())
+        assert generator.make_enough_large_supercell(num=60) is True
+        assert generator.struct.num_sites == len(generator.struct_dict["sites"]) == 60
+        assert generator.make_enough_large_supercell(num=60) is False
+    
     # Never passed, yet.
     def test_unsymmetric_model_generation(self):
         """
@@ -54,5 +143,49 @@ class ModelGeneratorTestSuite(unittest.TestCase):
         assert str(Poscar(gen.get_struct())) == str(Poscar(struct))
     
 
+class ModelAnalyserTestSuite(unittest.TestCase):
+    """
+    Test for modelanalyser.py
+    """
+    
+    def test_periodic_metrics(self):
+        """
+        Test for minimum image metrics and pairwise metrics.
+        """
+        struct = gen.struct.copy()
+        wrapped = struct.copy()
+        wrapped.translate_sites([0], [-0.999, 0.0, 0.0], frac_coords=True, to_unit_cell=False)
+        analyser = ModelAnalyser({"struct": struct, "wrapped": wrapped}, struct_stable=struct)
+        assert analyser.calc_euclid_metric()["wrapped"] > 0.99
+        assert abs(analyser.calc_euclid_metric(periodic=True)["wrapped"] - 0.001) < 1e-8
+        
+        batch = gen.generate(30, modify_shape=True, modify_atom=True, random_state=0)
+        analyser = ModelAnalyser(batch, struct_stable=struct)
+        names, matrix = analyser.calc_pairwise_metric(metric="euclid", chunk_size=7)
+        metrics = analyser.calc_euclid_metric(periodic=True)
+        reference = ModelAnalyser({"reference": struct}, struct_stable=batch.get_struct(4))
+        assert abs(reference.calc_euclid_metric(periodic=True)["reference"] -
+                   metrics[names[4]]) < 1e-8
+        assert numpy.allclose(matrix, matrix.T) and numpy.allclose(numpy.diag(matrix), 0.0)
+        names, chord = analyser.calc_pairwise_metric(metric="chord", chunk_size=7)
+        assert numpy.allclose(chord, chord.T, atol=1e-6)
+    
+    def test_fingerprint_index(self):
+        """
+        Test for nearest-neighbour search by fingerprints.
+        """
+        batch = gen.generate(20, modify_shape=True, modify_atom=True, random_state=0)
+        analyser = ModelAnalyser(batch, struct_stable=gen.struct)
+        names, fingerprints = analyser.calc_fingerprints(nbins=16)
+        index = analyser.build_index(nbins=16)
+        found, distances = index.query(fingerprints[[3, 11]], k=2)
+        assert [row[0] for row in found] == [names[3], names[11]]
+        assert numpy.allclose(distances[:, 0], 0.0, atol=1e-3)
+        assert numpy.all(distances[:, 1] >= distances[:, 0])
+        index.add(["copy"], fingerprints[5])
+        assert index.query_radius(fingerprints[5], 1e-3)[0] == [names[5], "copy"]
+        assert index.query(fingerprints[5], k=2, chunk_size=4)[0][0] == [names[5], "copy"]
+    
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,319 @@
+# coding: utf-8
+# Copyright (c) 2018-2019, Taku MURAKAMI. All rights reserved.
+# Distributed under the terms of the BSD 3-clause License.
+
+from .context import model
+from pythroughput.outputs.resulttable import ResultTable
+from pythroughput.outputs.trajectorystore import TrajectoryStore
+from pythroughput.outputs.manifest import Manifest
+from pythroughput.outputs.manifest import shard_path
+from pythroughput.outputs.telemetry import CampaignTelemetry
+from pythroughput.core.calculation import PyHighThroughput
+from pythroughput.core.geometry import GeometryFilter
+import pymatgen
+import os
+import json
+import unittest
+import logging
+import numpy
+import tempfile
+import shutil
+import threading
+
+"""
+Test for outputs package.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class ResultTableTestSuite(unittest.TestCase):
+    """
+    Test for resulttable.py
+    """
+    
+    def test_round_trip(self):
+        """
+        Test for storing and reading results like dict.
+        """
+        results = ResultTable(capacity=1)
+        forces = [[0.1, 0.2, 0.3], [-0.1, -0.2, -0.3]]
+        for i in range(5):
+            results["struct"+str(i)] = {"struct_name": "struct"+str(i),
+                                        "total_energy": -1.5 * i,
+                                        "final_forces": forces,
+                                        "formula": "Al1 O1"}
+        results["unconverged"] = {"results": "Unconverged"}
+        assert len(results) == 6
+        assert results["struct3"]["total_energy"] == -4.5
+        assert results["struct3"]["formula"] == "Al1 O1"
+        assert results["struct3"]["final_forces"].tolist() == forces
+        assert results["unconverged"]["results"] == "Unconverged"
+        assert list(results["struct0"].keys()) == [
+            "struct_name", "total_energy", "final_forces", "formula"]
+        assert "results" not in results["struct0"]
+    
+    def test_view_assignment(self):
+        """
+        Test for updating results through views.
+        """
+        results = ResultTable()
+        results["struct"] = {"total_energy": -2.0, "steps": 3}
+        results["struct"]["atomization_energy"] = -1.0
+        results["struct"]["total_energy"] = "Unconverged"
+        assert results["struct"]["atomization_energy"] == -1.0
+        assert results["struct"]["total_energy"] == "Unconverged"
+        assert results["struct"]["steps"] == 3
+        assert numpy.isnan(results.column("total_energy")[0])
+        assert results.to_dict() == {"struct": {"total_energy": "Unconverged",
+                                                "steps": 3,
+                                                "atomization_energy": -1.0}}
+        
+        # The view of the row is assigned to the row itself.
+        results["forces"] = {"final_forces": numpy.ones((2, 3)), "steps": 2}
+        results["forces"] = results["forces"]
+        results["struct"] = results["struct"]
+        assert results["forces"]["steps"] == 2
+        assert numpy.array_equal(results["forces"]["final_forces"], numpy.ones((2, 3)))
+        assert results["struct"].to_dict() == {"total_energy": "Unconverged", "steps": 3,
+                                               "atomization_energy": -1.0}
+
+    
+
+class TrajectoryStoreTestSuite(unittest.TestCase):
+    """
+    Test for trajectorystore.py
+    """
+    
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.path)
+    
+    def test_append_and_reload(self):
+        """
+        Test for appending trajectories and reading them as memory-mapped views.
+        """
+        store = TrajectoryStore(self.path)
+        rng = numpy.random.RandomState(0)
+        trajectories = {}
+        for name, nsteps, natoms in (("a", 3, 2), ("b", 1, 4), ("a", 2, 2)):
+            trajectories[name] = {"numbers": rng.randint(1, 90, natoms),
+                                  "energies": rng.rand(nsteps),
+                                  "lattices": rng.rand(nsteps, 3, 3),
+                                  "positions": rng.rand(nsteps, natoms, 3),
+                                  "forces": rng.rand(nsteps, natoms, 3)}
+            store.append(name, **trajectories[name])
+        
+        store = TrajectoryStore(self.path)
+        assert store.names() == ["a", "b"]
+        for name, trajectory in trajectories.items():
+            stored = store.get(name)
+            assert not stored["forces"].flags.writeable
+            for key, value in trajectory.items():
+                assert numpy.array_equal(stored[key], value)
+            assert numpy.all(numpy.isnan(stored["stresses"]))
+        assert store.get_all("energies").shape == (6,)
+        with self.assertRaises(ValueError):
+            store.append("c", [1], [0.0], numpy.eye(3)[numpy.newaxis], [[[0, 0, 0]]], [[0, 0]])
+    
+    def test_interrupted_and_concurrent_append(self):
+        """
+        Test for trajectories interrupted while writing and appended from threads.
+        """
+        def trajectory(i, nsteps=2, natoms=3):
+            return {"numbers": [i + 1] * natoms,
+                    "energies": [float(i)] * nsteps,
+                    "lattices": numpy.full((nsteps, 3, 3), float(i)),
+                    "positions": numpy.full((nsteps, natoms, 3), float(i)),
+                    "forces": numpy.full((nsteps, natoms, 3), float(i))}
+        
+        store = TrajectoryStore(self.path)
+        store.append("a", **trajectory(0))
+        # Partial arrays and an index row without its name.
+        with open(os.path.join(self.path, "lattices.f64"), mode="ab") as file:
+            file.write(numpy.zeros(5).tobytes())
+        with open(os.path.join(self.path, "index.i64"), mode="ab") as file:
+            file.write(numpy.array([2, 2, 3, 3, 6], dtype=numpy.int64).tobytes())
+        store = TrajectoryStore(self.path)
+        assert store.names() == ["a"]
+        assert os.path.getsize(os.path.join(self.path, "lattices.f64")) == 2 * 72
+        
+        threads = [threading.Thread(target=store.append, args=("s{}".format(i),),
+                                    kwargs=trajectory(i + 1)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        store = TrajectoryStore(self.path)
+        assert len(store) == 9
+        for i in range(8):
+            stored = store.get("s{}".format(i))
+            assert numpy.all(stored["lattices"] == i + 1)
+            assert numpy.all(stored["forces"] == i + 1)
+            assert numpy.all(stored["numbers"] == i + 2)
+
+
+
+class ManifestTestSuite(unittest.TestCase):
+    """
+    Test for manifest.py
+    """
+    
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.path)
+    
+    def test_record_and_reload(self):
+        """
+        Test for the latest records of structures and broken lines.
+        """
+        path = os.path.join(self.path, "manifest.jsonl")
+        manifest = Manifest(path)
+        manifest.record("a", "out/a", {"results": "Unconverged"})
+        entry = manifest.record("b", "out/b", {"total_energy": -1.0,
+                                               "final_forces": numpy.zeros((2, 3))})
+        manifest.record("a", "out/a", {"total_energy": -2.0})
+        with open(path, mode="a") as file:
+            file.write('{"struct_name": "c", "pa')
+        
+        manifest = Manifest(path)
+        assert manifest.names() == ["a", "b"]
+        assert manifest.names(status="done") == ["a", "b"]
+        assert manifest.get("b")["digest"] == entry["digest"]
+        manifest.record("c", None, {"results": "Invalid geometry"})
+        manifest.compact()
+        manifest = Manifest(path)
+        assert len(manifest) == 3
+        assert manifest.get("c")["status"] == "invalid"
+        assert not manifest.is_done("c")
+    
+    def test_sharded_layout(self):
+        """
+        Test for hash-prefix directories and recording of calculations.
+        """
+        path = shard_path(self.path, "Al4")
+        assert path == shard_path(self.path, "Al4")
+        assert os.path.relpath(path, self.path).split(os.sep)[2] == "Al4"
+        assert len(os.path.relpath(path, self.path).split(os.sep)[0]) == 2
+        
+        struct = pymatgen.Structure(pymatgen.Lattice.cubic(4.0), ["Al", "Al"],
+                                    [[0, 0, 0], [0.01, 0, 0]])
+        calculation = PyHighThroughput(output_path=self.path + "/", shard=True,
+                                       geometry_filter=GeometryFilter(), Al2=struct)
+        calculation.run(package="vasp")
+        manifest = Manifest(os.path.join(self.path, "manifest.jsonl"))
+        assert manifest.get("Al2")["status"] == "invalid"
+        assert calculation._set_default_calculator("Al2", struct)["txt"] == \
+            shard_path(self.path + "/", "Al2") + ".txt"
+    
+    def test_resume(self):
+        """
+        Test for resume, which calculates again the structures without staged outputs.
+        """
+        struct = pymatgen.Structure(pymatgen.Lattice.cubic(4.05), ["Al"], [[0, 0, 0]])
+        calls = []
+        
+        def calc(struct_name, struct, steps, package, n_jobs=4):
+            calls.append(struct_name)
+            return {"total_energy": -3.7}
+        
+        for package in ("vasp", "gpaw"):
+            calculation = PyHighThroughput(output_path=self.path + "/", shard=True, Al=struct)
+            calculation._calc = calc
+            calculation.run(package=package)
+            assert calculation.manifest.is_done("Al")
+            # Output files of the stand-in calculation are never staged.
+            results = calculation.run(package=package, resume=True)
+            assert results["Al"]["total_energy"] == -3.7
+        assert calls == ["Al"] * 4
+
+
+class CampaignTelemetryTestSuite(unittest.TestCase):
+    """
+    Test for telemetry.py
+    """
+    
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.path)
+    
+    def test_metrics(self):
+        """
+        Test for metrics written to the Prometheus textfile and the JSON status file.
+        """
+        telemetry = CampaignTelemetry(os.path.join(self.path, "pythroughput.prom"),
+                                      os.path.join(self.path, "status.json"),
+                                      cores_per_job=4, interval=None, labels={"campaign": "Al"})
+        telemetry.start(num_jobs=4)
+        telemetry.job_started("a")
+        telemetry.job_finished("a", {"total_energy": -1.0},
+                               {"scf_iterations": 20, "ionic_steps": 2})
+        telemetry.job_started("b")
+        telemetry.job_finished("b", {"total_energy": "Unconverged"},
+                               {"scf_iterations": 40, "ionic_steps": 1})
+        telemetry.job_started("c")
+        metrics = telemetry.get_metrics()
+        assert metrics["jobs_finished"] == 2
+        assert metrics["jobs_running"] == 1
+        assert metrics["queue_depth"] == 1
+        assert metrics["mean_scf_iterations"] == 30.0
+        assert metrics["unconverged_rate"] == 0.5
+        assert metrics["eta_seconds"] is not None
+        
+        with open(os.path.join(self.path, "status.json")) as file:
+            status = json.load(file)
+        assert status["jobs_finished"] == 2
+        with open(os.path.join(self.path, "pythroughput.prom")) as file:
+            textfile = file.read()
+        assert "# TYPE pythroughput_jobs_finished counter" in textfile
+        assert 'pythroughput_jobs_finished{campaign="Al"} 2.0' in textfile
+    
+    def test_concurrent_write(self):
+        """
+        Test for rewriting the files from the background thread and the calculation
+        at the same time, and errors in writing them, which are not raised.
+        """
+        telemetry = CampaignTelemetry(os.path.join(self.path, "pythroughput.prom"),
+                                      os.path.join(self.path, "status.json"), interval=0.0001)
+        telemetry.start(num_jobs=300)
+        for i in range(300):
+            telemetry.job_started(str(i))
+            telemetry.job_finished(str(i), {"total_energy": -1.0})
+        telemetry.stop()
+        assert sorted(os.listdir(self.path)) == ["pythroughput.prom", "status.json"]
+        with open(os.path.join(self.path, "status.json")) as file:
+            assert json.load(file)["jobs_finished"] == 300
+        
+        telemetry = CampaignTelemetry(os.path.join(self.path, "none", "pythroughput.prom"),
+                                      interval=None)
+        telemetry.start(num_jobs=1)
+        telemetry.job_finished("a", {"total_energy": -1.0})
+        telemetry.stop()
+    
+    def test_campaign(self):
+        """
+        Test for telemetry of run().
+        """
+        struct = pymatgen.Structure(pymatgen.Lattice.cubic(4.0), ["Al", "Al"],
+                                    [[0, 0, 0], [0.01, 0, 0]])
+        status_path = os.path.join(self.path, "status.json")
+        telemetry = CampaignTelemetry(status_path=status_path, interval=0.01)
+        valid = pymatgen.Structure(pymatgen.Lattice.cubic(4.05), ["Al"], [[0, 0, 0]])
+        calculation = PyHighThroughput(geometry_filter=GeometryFilter(), telemetry=telemetry,
+                                       Al2=struct, Al=valid)
+        calculation.run(package="none")
+        with open(status_path) as file:
+            status = json.load(file)
+        assert status["jobs_total"] == 2
+        assert status["jobs_invalid"] == 1
+        assert status["jobs_failed"] == 1
+        assert status["running"] == []
+
+if __name__ == "__main__":
+    unittest.main()